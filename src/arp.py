@@ -2,106 +2,881 @@
 
 import time
 import logging
+import re
 import subprocess
 import threading
 import shlex
 import sys
+import os
+import socket
+import struct
+import collections
+import heapq
+import numbers
+
+DEFAULT_ARP_COMMAND = '/usr/sbin/arp -a'
+
+# a single entry from the neighbor table; state is a NUD state name or None
+NeighborEntry = collections.namedtuple('NeighborEntry', ['ip', 'mac', 'iface', 'state'])
+
+# changes to the ARP table from a single refresh (lists of addresses)
+ArpDiff = collections.namedtuple('ArpDiff', ['arrived', 'departed', 'changed', 'expired'])
+
+# neighbor states that do not mean a device has been seen recently; NOARP
+# entries are multicast, broadcast and loopback addresses
+INACTIVE_STATES = ('INCOMPLETE', 'FAILED', 'NOARP')
+
+# neighbor states that mean the kernel could not resolve the address; these
+# entries usually have no MAC address
+UNRESOLVED_STATES = ('INCOMPLETE', 'FAILED')
+
+# netlink constants from linux/netlink.h, linux/rtnetlink.h & linux/neighbour.h
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+NLM_F_REQUEST = 0x01
+NLM_F_DUMP = 0x300
+RTM_NEWNEIGH = 28
+RTM_DELNEIGH = 29
+RTM_GETNEIGH = 30
+NDA_DST = 1
+NDA_LLADDR = 2
+RTMGRP_NEIGH = 0x04
+
+NUD_STATES = collections.OrderedDict([
+    (0x01, 'INCOMPLETE'), (0x02, 'REACHABLE'), (0x04, 'STALE'), (0x08, 'DELAY'),
+    (0x10, 'PROBE'), (0x20, 'FAILED'), (0x40, 'NOARP'), (0x80, 'PERMANENT')
+])
+
+_NLMSGHDR = struct.Struct('=LHHLL')
+_NDMSG = struct.Struct('=BBHiHBB')
+_RTATTR = struct.Struct('=HH')
+
+# padded, colon-separated addresses can be converted directly
+_MAC_CANONICAL = re.compile(r'^[0-9a-fA-F]{2}(?::[0-9a-fA-F]{2}){5}$')
+_MAC_ADDRESS = re.compile(r'^\s*' + r'[:-]'.join([ r'([0-9a-fA-F]{1,2})' ] * 6) + r'\s*$')
+
+#-------------------------------------------------------------------------------
+def _align(length): return (length + 3) & ~3
+
+#-------------------------------------------------------------------------------
+# convert a MAC address to a 48-bit integer; octets do not need to be padded
+# (macOS arp does not pad them), returns None if the address is not valid
+def parseMacAddress(address):
+    if isinstance(address, numbers.Integral):
+        return address if 0 <= address < (1 << 48) else None
+
+    if not isinstance(address, basestring): return None
+
+    if _MAC_CANONICAL.match(address):
+        return int(address.replace(':', ''), 16)
+
+    match = _MAC_ADDRESS.match(address)
+    if match is None: return None
+
+    value = 0
+    for octet in match.groups():
+        value = (value << 8) | int(octet, 16)
+
+    return value
+
+#-------------------------------------------------------------------------------
+def formatMacAddress(value):
+    octets = [ (value >> shift) & 0xFF for shift in range(40, -8, -8) ]
+    return ':'.join([ '%02x' % octet for octet in octets ])
+
+#-------------------------------------------------------------------------------
+# neighbor table formats; incomplete entries have no hardware address, so they
+# are returned with a state of INCOMPLETE (or FAILED) and no MAC address
+
+_MAC = r'[0-9A-Fa-f]{1,2}(?::[0-9A-Fa-f]{1,2}){5}'
+
+# `arp -a` / `arp -an` on macOS, linux (net-tools) and busybox:
+#   ? (10.0.0.1) at 30:2a:43:b2:1:2f on en0 ifscope [ethernet]
+#   ? (10.0.0.1) at 30:2a:43:b2:01:2f [ether] PERM on eth0
+#   ? (10.0.0.5) at (incomplete) on en0 ifscope [ethernet]
+_ARP_FORMAT = re.compile(
+    r'^\S+[ \t]+\((?P<ip>[^)\s]+)\)[ \t]+at[ \t]+'
+    r'(?:(?P<mac>' + _MAC + r')|(?P<incomplete>[(<]incomplete[)>]))'
+    r'(?:[ \t]+\[\w+\])?(?P<perm>[ \t]+PERM)?[ \t]+on[ \t]+(?P<iface>\S+)(?P<rest>[^\n]*)',
+    re.MULTILINE
+)
+
+# `ip neigh` on linux:
+#   10.0.0.1 dev eth0 lladdr 30:2a:43:b2:01:2f router REACHABLE
+#   10.0.0.5 dev eth0  FAILED
+_IP_NEIGH_FORMAT = re.compile(
+    r'^(?P<ip>[0-9A-Fa-f.:]+)[ \t]+dev[ \t]+(?P<iface>\S+)'
+    r'(?:[ \t]+lladdr[ \t]+(?P<mac>' + _MAC + r')\b)?(?P<rest>[^\n]*)',
+    re.MULTILINE
+)
+
+# /proc/net/arp on linux:
+#   10.0.0.1         0x1         0x2         30:2a:43:b2:01:2f     *        eth0
+_PROC_NET_ARP_FORMAT = re.compile(
+    r'^(?P<ip>[0-9.]+)[ \t]+0x[0-9A-Fa-f]+[ \t]+(?P<flags>0x[0-9A-Fa-f]+)[ \t]+(?P<mac>' + _MAC + r')'
+    r'[ \t]+\S+[ \t]+(?P<iface>\S+)',
+    re.MULTILINE
+)
+
+# flags from linux/if_arp.h
+ATF_COM = 0x02
+ATF_PERM = 0x04
+
+#-------------------------------------------------------------------------------
+def _buildArpEntries(data):
+    for match in _ARP_FORMAT.finditer(data):
+        ip, mac, perm, iface, rest = match.group('ip', 'mac', 'perm', 'iface', 'rest')
+
+        if match.group('incomplete'):
+            state = 'INCOMPLETE'
+        elif perm or 'permanent' in rest:
+            state = 'PERMANENT'
+        else:
+            state = None
+
+        yield NeighborEntry(ip, mac, iface, state)
+
+#-------------------------------------------------------------------------------
+def _buildIpNeighEntries(data):
+    for match in _IP_NEIGH_FORMAT.finditer(data):
+        ip, iface, mac, rest = match.group('ip', 'iface', 'mac', 'rest')
+
+        # the state is the last word, after any flags such as 'router'
+        words = rest.split()
+        state = words[-1] if (len(words) > 0 and words[-1].isupper()) else None
+
+        # only unresolved entries are expected without an address
+        if mac is None and state not in UNRESOLVED_STATES: continue
+
+        yield NeighborEntry(ip, mac, iface, state)
+
+#-------------------------------------------------------------------------------
+def _buildProcNetArpEntries(data):
+    for match in _PROC_NET_ARP_FORMAT.finditer(data):
+        ip, flags, mac, iface = match.group('ip', 'flags', 'mac', 'iface')
+        flags = int(flags, 16)
+
+        if flags & ATF_PERM:
+            state = 'PERMANENT'
+        elif flags & ATF_COM:
+            state = 'REACHABLE'
+        else:
+            mac = None
+            state = 'INCOMPLETE'
+
+        yield NeighborEntry(ip, mac, iface, state)
+
+# format name -> (pattern, entry builder)
+TABLE_FORMATS = collections.OrderedDict([
+    ('proc', (_PROC_NET_ARP_FORMAT, _buildProcNetArpEntries)),
+    ('ip', (_IP_NEIGH_FORMAT, _buildIpNeighEntries)),
+    ('arp', (_ARP_FORMAT, _buildArpEntries))
+])
+
+#-------------------------------------------------------------------------------
+# guess the table format from the first entry found; returns None if unknown
+def detectTableFormat(data):
+
+    # a sample is enough unless the output starts with a long banner
+    for sample in (data[:4096], data):
+        for name, (pattern, builder) in TABLE_FORMATS.items():
+            if pattern.search(sample): return name
+
+        if len(sample) == len(data): break
+
+    return None
+
+#-------------------------------------------------------------------------------
+# parse a complete neighbor table in a single pass; yields NeighborEntry
+def parseNeighborTable(data, tableFormat=None):
+    if tableFormat is None: tableFormat = detectTableFormat(data)
+    if tableFormat is None: return iter(())
+
+    pattern, builder = TABLE_FORMATS[tableFormat]
+
+    return builder(data)
+
+#-------------------------------------------------------------------------------
+# read a single line of neighbor table output; returns a NeighborEntry or None
+def parseArpLine(line):
+    return next(parseNeighborTable(line), None)
+
+#-------------------------------------------------------------------------------
+# look up interface names by index using sysfs
+def _getInterfaceNames():
+    names = dict()
+
+    try:
+        for name in os.listdir('/sys/class/net'):
+            with open(os.path.join('/sys/class/net', name, 'ifindex')) as fp:
+                names[int(fp.read())] = name
+    except (IOError, OSError, ValueError):
+        pass
+
+    return names
+
+#-------------------------------------------------------------------------------
+# parse a buffer of netlink messages; yields (msgType, NeighborEntry) for each
+# neighbor message and (msgType, None) for anything else
+def parseNeighborMessages(data, ifnames=None):
+    if ifnames is None: ifnames = dict()
+    offset = 0
+
+    while offset + _NLMSGHDR.size <= len(data):
+        msgLen, msgType, flags, seq, pid = _NLMSGHDR.unpack_from(data, offset)
+        if msgLen < _NLMSGHDR.size: break
+
+        body = offset + _NLMSGHDR.size
+        end = offset + msgLen
+        offset += _align(msgLen)
+
+        if msgType not in (RTM_NEWNEIGH, RTM_DELNEIGH):
+            yield (msgType, None)
+            continue
+
+        family, pad1, pad2, ifindex, nud, ndflags, ndtype = _NDMSG.unpack_from(data, body)
+
+        ip = mac = None
+        attr = body + _NDMSG.size
+
+        while attr + _RTATTR.size <= end:
+            attrLen, attrType = _RTATTR.unpack_from(data, attr)
+            if attrLen < _RTATTR.size: break
+
+            value = data[attr + _RTATTR.size : attr + attrLen]
+
+            if attrType == NDA_DST:
+                ip = socket.inet_ntop(family, value)
+            elif attrType == NDA_LLADDR:
+                mac = ':'.join([ '%02x' % byte for byte in bytearray(value) ])
+
+            attr += _align(attrLen)
+
+        state = None
+
+        for bit, name in NUD_STATES.items():
+            if nud & bit:
+                state = name
+                break
+
+        iface = ifnames.get(ifindex, str(ifindex))
+
+        yield (msgType, NeighborEntry(ip, mac, iface, state))
+
+################################################################################
+# base class for reading the current neighbor table
+class NeighborSource():
+
+    #---------------------------------------------------------------------------
+    # returns a list of NeighborEntry objects or None if the table is not available
+    def getEntries(self): raise NotImplementedError()
+
+################################################################################
+# runs a local command, such as `arp -a`, and parses the output
+class CommandSource(NeighborSource):
+
+    # seconds before a command that has not finished is killed
+    timeout = 10
+
+    #---------------------------------------------------------------------------
+    def __init__(self, cmd=DEFAULT_ARP_COMMAND):
+        self.logger = logging.getLogger('Plugin.arp.CommandSource')
+        self.cmd = cmd
+
+    #---------------------------------------------------------------------------
+    def getRawOutput(self):
+        cmd = shlex.split(self.cmd)
+        self.logger.debug('exec: %s', cmd)
+
+        try:
+            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        except:
+            return None
+
+        # a hung command would stall the refresh; kill it after the timeout
+        timer = threading.Timer(self.timeout, self._kill, (proc,))
+        timer.daemon = True
+        timer.start()
+
+        pout, perr = proc.communicate()
+        timer.cancel()
+
+        if proc.returncode < 0:
+            self.logger.warn(u'command did not finish: %s', self.cmd)
+            return None
+
+        return pout
+
+    #---------------------------------------------------------------------------
+    def _kill(self, proc):
+        try:
+            proc.kill()
+        except OSError:
+            pass
+
+    #---------------------------------------------------------------------------
+    def getEntries(self):
+        rawOutput = self.getRawOutput()
+        if rawOutput is None: return None
+
+        self.logger.debug('read %d bytes from command', len(rawOutput))
+
+        return list(parseNeighborTable(rawOutput))
+
+################################################################################
+# reads the kernel ARP table directly on linux
+class ProcNetArpSource(NeighborSource):
+
+    path = '/proc/net/arp'
+
+    #---------------------------------------------------------------------------
+    def __init__(self, path=None):
+        self.logger = logging.getLogger('Plugin.arp.ProcNetArpSource')
+        if path is not None: self.path = path
+
+    #---------------------------------------------------------------------------
+    def getEntries(self):
+        try:
+            with open(self.path) as fp:
+                data = fp.read()
+        except (IOError, OSError) as e:
+            self.logger.warn('cannot read %s - %s', self.path, str(e))
+            return None
+
+        return list(parseNeighborTable(data, 'proc'))
+
+################################################################################
+# dumps the kernel neighbor table using rtnetlink on linux
+class NetlinkSource(NeighborSource):
+
+    #---------------------------------------------------------------------------
+    def __init__(self, family=socket.AF_UNSPEC):
+        self.logger = logging.getLogger('Plugin.arp.NetlinkSource')
+        self.family = family
+        self.seq = 0
+
+    #---------------------------------------------------------------------------
+    @staticmethod
+    def isSupported():
+        if not hasattr(socket, 'AF_NETLINK'): return False
+
+        try:
+            sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, 0)
+            sock.close()
+        except socket.error:
+            return False
+
+        return True
+
+    #---------------------------------------------------------------------------
+    def getEntries(self):
+        self.seq += 1
+
+        ndmsg = _NDMSG.pack(self.family, 0, 0, 0, 0, 0, 0)
+        header = _NLMSGHDR.pack(_NLMSGHDR.size + len(ndmsg), RTM_GETNEIGH,
+                                NLM_F_REQUEST | NLM_F_DUMP, self.seq, 0)
+
+        try:
+            sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, 0)
+        except socket.error as e:
+            self.logger.warn('cannot open netlink socket - %s', str(e))
+            return None
+
+        entries = list()
+        ifnames = _getInterfaceNames()
+
+        try:
+            sock.settimeout(5)
+            sock.sendto(header + ndmsg, (0, 0))
+
+            done = False
+
+            while not done:
+                data = sock.recv(65536)
+                if len(data) == 0: break
+
+                for msgType, entry in parseNeighborMessages(data, ifnames):
+                    if msgType in (NLMSG_DONE, NLMSG_ERROR):
+                        done = True
+                    elif msgType == RTM_NEWNEIGH and (entry.mac is not None or
+                                                      entry.state in UNRESOLVED_STATES):
+                        entries.append(entry)
+
+        except socket.error as e:
+            self.logger.warn('netlink dump failed - %s', str(e))
+            entries = None
+
+        sock.close()
+
+        return entries
+
+################################################################################
+# listens for neighbor changes from the kernel and applies them to an ArpCache
+# as they happen; the regular refresh is still used to catch missed events
+class NeighborListener():
+
+    #---------------------------------------------------------------------------
+    # sock may be any object with recv(), e.g. to replay recorded messages
+    def __init__(self, cache, sock=None):
+        self.logger = logging.getLogger('Plugin.arp.NeighborListener')
+
+        self.cache = cache
+        self.sock = sock
+        self.thread = None
+        self.running = False
+
+    #---------------------------------------------------------------------------
+    def isRunning(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    #---------------------------------------------------------------------------
+    def start(self):
+        if self.isRunning(): return True
+
+        if self.sock is None:
+            try:
+                sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, 0)
+                sock.bind((0, RTMGRP_NEIGH))
+                sock.settimeout(1)
+            except (socket.error, AttributeError) as e:
+                self.logger.warn('cannot listen for neighbor events - %s', str(e))
+                return False
+
+            self.sock = sock
+
+        self.logger.debug('listening for neighbor events')
+
+        self.running = True
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+        return True
+
+    #---------------------------------------------------------------------------
+    def stop(self):
+        self.running = False
+
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+        if self.sock is not None and hasattr(self.sock, 'close'):
+            self.sock.close()
+
+        self.sock = None
+
+    #---------------------------------------------------------------------------
+    def _run(self):
+        ifnames = _getInterfaceNames()
+
+        while self.running:
+            try:
+                data = self.sock.recv(65536)
+            except socket.timeout:
+                continue
+            except socket.error as e:
+                self.logger.warn('neighbor listener failed - %s', str(e))
+                break
+
+            # an empty read means the feed has closed
+            if not data: break
+
+            for msgType, entry in parseNeighborMessages(data, ifnames):
+                if entry is not None:
+                    self.cache.applyNeighborEvent(msgType, entry)
+
+        self.running = False
+        self.logger.debug('neighbor listener stopped')
+
+#-------------------------------------------------------------------------------
+# create a neighbor source by name; 'auto' uses the arp command on macOS and
+# the kernel table on linux, unless a custom command has been configured
+def createSource(kind='auto', cmd=DEFAULT_ARP_COMMAND):
+    if kind == 'netlink':
+        return NetlinkSource()
+
+    if kind == 'proc':
+        return ProcNetArpSource()
+
+    if cmd is None:
+        return None
+
+    if kind == 'auto' and cmd == DEFAULT_ARP_COMMAND and sys.platform.startswith('linux'):
+        if NetlinkSource.isSupported():
+            return NetlinkSource()
+        if os.path.exists(ProcNetArpSource.path):
+            return ProcNetArpSource()
+
+    return CommandSource(cmd)
 
 ################################################################################
+# the table of recently seen devices; readers never take a lock - bulk updates
+# build a new table and publish it with a single reference swap, and single
+# updates are applied to the published table one key at a time
+#
+# devices that are in the neighbor table right now are kept in `present` (with
+# a tuple of their entries, since one device may have several addresses) and
+# share the time of the last refresh; `cache` holds the last seen time for
+# devices that have left the table (or were added one at a time) until they
+# expire - an address is never in both
 class ArpCache():
 
     cmdLock = None
     cacheLock = None
 
     cache = None
+    current = None
+    expiry = None
     timeout = 0
     arp_cmd = None
+    source = None
+    sourceType = 'auto'
 
     #---------------------------------------------------------------------------
-    def __init__(self, timeout=5, cmd='/usr/sbin/arp -a'):
+    def __init__(self, timeout=5, cmd=DEFAULT_ARP_COMMAND, source='auto'):
         self.logger = logging.getLogger('Plugin.arp.ArpCache')
         self.cmdLock = threading.Lock()
         self.cacheLock = threading.RLock()
         self.cache = dict()
 
-        self.updateProps(timeout=timeout, cmd=cmd)
+        # (present, tstamp) from the last refresh, published as a single value
+        self.current = (dict(), None)
+
+        # raw entries from the last refresh, used to find what changed
+        self.lastEntries = set()
+        self.lastDiff = ArpDiff([], [], [], [])
+
+        # addr -> list of callbacks for devices waiting on presence changes
+        self.subscribers = dict()
+
+        # IP address -> time the kernel last failed to resolve it; cleared as
+        # soon as the address is seen again
+        self.unreachable = dict()
+
+        # min-heap of (timestamp, addr) used to find expired entries without
+        # scanning the whole table; entries that have since been updated or
+        # removed are skipped when they reach the top of the heap
+        self.expiry = list()
+
+        self.updateProps(timeout=timeout, cmd=cmd, source=source)
 
     #---------------------------------------------------------------------------
-    def __len__(self): return len(self.cache)
-    def __getitem__(self, key): return self.cache.get(key)
-    def __setitem__(self, key, value): self.cache[key] = value
-    def __delitem__(self, key): self.cache.pop(key, None)
+    def __len__(self): return len(self.current[0]) + len(self.cache)
+    def __getitem__(self, key): return self._getTimestamp(self._getKey(key))
+    def __setitem__(self, key, value): self._touch(self._getKey(key), value)
+    def __delitem__(self, key): self.cache.pop(self._getKey(key), None)
 
     #---------------------------------------------------------------------------
-    def _normalizeAddress(self, address):
-        addr = address.lower().strip()
+    # callback(active) is called whenever the address becomes active or expires
+    def subscribe(self, address, callback):
+        addr = self._getKey(address)
+
+        self.cacheLock.acquire()
+        self.subscribers.setdefault(addr, list()).append(callback)
+        self.cacheLock.release()
+
+    #---------------------------------------------------------------------------
+    def unsubscribe(self, address, callback):
+        addr = self._getKey(address)
+
+        self.cacheLock.acquire()
+
+        callbacks = self.subscribers.get(addr, list())
+        if callback in callbacks: callbacks.remove(callback)
+        if len(callbacks) == 0: self.subscribers.pop(addr, None)
+
+        self.cacheLock.release()
+
+    #---------------------------------------------------------------------------
+    # tell subscribers about presence changes; this is called after the lock
+    # is released so callbacks are free to query the cache
+    def _notify(self, addrs, active):
+        for addr in addrs:
+            for callback in list(self.subscribers.get(addr, list())):
+                try:
+                    callback(active)
+                except Exception as e:
+                    self.logger.error('subscriber for %s failed - %s', addr, str(e))
+
+    #---------------------------------------------------------------------------
+    # true if the address has been seen and has not expired
+    def _isCurrent(self, addr):
+        return (self._isExpired(self._getTimestamp(addr)) is False)
+
+    #---------------------------------------------------------------------------
+    # writers publish the neighbor table before they remove anything from the
+    # cache, so a miss in both only counts if the table did not change between
+    # the two reads; otherwise look again
+    def _getTimestamp(self, addr):
+        while True:
+            current = self.current
+
+            present, presentAt = current
+            if addr in present: return presentAt
+
+            tstamp = self.cache.get(addr)
+            if tstamp is not None or self.current is current: return tstamp
+
+    #---------------------------------------------------------------------------
+    # record the last time an address was seen outside of a full refresh
+    def _touch(self, addr, tstamp):
+        self.cacheLock.acquire()
+
+        # devices in the neighbor table are already current
+        if addr not in self.current[0]:
+            self.cache[addr] = tstamp
+
+            if isinstance(tstamp, numbers.Number):
+                heapq.heappush(self.expiry, (tstamp, addr))
+
+        # every update leaves a stale item behind, so rebuild the heap from the
+        # table once the stale items outnumber the live ones
+        if len(self.expiry) > 2 * len(self.cache) + 64:
+            self._rebuildExpiry()
+
+        self.cacheLock.release()
+
+    #---------------------------------------------------------------------------
+    def _rebuildExpiry(self):
+        self.cacheLock.acquire()
+
+        self.expiry = [ (tstamp, addr) for addr, tstamp in self.cache.items()
+                        if isinstance(tstamp, numbers.Number) ]
+        heapq.heapify(self.expiry)
+
+        self.cacheLock.release()
 
-        # TODO return None for invalid address
+    #---------------------------------------------------------------------------
+    # devices are keyed by the integer value of their MAC address; returns
+    # None if the address is not valid
+    def _normalizeAddress(self, address):
+        return parseMacAddress(address)
 
-        # make sure all octets are padded - macOS arp does not pad properly
-        addr = ':'.join(map(lambda byte: byte.zfill(2), addr.split(':')))
+    #---------------------------------------------------------------------------
+    # MAC address strings are converted to their integer value, anything else
+    # (including an already normalized address) is used as given
+    def _getKey(self, key):
+        if isinstance(key, basestring):
+            addr = parseMacAddress(key)
+            if addr is not None: return addr
 
-        return addr
+        return key
 
     #---------------------------------------------------------------------------
-    def _getRawArpOutput(self):
-        if self.arp_cmd is None: return None
+    def _getNeighborEntries(self):
+        source = self.source
+        if source is None: return None
 
-        # the command takes some time to run so we will bail if
-        # another thread is already executing the arp command
+        # reading the table takes some time so we will bail if
+        # another thread is already reading from the source
         if not self.cmdLock.acquire(False):
             self.logger.warn('arp: already in use')
             return None
 
-        cmd = shlex.split(self.arp_cmd)
-        self.logger.debug('exec: %s', cmd)
-
         try:
-            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            pout, perr = proc.communicate()
-        except:
-            pout = None
+            entries = source.getEntries()
+        finally:
+            self.cmdLock.release()
 
-        self.cmdLock.release()
-
-        return pout
+        return entries
 
     #---------------------------------------------------------------------------
     def _updateCacheData(self, arp_output):
         self.logger.debug('reading %d bytes into ARP table', len(arp_output))
-        self._updateCacheLines(arp_output.splitlines())
+        self._updateCacheEntries(list(parseNeighborTable(arp_output)))
 
     #---------------------------------------------------------------------------
     def _updateCacheLines(self, lines):
         self.logger.debug('loading %d lines into ARP table', len(lines))
+        self._updateCacheData('\n'.join(lines))
+
+    #---------------------------------------------------------------------------
+    def _updateCacheLine(self, line):
+        self.logger.debug('parsing table entry: %s', line)
+
+        entry = parseArpLine(line)
+        if entry is None: return
+
+        self._updateCacheEntries([ entry ])
 
+    #---------------------------------------------------------------------------
+    # mark individual entries as seen now; see _updateNeighborTable for a
+    # full refresh of the table
+    def _updateCacheEntries(self, entries):
         self.cacheLock.acquire()
 
-        for line in lines:
-            self._updateCacheLine(line)
+        # update time for found devices
+        tstamp = time.time()
+
+        for entry in entries:
+            if entry.state in UNRESOLVED_STATES:
+                self.unreachable[entry.ip] = tstamp
+
+            if entry.state in INACTIVE_STATES: continue
+
+            addr = self._normalizeAddress(entry.mac)
+            if addr is None: continue
+
+            self.unreachable.pop(entry.ip, None)
+
+            self._touch(addr, tstamp)
+            self.logger.debug('device found: %012x @ %s', addr, tstamp)
 
         self.cacheLock.release()
 
     #---------------------------------------------------------------------------
-    def _updateCacheLine(self, line):
-        self.logger.debug('parsing table entry: %s', line)
+    # replace the neighbor table with a complete read from the source; only the
+    # entries that differ from the last read are examined, unless rebuilding,
+    # where the old table, cache and expiry heap are dropped altogether
+    def _updateNeighborTable(self, entries, rebuild=False):
+        self.cacheLock.acquire()
+
+        tstamp = time.time()
+
+        if rebuild:
+            present, presentAt = (dict(), None)
+            lastEntries = set()
+            cache = dict()
+            expiry = list()
+            unreachable = dict()
+        else:
+            present, presentAt = self.current
+            lastEntries = self.lastEntries
+            cache = self.cache
+            expiry = self.expiry
+            unreachable = self.unreachable
+
+        entries = set(entries)
+        added = entries - lastEntries
+        removed = lastEntries - entries
+
+        # build the new table on the side, then publish it all at once
+        present = dict(present)
+
+        arrived = list()
+        departed = list()
+        changed = list()
+        appeared = list()
+
+        for entry in removed:
+            if entry.mac is None: continue
+
+            addr = self._normalizeAddress(entry.mac)
+            existing = present.get(addr)
+
+            if existing is None or entry not in existing: continue
 
-        parts = line.split()
-        if len(parts) < 4: return
+            remaining = tuple([ other for other in existing if other != entry ])
 
-        # XXX safe to assume the part index?
-        addr = self._normalizeAddress(parts[3])
+            if len(remaining) > 0:
+                present[addr] = remaining
+                changed.append(addr)
+            else:
+                present.pop(addr)
+                departed.append(addr)
+
+        for entry in added:
+
+            # the IP stays unreachable until it is seen or the mark expires
+            if entry.state in UNRESOLVED_STATES:
+                unreachable[entry.ip] = tstamp
+
+            if entry.state in INACTIVE_STATES: continue
+            if entry.mac is None: continue
+
+            addr = self._normalizeAddress(entry.mac)
+            if addr is None: continue
+
+            existing = present.get(addr, tuple())
+
+            if len(existing) > 0:
+                if addr not in changed: changed.append(addr)
+            elif addr in departed:
+                departed.remove(addr)
+                changed.append(addr)
+            else:
+                arrived.append(addr)
+
+            present[addr] = existing + (entry,)
+            unreachable.pop(entry.ip, None)
+
+            self.logger.debug('device found: %012x (%s)', addr, entry.ip)
+
+        # departed devices were last seen at the previous refresh; they go in
+        # the cache before the table without them is published
+        for addr in departed:
+            cache[addr] = presentAt
+            heapq.heappush(expiry, (presentAt, addr))
+            self.logger.debug('device departed: %012x', addr)
+
+        # arriving devices are only news to subscribers if they had expired
+        for addr in arrived:
+            if not self._isCurrent(addr): appeared.append(addr)
+
+        # publish the table before the cache, then drop the arrivals from the
+        # cache; readers never see a current device missing from both
+        self.current = (present, tstamp)
+
+        self.cache = cache
+        self.expiry = expiry
+        self.unreachable = unreachable
+        self.lastEntries = entries
+
+        for addr in arrived:
+            cache.pop(addr, None)
+
+        self.cacheLock.release()
+
+        self._notify(appeared, True)
+
+        return (arrived, departed, changed)
+
+    #---------------------------------------------------------------------------
+    # apply a single neighbor add / change / delete event from the kernel
+    def applyNeighborEvent(self, msgType, entry):
+
+        # failed entries usually have no MAC address, so keep track by IP
+        if msgType == RTM_NEWNEIGH and entry.ip is not None:
+            if entry.state == 'FAILED':
+                self.unreachable[entry.ip] = time.time()
+            elif entry.state not in INACTIVE_STATES:
+                self.unreachable.pop(entry.ip, None)
+
+        if entry.mac is None: return
+
+        addr = self._normalizeAddress(entry.mac)
         if addr is None: return
 
         self.cacheLock.acquire()
 
-        # update time for found devices
-        tstamp = time.time()
-        self.cache[addr] = tstamp
-        self.logger.debug('device found: %s @ %s', addr, tstamp)
+        wasActive = self._isCurrent(addr)
+
+        if msgType == RTM_NEWNEIGH and entry.state not in INACTIVE_STATES:
+            tstamp = time.time()
+            self._touch(addr, tstamp)
+            self.logger.debug('device event: %012x (%s) @ %s', addr, entry.state, tstamp)
+
+        elif msgType == RTM_NEWNEIGH and entry.state == 'FAILED':
+            present = self.current[0]
+
+            # the next refresh should see these entries as new if they return
+            if addr in present:
+                self.lastEntries.difference_update(present.pop(addr))
+
+            self.cache.pop(addr, None)
+            self.logger.debug('device unreachable: %012x', addr)
+
+        # the kernel deletes entries that have simply gone stale, so a delete
+        # does not mean the device left; it will expire on the normal timeout
+
+        isActive = self._isCurrent(addr)
 
         self.cacheLock.release()
 
+        if isActive != wasActive:
+            self._notify([ addr ], isActive)
+
     #---------------------------------------------------------------------------
     def _isExpired(self, timestamp):
         if timestamp is None: return None
@@ -114,70 +889,95 @@ class ArpCache():
         return (diff >= self.timeout)
 
     #---------------------------------------------------------------------------
-    def updateProps(self, timeout=None, cmd=None):
+    def updateProps(self, timeout=None, cmd=None, source=None):
         if (timeout is not None):
             self.timeout = timeout
 
         if (cmd is not None):
             self.arp_cmd = cmd
 
+        if (source is not None):
+            self.sourceType = source
+
+        self.source = createSource(self.sourceType, self.arp_cmd)
+
     #---------------------------------------------------------------------------
+    # returns an ArpDiff with the changes since the last refresh
     def refreshArpCache(self):
-        self.cacheLock.acquire()
-
         self.logger.debug('updating ARP table')
-        self.loadCurrentDevices()
-        self.purgeExpiredDevices()
 
-        self.cacheLock.release()
+        arrived, departed, changed = self.loadCurrentDevices()
+        expired = self.purgeExpiredDevices()
+
+        self.lastDiff = ArpDiff(arrived, departed, changed, expired)
+
+        self.logger.debug('ARP table changes: %d arrived, %d departed, %d changed, %d expired',
+                          len(arrived), len(departed), len(changed), len(expired))
+
+        return self.lastDiff
 
     #---------------------------------------------------------------------------
     def rebuildArpCache(self):
-        self.cacheLock.acquire()
-
         self.logger.debug('rebuilding ARP table')
-        self.cache.clear()
-        self.loadCurrentDevices()
 
-        self.cacheLock.release()
+        # reading the neighbor table is slow, so do that before taking the lock
+        entries = self._getNeighborEntries()
+
+        # the new table, cache and expiry heap are built on the side and
+        # replace the old ones all at once
+        self._updateNeighborTable(entries or list(), rebuild=True)
 
     #---------------------------------------------------------------------------
+    # returns (arrived, departed, changed) lists of addresses
     def loadCurrentDevices(self):
         self.logger.debug('loading current devices table')
 
-        rawOutput = self._getRawArpOutput()
-        if rawOutput is None: return
+        # reading the neighbor table is slow, so do that before taking the lock
+        entries = self._getNeighborEntries()
+        if entries is None: return ([], [], [])
 
-        self._updateCacheData(rawOutput)
+        self.logger.debug('loading %d entries into ARP table', len(entries))
+
+        return self._updateNeighborTable(entries)
 
     #---------------------------------------------------------------------------
+    # returns a list of the addresses that expired
     def purgeExpiredDevices(self):
         self.cacheLock.acquire()
         self.logger.debug('purging expired items in table')
 
-        # find all the addresses for expired timestamps
-        expiredDevices = [ addr for addr, tstamp in self.cache.items() if self._isExpired(tstamp) ]
+        # configured timeout is in minutes, timestamps are in seconds...
+        cutoff = time.time() - (self.timeout * 60)
+        expiry = self.expiry
+        expired = list()
+
+        # only the expired items (and stale copies of them) are visited
+        while len(expiry) > 0 and expiry[0][0] <= cutoff:
+            tstamp, addr = heapq.heappop(expiry)
+
+            if self.cache.get(addr) == tstamp:
+                self.cache.pop(addr)
+                expired.append(addr)
+                self.logger.debug('device expired: %s', addr)
 
-        # now, delete the expired addresses
-        for addr in expiredDevices:
-            self.cache.pop(addr)
-            self.logger.debug('device expired: %s', addr)
+        for ip, tstamp in list(self.unreachable.items()):
+            if tstamp <= cutoff: self.unreachable.pop(ip, None)
 
         self.cacheLock.release()
 
+        self._notify(expired, False)
+
+        return expired
+
     #---------------------------------------------------------------------------
     def isActive(self, address):
         self.logger.debug('looking for %s in table', address)
 
-        # this lock may be overkill, but we want to ensure soemthing doesn't go
-        # sideways if the cache is being modified by another method
-        self.cacheLock.acquire()
-
-        addr = self._normalizeAddress(address)
-        tstamp = self.cache.get(addr)
+        # no lock needed; the published table is replaced, never rebuilt in place
+        addr = self._getKey(address)
+        tstamp = self._getTimestamp(addr)
 
-        self.cacheLock.release()
-        self.logger.debug('device %s expires @ %s', addr, tstamp)
+        self.logger.debug('device %s last seen @ %s', address, tstamp)
 
         expired = self._isExpired(tstamp)
         if expired is None: return False
@@ -185,17 +985,78 @@ class ArpCache():
         return (not expired)
 
     #---------------------------------------------------------------------------
-    def getActiveDeviceCount(self):
-        count = 0
+    # returns the IP addresses in the neighbor table for the given devices
+    def getIpAddresses(self, addrs):
+        present = self.current[0]
+        ipAddrs = list()
+
+        for addr in addrs:
+            for entry in present.get(self._getKey(addr), tuple()):
+                ipAddrs.append(entry.ip)
 
+        return ipAddrs
+
+    #---------------------------------------------------------------------------
+    # returns a list of (addr, tstamp) for every device that has not expired
+    def getSnapshot(self):
         self.cacheLock.acquire()
 
-        for addr, tstamp in self.cache.items():
-            if not self._isExpired(tstamp):
-                count += 1
+        present, presentAt = self.current
+        entries = list()
+
+        if presentAt is not None:
+            entries.extend([ (addr, presentAt) for addr in present ])
+
+        entries.extend([ (addr, tstamp) for addr, tstamp in self.cache.items()
+                         if isinstance(tstamp, numbers.Number) ])
 
         self.cacheLock.release()
 
+        return [ (addr, tstamp) for addr, tstamp in entries if self._isExpired(tstamp) is False ]
+
+    #---------------------------------------------------------------------------
+    # restore (addr, tstamp) pairs from getSnapshot; entries that have expired
+    # since then are skipped, and newer sightings are kept; returns the number
+    # of entries restored
+    def loadSnapshot(self, entries):
+        self.cacheLock.acquire()
+
+        count = 0
+
+        for addr, tstamp in entries:
+            if self._isExpired(tstamp) is not False: continue
+
+            existing = self._getTimestamp(addr)
+            if existing is not None and existing >= tstamp: continue
+
+            self._touch(addr, tstamp)
+            count += 1
+
+        self.cacheLock.release()
+
+        self.logger.debug('restored %d devices from snapshot', count)
+
+        return count
+
+    #---------------------------------------------------------------------------
+    # true if the kernel recently failed to resolve the IP address (from an
+    # unresolved table entry or a neighbor event) and it has not been seen
+    # since; an address that is simply missing is not unreachable
+    def isUnreachable(self, ip):
+        tstamp = self.unreachable.get(ip)
+        return (self._isExpired(tstamp) is False)
+
+    #---------------------------------------------------------------------------
+    # the tables grow as devices are seen and shrink as they expire, so their
+    # sizes are the count; entries that expired since the last refresh are
+    # counted until that refresh purges them
+    def getActiveDeviceCount(self):
+        count = len(self.cache)
+
+        # the neighbor table only counts if it has been refreshed recently
+        present, presentAt = self.current
+        if self._isExpired(presentAt) is False: count += len(present)
+
         return count
 
 ################################################################################
@@ -1,41 +1,201 @@
 ## handle client activities for Network Devices
 
+import hashlib
 import logging
+import os
 import shlex
-import json
+import signal
 import socket
-import urllib2
+import tempfile
 import threading
 import subprocess
+import time
+
+import arp
+import tcp
+import icmp
+import httpprobe
+import extip
+import resolver
+import coalesce
+
+# shared cache of host lookups for all clients and engines
+dnsCache = resolver.Resolver()
+
+# shared engine for batched TCP connection probes
+tcpProbe = tcp.TcpProbe(resolver=dnsCache)
+
+# shared engine for batched ICMP echo probes
+icmpProbe = icmp.IcmpProbe(resolver=dnsCache)
+
+# shared pool of keep-alive HTTP connections
+httpProbe = httpprobe.HttpProbe(resolver=dnsCache)
+
+# shared cache of the external address
+externalAddress = extip.ExternalAddressService()
+
+# devices that check the same target share a single probe
+probes = coalesce.ProbeCoalescer()
 
 ################################################################################
+# keeps smoothed round trip time and variance for a client, in the style of the
+# TCP retransmission timer (RFC 6298), and derives a timeout from them
+class RttEstimator():
+
+    # limits for the timeout (in seconds), shared by all estimators
+    minTimeout = 0.25
+    maxTimeout = 30
+
+    alpha = 0.125
+    beta = 0.25
+
+    #---------------------------------------------------------------------------
+    def __init__(self):
+        self.srtt = None
+        self.rttvar = None
+        self.backoff = 0
+
+    #---------------------------------------------------------------------------
+    def update(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2.0
+        else:
+            self.rttvar = (1 - self.beta) * self.rttvar + self.beta * abs(self.srtt - rtt)
+            self.srtt = (1 - self.alpha) * self.srtt + self.alpha * rtt
+
+        self.backoff = 0
+
+    #---------------------------------------------------------------------------
+    def timedOut(self):
+        if self.srtt is None: return
+
+        # the timeout stops growing long before this; see getTimeout
+        self.backoff = min(self.backoff + 1, 32)
+
+    #---------------------------------------------------------------------------
+    # returns the default until there is a sample to go on; each timed out
+    # check doubles the timeout until it reaches the default (or the learned
+    # timeout, if that is longer), so a host that got slower can answer and be
+    # measured again while one that is down costs no more than without an RTT
+    def getTimeout(self, default):
+        if self.srtt is None: return default
+
+        rto = max(self.srtt + 4 * self.rttvar, self.minTimeout)
+
+        if self.backoff > 0:
+            rto = min(rto * (2 ** self.backoff), max(rto, default))
+
+        return min(rto, self.maxTimeout)
+
+################################################################################
+# isAvailable(deadline) returns True / False, or None if the check ran out of
+# time; no check runs longer than its timeout or past the deadline
 class ClientBase():
 
+    # seconds allowed for a single check until the client has measured the
+    # round trip time to its host (shared by all clients)
+    timeout = 5
+
+    # round trip time (in seconds) from the last check; None if it timed out
+    lastRtt = None
+
     #---------------------------------------------------------------------------
     def __init__(self):
         self.logger = logging.getLogger('Plugin.client.ClientBase')
         self.execLock = threading.Lock()
+        self.rtt = RttEstimator()
+
+    #---------------------------------------------------------------------------
+    # seconds left for a check that must finish by the deadline (if given)
+    def getTimeout(self, deadline=None):
+        timeout = self.rtt.getTimeout(self.timeout)
+
+        if deadline is not None:
+            timeout = min(timeout, deadline - time.time())
+
+        return max(timeout, 0)
+
+    #---------------------------------------------------------------------------
+    # update the RTT estimate from a check that took the given time; None
+    # means the host did not answer in time
+    def _updateRtt(self, rtt):
+        if rtt is None:
+            self.rtt.timedOut()
+        else:
+            self.rtt.update(rtt)
+
+        self.lastRtt = rtt
 
     #---------------------------------------------------------------------------
-    # defined here as a convenience to subclasses
-    def _exec(self, *cmd):
+    # defined here as a convenience to subclasses; if a timeout is given, the
+    # command (and anything it started) is killed when it runs over and None
+    # is returned; with discard, the output goes straight to /dev/null
+    def _exec(self, *cmd, **kwargs):
+        timeout = kwargs.get('timeout', None)
+        discard = kwargs.get('discard', False)
+
         self.execLock.acquire()
         self.logger.debug(u'=> exec%s', cmd)
 
-        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        pout, perr = proc.communicate()
+        # output goes to temp files rather than pipes; with pipes, we would wait
+        # for every process that inherited them and not just the command
+        if discard:
+            pout = open(os.devnull, 'wb')
+            perr = open(os.devnull, 'wb')
+        else:
+            pout = tempfile.TemporaryFile()
+            perr = tempfile.TemporaryFile()
+
+        # the command runs in its own process group so it can be killed along
+        # with any children it left running
+        proc = subprocess.Popen(cmd, stdout=pout, stderr=perr, preexec_fn=os.setsid)
+
+        # wait() cannot time out on its own, so a timer kills the process group
+        expired = threading.Event()
+        timer = None
+
+        if timeout is not None:
+            timer = threading.Timer(timeout, self._kill, (proc, expired))
+            timer.daemon = True
+            timer.start()
+
+        retval = proc.wait()
+
+        if timer is not None: timer.cancel()
 
-        retval = proc.returncode
         self.logger.debug(u'=> exit(%d)', retval)
 
         # TODO check perr
-        #self.logger.warn(perr)
+        #self.logger.warn(perr.read())
+
+        pout.close()
+        perr.close()
 
         self.execLock.release()
+
+        # the process may have finished just as the timer fired
+        if expired.is_set() and retval < 0:
+            self.logger.debug(u'=> killed after %.1f sec', timeout)
+            return None
+
         return (retval == 0)
 
     #---------------------------------------------------------------------------
-    def isAvailable(self): raise NotImplementedError()
+    def _kill(self, proc, expired):
+        expired.set()
+
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+    #---------------------------------------------------------------------------
+    def isAvailable(self, deadline=None): raise NotImplementedError()
+
+    #---------------------------------------------------------------------------
+    # release any resources held by the client
+    def close(self): pass
 
 ################################################################################
 class NullClient(ClientBase):
@@ -45,7 +205,7 @@ class NullClient(ClientBase):
         ClientBase.__init__(self)
 
     #---------------------------------------------------------------------------
-    def isAvailable(self):
+    def isAvailable(self, deadline=None):
         return False
 
 ################################################################################
@@ -59,7 +219,7 @@ class LocalCommand(ClientBase):
         self.statusCommand = statusCommand
 
     #---------------------------------------------------------------------------
-    def isAvailable(self):
+    def isAvailable(self, deadline=None):
         statusCmd = self.statusCommand
         self.logger.debug(u'checking status: %s', statusCmd)
 
@@ -67,7 +227,7 @@ class LocalCommand(ClientBase):
             return False
         else:
             cmd = shlex.split(statusCmd)
-            return self._exec(*cmd)
+            return self._exec(*cmd, timeout=self.getTimeout(deadline))
 
 ################################################################################
 class ServiceClient(ClientBase):
@@ -80,72 +240,116 @@ class ServiceClient(ClientBase):
         self.address = address
         self.port = port
 
+    #---------------------------------------------------------------------------
+    # the target to include in a batched sweep; see tcp.TcpProbe.sweep
+    def getProbeTarget(self):
+        return (self.address, self.port)
+
     #---------------------------------------------------------------------------
     # determine if the specific host is reachable
-    def isAvailable(self):
+    def isAvailable(self, deadline=None):
         self.logger.debug('checking host - %s:%d', self.address, self.port)
 
-        ret = True
+        key = ('tcp', self.address, self.port)
+        timeout = self.getTimeout(deadline)
 
-        try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.connect( (self.address, self.port) )
-            sock.close()
-        except:
-            ret = False
+        available, rtt = probes.run(key, tcpProbe.probe, self.address, self.port, timeout)
+        self._updateRtt(rtt)
 
-        return ret
+        return available
 
 ################################################################################
 class PingClient(ClientBase):
 
+    # used when the ICMP engine is not able to open a socket
+    pingCommand = '/sbin/ping'
+
     #---------------------------------------------------------------------------
     def __init__(self, address):
         ClientBase.__init__(self)
         self.logger = logging.getLogger('Plugin.client.PingClient')
         self.address = address
 
+        # round trip time (in seconds) from the last successful ping
+        self.roundTripTime = None
+
     #---------------------------------------------------------------------------
     # determine if the specific host is reachable
-    def isAvailable(self):
+    def isAvailable(self, deadline=None):
         self.logger.debug('pinging address - %s', self.address)
 
-        # we will only wait for 1 ping response
-        cmd = ['/sbin/ping', '-c1', self.address]
+        key = ('icmp', self.address)
+        rtt = probes.run(key, self._ping, self.getTimeout(deadline))
+
+        self.roundTripTime = rtt
+        self._updateRtt(rtt)
+
+        return (rtt is not None)
+
+    #---------------------------------------------------------------------------
+    # returns the round trip time in seconds or None if there was no reply
+    def _ping(self, timeout):
+        if icmpProbe.isSupported():
+            rtt = icmpProbe.getRoundTripTime(self.address, timeout)
 
-        return self._exec(*cmd)
+            # the engine may have lost its socket; if so, use the command
+            if rtt is not None or icmpProbe.isSupported():
+                return rtt
+
+        # let ping resolve the name itself if it is not in the cache
+        result = dnsCache.resolve(self.address, socket.AF_INET)
+        address = self.address if result is None else result[1]
+
+        # we will only wait for 1 ping response; as with the ICMP engine, no
+        # reply before the timeout means the host is not available
+        cmd = [self.pingCommand, '-c1', address]
+
+        # the command does not report the round trip time, so this includes
+        # the time to run it
+        startTime = time.time()
+        if self._exec(*cmd, timeout=timeout) is not True: return None
+
+        return (time.time() - startTime)
 
 ################################################################################
 class HttpClient(ClientBase):
 
     #---------------------------------------------------------------------------
-    def __init__(self, url):
+    def __init__(self, url, method='HEAD'):
         ClientBase.__init__(self)
         self.logger = logging.getLogger('Plugin.client.HttpClient')
         self.url = url
+        self.method = method
+
+        # response time (in seconds) and bytes read from the last request
+        self.latency = None
+        self.bytesRead = None
 
     #---------------------------------------------------------------------------
     # determine if the returned status code is success or error
-    def isAvailable(self):
+    def isAvailable(self, deadline=None):
         self.logger.debug('connecting to URL - %s', self.url)
-        available = None
 
-        try:
-            resp = urllib2.urlopen(self.url)
-            status = resp.getcode()
+        # redirects are followed by the probe
+        key = ('http', self.method, self.url)
+        result = probes.run(key, httpProbe.probe, self.url, self.method, self.getTimeout(deadline))
+
+        self.latency = result.latency
+        self.bytesRead = result.bytesRead
+
+        if result.timedOut:
+            self._updateRtt(None)
+            return None
 
-            self.logger.debug('HTTP status - %d', status)
-            available = (200 <= status <= 299)
+        if result.status is None: return False
 
-            # XXX how are redirects handled?
+        self._updateRtt(result.latency)
 
-        except Exception as e:
-            self.logger.warn(str(e))
-            available = False
+        self.logger.debug('HTTP status - %d', result.status)
 
         # XXX maybe we want to return None (Error) for 5xx codes?
 
-        return available
+        return (200 <= result.status <= 299)
 
 ################################################################################
 class ArpClient(ClientBase):
@@ -157,75 +361,143 @@ class ArpClient(ClientBase):
         ClientBase.__init__(self)
         self.logger = logging.getLogger('Plugin.client.ArpClient')
 
+        # normalize once here rather than on every lookup
+        self.key = arp.parseMacAddress(address)
+
+        if self.key is None:
+            raise ValueError('invalid MAC address: %s' % address)
+
         self.address = address
         self.arpTable = arpTable
+        self.callback = None
 
     #---------------------------------------------------------------------------
     # check for the device in the current ARP table
-    def isAvailable(self):
+    def isAvailable(self, deadline=None):
         self.logger.debug('checking ARP table for device - %s', self.address)
-        return self.arpTable.isActive(self.address)
+        return self.arpTable.isActive(self.key)
+
+    #---------------------------------------------------------------------------
+    # callback(active) is called as soon as the device appears or expires
+    def subscribe(self, callback):
+        self.unsubscribe()
+
+        self.callback = callback
+        self.arpTable.subscribe(self.key, callback)
+
+    #---------------------------------------------------------------------------
+    def unsubscribe(self):
+        if self.callback is None: return
+
+        self.arpTable.unsubscribe(self.key, self.callback)
+        self.callback = None
 
 ################################################################################
-class ExternalAddressClient(ClientBase):
+# looks for an IPv4 host that the kernel failed to resolve on the local network;
+# this can show that a host is down, but never that it is up
+class NeighborClient(ClientBase):
 
-    # helper class for parsing API results...
-    # based on API at https://www.ipify.org/
+    # NOTE we depend on the ARP table to be maintained outside this client
 
     #---------------------------------------------------------------------------
-    def __init__(self):
+    def __init__(self, address, arpTable):
         ClientBase.__init__(self)
-        self.logger = logging.getLogger('Plugin.client.ExternalAddressClient')
+        self.logger = logging.getLogger('Plugin.client.NeighborClient')
 
-        current_address = None
+        self.address = address
+        self.arpTable = arpTable
 
     #---------------------------------------------------------------------------
-    def parseAddress(self, url):
-        self.logger.debug('getting address from API - %s', url)
+    # returns False only if the address is known to be unreachable
+    def isAvailable(self, deadline=None):
+        result = dnsCache.resolve(self.address, socket.AF_INET)
+        if result is None: return True
 
-        try:
-            resp = urllib2.urlopen(url)
-            raw = resp.read()
-            self.logger.debug('read %d bytes from API', len(raw))
+        self.logger.debug('checking neighbor table for host - %s', result[1])
 
-            data = json.loads(raw)
-            addr = data['ip']
+        return not self.arpTable.isUnreachable(result[1])
 
-        except Exception as e:
-            self.logger.error(str(e))
-            addr = None
+################################################################################
+# runs a list of (name, client) stages from the cheapest to the full check;
+# the stages before the last can only show that the device is down, so the
+# first one that fails decides the result and the full check is only run when
+# all of them pass
+class ProbePipeline(ClientBase):
 
-        self.current_address = addr
+    #---------------------------------------------------------------------------
+    def __init__(self, stages):
+        ClientBase.__init__(self)
+        self.logger = logging.getLogger('Plugin.client.ProbePipeline')
+
+        self.stages = stages
+
+        # the name of the stage that decided the last result
+        self.decidedBy = None
+        self.lastResult = None
+
+        # stage name -> number of results it decided
+        self.decisions = dict([ (name, 0) for name, client in stages ])
+
+    #---------------------------------------------------------------------------
+    def isAvailable(self, deadline=None):
+        stages = self.stages
+
+        # the cheap stages cannot tell us anything new about a device that was
+        # up at the last check, so only the full check runs until it fails
+        if self.lastResult is True: stages = stages[-1:]
+
+        for name, client in stages:
+            available = client.isAvailable(deadline)
+            if available is not True: break
+
+        self.logger.debug('result decided by %s stage - %s', name, available)
+
+        self.decidedBy = name
+        self.decisions[name] += 1
+        self.lastResult = available
 
-        return addr
+        return available
+
+    #---------------------------------------------------------------------------
+    def close(self):
+        for name, client in self.stages: client.close()
 
 ################################################################################
-class IPv4AddressClient(ExternalAddressClient):
+class ExternalAddressClient(ClientBase):
 
     #---------------------------------------------------------------------------
-    def __init__(self):
-        ExternalAddressClient.__init__(self)
-        self.logger = logging.getLogger('Plugin.client.IPv4AddressClient')
+    def __init__(self, family):
+        ClientBase.__init__(self)
+        self.logger = logging.getLogger('Plugin.client.ExternalAddressClient')
+
+        self.family = family
+        self.current_address = None
 
     #---------------------------------------------------------------------------
-    def isAvailable(self):
-        addr = self.parseAddress('https://api.ipify.org/?format=json')
+    # the address is shared by all devices and only looked up when needed
+    def isAvailable(self, deadline=None):
+        addr = externalAddress.getAddress(self.family, self.getTimeout(deadline))
         self.logger.debug('found external address - %s', addr)
+
+        self.current_address = addr
+
         return addr is not None
 
 ################################################################################
-class IPv6AddressClient(ExternalAddressClient):
+class IPv4AddressClient(ExternalAddressClient):
 
     #---------------------------------------------------------------------------
     def __init__(self):
-        ExternalAddressClient.__init__(self)
-        self.logger = logging.getLogger('Plugin.client.IPv6AddressClient')
+        ExternalAddressClient.__init__(self, 'ipv4')
+        self.logger = logging.getLogger('Plugin.client.IPv4AddressClient')
+
+################################################################################
+class IPv6AddressClient(ExternalAddressClient):
 
     #---------------------------------------------------------------------------
-    def isAvailable(self):
-        addr = self.parseAddress('https://api6.ipify.org/?format=json')
-        self.logger.debug('found external address - %s', addr)
-        return addr is not None
+    def __init__(self):
+        ExternalAddressClient.__init__(self, 'ipv6')
+        self.logger = logging.getLogger('Plugin.client.IPv6AddressClient')
 
 ################################################################################
 class SSHClient(ServiceClient):
@@ -235,6 +507,18 @@ class SSHClient(ServiceClient):
     # - status : determine if the system is available
     # - shutdown : shut the system down; halt; power off
 
+    sshCommand = '/usr/bin/ssh'
+
+    # seconds to keep an idle control connection open; 0 disables sharing
+    controlPersist = 600
+
+    # control sockets for all clients are kept in a private temp directory
+    controlDir = None
+    controlLock = threading.Lock()
+
+    # control path -> number of clients using the master connection
+    controlUsers = dict()
+
     #---------------------------------------------------------------------------
     def __init__(self, address, port=22, username=None, password=None):
         ServiceClient.__init__(self, address, port)
@@ -244,16 +528,41 @@ class SSHClient(ServiceClient):
         self.username = username
         self.password = password
 
+        # set once a command has run over a shared connection, along with the
+        # host options used to reach it
+        self.controlPath = None
+        self.controlHostArgs = None
+
+    #---------------------------------------------------------------------------
+    # only plain connection checks can be batched
+    def getProbeTarget(self):
+        if self.commands.get('status', None) is not None: return None
+        return ServiceClient.getProbeTarget(self)
+
     #---------------------------------------------------------------------------
-    def isAvailable(self):
+    def isAvailable(self, deadline=None):
         statusCmd = self.commands.get('status', None)
         self.logger.debug(u'checking remote status: %s', statusCmd)
 
         if statusCmd is None:
-            return ServiceClient.isAvailable(self)
-        else:
-            cmd = shlex.split(statusCmd)
-            return self._rexec(*cmd)
+            return ServiceClient.isAvailable(self, deadline)
+
+        key = ('ssh', self.username, self.address, self.port, statusCmd)
+        available, elapsed = probes.run(key, self._runStatus, statusCmd, self.getTimeout(deadline))
+
+        self._updateRtt(None if available is None else elapsed)
+
+        return available
+
+    #---------------------------------------------------------------------------
+    # returns (available, seconds) for the status command
+    def _runStatus(self, statusCmd, timeout):
+        cmd = shlex.split(statusCmd)
+
+        startTime = time.time()
+        available = self._rexec(*cmd, timeout=timeout)
+
+        return (available, time.time() - startTime)
 
     #---------------------------------------------------------------------------
     def turnOff(self):
@@ -263,33 +572,129 @@ class SSHClient(ServiceClient):
 
         # execute the command remotely
         cmd = shlex.split(shutdownCmd)
-        status = self._rexec(*cmd)
+        status = self._rexec(*cmd, timeout=self.timeout)
 
-        return status
+        return (status is True)
 
     #---------------------------------------------------------------------------
-    def _rexec(self, *cmd):
-        # setup the remote command using a safe ssh config
-        # XXX -f would be ideal, but we lose the return code of the remote command
-        rcmd = ['/usr/bin/ssh', '-anTxq']
+    # clients for the same user, host and port share a master connection; like
+    # the %C token in ssh, the name is a hash, but here we know which clients
+    # share it so the master is only stopped when the last of them closes
+    def _getControlPath(self):
+        SSHClient.controlLock.acquire()
+
+        if SSHClient.controlDir is None:
+            SSHClient.controlDir = tempfile.mkdtemp(prefix='netdev-ssh-')
 
-        # TODO support global timeout, e.g.
-        #rcmd.append('-o', 'ConnectTimeout=%d' % connectionTimeout)
+        SSHClient.controlLock.release()
+
+        key = '%s@%s:%d' % (self.username or '', self.address, self.port)
+        name = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+        return os.path.join(SSHClient.controlDir, name)
+
+    #---------------------------------------------------------------------------
+    # start using the shared master connection; see close()
+    def _openControl(self):
+        controlPath = self._getControlPath()
+
+        SSHClient.controlLock.acquire()
+        SSHClient.controlUsers[controlPath] = SSHClient.controlUsers.get(controlPath, 0) + 1
+        SSHClient.controlLock.release()
+
+        self.controlPath = controlPath
+
+    #---------------------------------------------------------------------------
+    # options common to all ssh invocations for this host
+    def _getHostArgs(self):
+        args = list()
+
+        # connect to the cached address, but check the host key by name; names
+        # that do not resolve may be aliases in ssh_config, so leave those to ssh
+        if resolver.getAddressFamily(self.address) is None:
+            result = dnsCache.resolve(self.address)
+
+            if result is not None:
+                args.extend(('-o', 'HostName=%s' % result[1]))
+                args.extend(('-o', 'HostKeyAlias=%s' % self.address))
 
         # username is optional for SSH commands...
         username = self.username
         if username is not None and len(username) > 0:
             self.logger.debug(u'running as remote user: %s', username)
-            rcmd.extend(('-l', username))
+            args.extend(('-l', username))
         else:
             # TODO capture local username in debug log
             self.logger.debug(u'running as local user')
 
         # add the host and port
-        rcmd.extend(('-p', str(self.port), self.address))
+        args.extend(('-p', str(self.port), self.address))
+
+        return args
+
+    #---------------------------------------------------------------------------
+    def _rexec(self, *cmd, **kwargs):
+        timeout = kwargs.get('timeout', self.timeout)
+
+        # setup the remote command using a safe ssh config
+        # XXX -f would be ideal, but we lose the return code of the remote command
+        rcmd = [self.sshCommand, '-anTxq']
+
+        # ssh gives up on the connection by itself; the command is killed if it
+        # still runs past the timeout
+        rcmd.extend(('-o', 'ConnectTimeout=%d' % max(int(timeout), 1)))
+
+        hostArgs = self._getHostArgs()
+
+        # the first command starts a master connection that stays open in the
+        # background; later commands reuse it without a new key exchange
+        if self.controlPersist > 0:
+            if self.controlPath is None: self._openControl()
+            self.controlHostArgs = hostArgs
+
+            rcmd.extend(('-o', 'ControlMaster=auto'))
+            rcmd.extend(('-o', 'ControlPath=%s' % self.controlPath))
+            rcmd.extend(('-o', 'ControlPersist=%d' % self.controlPersist))
+
+        rcmd.extend(hostArgs)
 
         # add all commands supplied by caller
         rcmd.extend(cmd)
 
-        return self._exec(*rcmd)
+        # the master keeps whatever output the first command had; it must not
+        # hold on to anything of ours for the whole ControlPersist time
+        return self._exec(*rcmd, timeout=timeout, discard=(self.controlPersist > 0))
+
+    #---------------------------------------------------------------------------
+    # stop the master connection, if one was started and no other client is
+    # still using it
+    def close(self):
+        controlPath = self.controlPath
+        if controlPath is None: return
+
+        self.controlPath = None
+
+        SSHClient.controlLock.acquire()
+
+        users = SSHClient.controlUsers.get(controlPath, 1) - 1
+
+        if users > 0:
+            SSHClient.controlUsers[controlPath] = users
+        else:
+            SSHClient.controlUsers.pop(controlPath, None)
+
+        SSHClient.controlLock.release()
+
+        if users > 0:
+            self.logger.debug(u'control connection still in use: %s', self.address)
+            return
+
+        self.logger.debug(u'closing control connection: %s', self.address)
+
+        # use the same host options as the commands that started it
+        rcmd = [self.sshCommand, '-q', '-O', 'exit']
+        rcmd.extend(('-o', 'ControlPath=%s' % controlPath))
+        rcmd.extend(self.controlHostArgs)
+
+        self._exec(*rcmd, timeout=self.timeout)
 
@@ -0,0 +1,142 @@
+## shares probe results between devices that check the same target
+
+import logging
+import threading
+import time
+
+################################################################################
+# runs each probe once for all callers with the same key; a result is handed
+# to anyone asking for it within the window, and callers that ask while the
+# probe is running wait for it rather than starting their own
+class ProbeCoalescer():
+
+    #---------------------------------------------------------------------------
+    def __init__(self, window=5):
+        self.logger = logging.getLogger('Plugin.coalesce.ProbeCoalescer')
+        self.lock = threading.Lock()
+
+        # key -> (tstamp, result) for the last completed probe
+        self.results = dict()
+
+        # key -> Event for probes that are running now
+        self.inflight = dict()
+
+        self.totalProbes = 0
+        self.totalShared = 0
+
+        self.resetStats()
+        self.updateProps(window=window)
+
+    #---------------------------------------------------------------------------
+    def updateProps(self, window=None):
+        if window is not None:
+            self.window = window
+
+    #---------------------------------------------------------------------------
+    # counters since the last reset; totals are kept for the life of the plugin
+    def resetStats(self):
+        self.probes = 0
+        self.shared = 0
+
+    #---------------------------------------------------------------------------
+    # returns a dict of counters, optionally starting a new count
+    def getStats(self, reset=False):
+        self.lock.acquire()
+
+        stats = {
+            'probes' : self.probes,
+            'shared' : self.shared,
+            'totalProbes' : self.totalProbes,
+            'totalShared' : self.totalShared
+        }
+
+        if reset: self.resetStats()
+
+        self.lock.release()
+
+        return stats
+
+    #---------------------------------------------------------------------------
+    def _countProbe(self):
+        # lock must be held by caller
+        self.probes += 1
+        self.totalProbes += 1
+
+    #---------------------------------------------------------------------------
+    def _countShared(self):
+        # lock must be held by caller
+        self.shared += 1
+        self.totalShared += 1
+
+    #---------------------------------------------------------------------------
+    def _getFresh(self, key, now):
+        # lock must be held by caller
+        entry = self.results.get(key)
+        if entry is None or (now - entry[0]) >= self.window: return None
+
+        return entry
+
+    #---------------------------------------------------------------------------
+    # returns func(*args), or the result of the same probe if it just ran
+    def run(self, key, func, *args):
+        if self.window <= 0: return func(*args)
+
+        self.lock.acquire()
+
+        entry = self._getFresh(key, time.time())
+
+        if entry is not None:
+            self._countShared()
+            self.lock.release()
+            return entry[1]
+
+        event = self.inflight.get(key)
+
+        # someone else is running this probe; use their result
+        if event is not None:
+            self.lock.release()
+            event.wait()
+
+            self.lock.acquire()
+            entry = self.results.get(key)
+
+            if entry is not None and entry[0] >= event.startTime:
+                self._countShared()
+                self.lock.release()
+                return entry[1]
+
+            self.lock.release()
+
+            # the probe failed; try it ourselves
+            return self.run(key, func, *args)
+
+        event = threading.Event()
+        event.startTime = time.time()
+
+        self.inflight[key] = event
+        self._countProbe()
+
+        self.lock.release()
+
+        try:
+            result = func(*args)
+
+            self.lock.acquire()
+            self.results[key] = (time.time(), result)
+            self.lock.release()
+
+        finally:
+            self.lock.acquire()
+            self.inflight.pop(key, None)
+            self.lock.release()
+
+            event.set()
+
+        return result
+
+    #---------------------------------------------------------------------------
+    # forget all results, e.g. when the devices have changed
+    def clear(self):
+        self.lock.acquire()
+        self.results.clear()
+        self.lock.release()
@@ -0,0 +1,229 @@
+## shared lookup of the external (WAN) address for Network Devices
+
+import json
+import logging
+import Queue
+import socket
+import threading
+import time
+import urllib2
+
+DEFAULT_PROVIDERS = {
+    'ipv4' : [
+        'https://api.ipify.org/?format=json',
+        'https://ipv4.icanhazip.com/',
+        'https://checkip.amazonaws.com/'
+    ],
+    'ipv6' : [
+        'https://api6.ipify.org/?format=json',
+        'https://ipv6.icanhazip.com/'
+    ]
+}
+
+# well known public addresses used to find the local route; nothing is sent
+_ROUTE_PROBES = {
+    'ipv4' : (socket.AF_INET, ('8.8.8.8', 53)),
+    'ipv6' : (socket.AF_INET6, ('2001:4860:4860::8888', 53))
+}
+
+#-------------------------------------------------------------------------------
+# returns the address if it is valid for the family, otherwise None
+def validateAddress(family, addr):
+    sockFamily = _ROUTE_PROBES[family][0]
+
+    try:
+        socket.inet_pton(sockFamily, addr)
+    except (socket.error, TypeError, ValueError, UnicodeError):
+        return None
+
+    return str(addr)
+
+#-------------------------------------------------------------------------------
+# providers answer with either plain text or JSON like {"ip": "..."}
+def parseResponse(raw):
+    raw = raw.strip()
+
+    if raw.startswith('{'):
+        try:
+            return json.loads(raw).get('ip')
+        except (ValueError, AttributeError):
+            return None
+
+    return raw
+
+################################################################################
+# caches the external address for each family; providers are only queried when
+# the local route changes or the cached value is too old
+class ExternalAddressService():
+
+    #---------------------------------------------------------------------------
+    def __init__(self, ttl=3600, timeout=5, hedgeDelay=1, maxBytes=1024):
+        self.logger = logging.getLogger('Plugin.extip.ExternalAddressService')
+        self.queryLock = threading.Lock()
+
+        self.providers = dict(DEFAULT_PROVIDERS)
+
+        # family -> (address, tstamp, localAddress)
+        self.cache = dict()
+
+        self.queries = 0
+
+        self.updateProps(ttl=ttl, timeout=timeout, hedgeDelay=hedgeDelay, maxBytes=maxBytes)
+
+    #---------------------------------------------------------------------------
+    def updateProps(self, ttl=None, timeout=None, hedgeDelay=None, maxBytes=None, providers=None):
+        if ttl is not None:
+            self.ttl = ttl
+
+        if timeout is not None:
+            self.timeout = timeout
+
+        if hedgeDelay is not None:
+            self.hedgeDelay = hedgeDelay
+
+        if maxBytes is not None:
+            self.maxBytes = maxBytes
+
+        # providers is a dict of family -> list of urls; empty means the defaults
+        if providers is not None:
+            for family, urls in providers.items():
+                if len(urls) == 0: urls = DEFAULT_PROVIDERS.get(family, list())
+                self.providers[family] = list(urls)
+
+    #---------------------------------------------------------------------------
+    # the local source address for the default route; this changes when the
+    # network or interface changes, without sending any packets
+    def _getLocalAddress(self, family):
+        sockFamily, target = _ROUTE_PROBES[family]
+
+        try:
+            sock = socket.socket(sockFamily, socket.SOCK_DGRAM)
+        except socket.error:
+            return None
+
+        try:
+            sock.connect(target)
+            addr = sock.getsockname()[0]
+        except socket.error:
+            addr = None
+
+        sock.close()
+
+        return addr
+
+    #---------------------------------------------------------------------------
+    def _fetch(self, url, timeout):
+        self.logger.debug(u'getting address from provider - %s', url)
+
+        resp = urllib2.urlopen(url, timeout=timeout)
+        raw = resp.read(self.maxBytes)
+        resp.close()
+
+        self.logger.debug(u'read %d bytes from provider', len(raw))
+
+        return parseResponse(raw)
+
+    #---------------------------------------------------------------------------
+    # worker for a single provider; always puts exactly one result on the queue
+    def _ask(self, family, url, timeout, results):
+        addr = None
+
+        try:
+            addr = validateAddress(family, self._fetch(url, timeout))
+        except Exception as e:
+            self.logger.debug(u'provider failed: %s - %s', url, str(e))
+
+        if addr is None:
+            self.logger.debug(u'no valid address from %s', url)
+
+        results.put((url, addr))
+
+    #---------------------------------------------------------------------------
+    def _start(self, family, url, timeout, results):
+        thread = threading.Thread(target=self._ask, args=(family, url, timeout, results))
+        thread.daemon = True
+        thread.start()
+
+    #---------------------------------------------------------------------------
+    # query providers in order, starting the next one if there is no answer
+    # within the hedge delay; the first valid answer wins
+    def _query(self, family, timeout):
+        providers = self.providers.get(family, list())
+        results = Queue.Queue()
+
+        self.queries += 1
+
+        deadline = time.time() + timeout
+        nextStart = time.time()
+        started = 0
+        finished = 0
+
+        while finished < len(providers):
+            now = time.time()
+            if now >= deadline: break
+
+            if started < len(providers) and now >= nextStart:
+                self._start(family, providers[started], max(deadline - now, 0.001), results)
+                started += 1
+                nextStart = now + self.hedgeDelay
+
+            wait = deadline - now
+            if started < len(providers): wait = min(wait, nextStart - now)
+
+            try:
+                url, addr = results.get(True, max(wait, 0.001))
+            except Queue.Empty:
+                continue
+
+            finished += 1
+
+            if addr is not None:
+                self.logger.debug(u'external address from %s - %s', url, addr)
+                return addr
+
+            # a failed provider should not hold up the next one
+            nextStart = time.time()
+
+        self.logger.warn(u'no external %s address from %d providers', family, len(providers))
+
+        return None
+
+    #---------------------------------------------------------------------------
+    # returns the current external address for 'ipv4' or 'ipv6', or None
+    def getAddress(self, family, timeout=None):
+        if timeout is None: timeout = self.timeout
+
+        self.queryLock.acquire()
+
+        localAddress = self._getLocalAddress(family)
+        cached = self.cache.get(family)
+
+        addr = None
+
+        if cached is not None:
+            addr, tstamp, lastLocal = cached
+
+            if localAddress != lastLocal:
+                self.logger.debug(u'local %s address changed: %s', family, localAddress)
+                addr = None
+
+            elif (time.time() - tstamp) >= self.ttl:
+                self.logger.debug(u'cached %s address expired', family)
+                addr = None
+
+        if addr is None:
+            addr = self._query(family, timeout)
+
+            if addr is not None:
+                self.cache[family] = (addr, time.time(), localAddress)
+
+        self.queryLock.release()
+
+        return addr
+
+    #---------------------------------------------------------------------------
+    # forget cached addresses so the next lookup asks a provider
+    def invalidate(self):
+        self.queryLock.acquire()
+        self.cache.clear()
+        self.queryLock.release()
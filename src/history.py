@@ -0,0 +1,162 @@
+## availability history and uptime statistics for Network Devices
+
+import array
+import binascii
+import logging
+import time
+
+# seconds of history kept for each device
+MAX_AGE = 7 * 86400
+
+# upper limit on samples per device, whatever the poll interval; at 6 bytes
+# and 1 bit per sample this is about 60 KB for a device checked every minute
+MAX_SAMPLES = 10080
+
+# stored in place of a round trip time when there is none
+NO_RTT = 0xFFFF
+
+#-------------------------------------------------------------------------------
+# the number of samples needed to cover MAX_AGE at the given poll interval
+def getCapacity(interval):
+    return max(min(MAX_AGE // max(int(interval), 1), MAX_SAMPLES), 1)
+
+#-------------------------------------------------------------------------------
+def _popcount(value):
+    return bin(value).count('1')
+
+#-------------------------------------------------------------------------------
+# returns the value at the given percent (0 - 100) of a sorted list
+def _percentile(values, percent):
+    if len(values) == 0: return None
+
+    idx = int(round((len(values) - 1) * percent / 100.0))
+
+    return values[idx]
+
+################################################################################
+# a fixed-size ring of check results: timestamps (seconds) in an array of
+# unsigned ints, up / down as a bitset and round trip times (milliseconds) in
+# an array of unsigned shorts; when the ring is full, the oldest is replaced
+class AvailabilityHistory():
+
+    #---------------------------------------------------------------------------
+    def __init__(self, capacity=MAX_SAMPLES):
+        self.logger = logging.getLogger('Plugin.history.AvailabilityHistory')
+
+        self.capacity = capacity
+
+        self.times = array.array('I', [ 0 ]) * capacity
+        self.rtts = array.array('H', [ NO_RTT ]) * capacity
+        self.bits = bytearray((capacity + 7) // 8)
+
+        # index of the oldest sample and the number of samples
+        self.first = 0
+        self.count = 0
+
+    #---------------------------------------------------------------------------
+    def __len__(self): return self.count
+
+    #---------------------------------------------------------------------------
+    # record a check result; rtt is in seconds or None
+    def append(self, tstamp, available, rtt=None):
+        idx = (self.first + self.count) % self.capacity
+
+        if self.count < self.capacity:
+            self.count += 1
+        else:
+            self.first = (self.first + 1) % self.capacity
+
+        self.times[idx] = int(tstamp)
+
+        if rtt is None:
+            self.rtts[idx] = NO_RTT
+        else:
+            self.rtts[idx] = min(int(round(rtt * 1000)), NO_RTT - 1)
+
+        mask = 1 << (idx & 7)
+
+        if available:
+            self.bits[idx >> 3] |= mask
+        else:
+            self.bits[idx >> 3] &= ~mask & 0xFF
+
+    #---------------------------------------------------------------------------
+    def _getTime(self, pos):
+        return self.times[(self.first + pos) % self.capacity]
+
+    #---------------------------------------------------------------------------
+    # position (from the oldest) of the first sample at or after the time;
+    # timestamps only go forward, so this is a binary search
+    def _findPosition(self, since):
+        lo = 0
+        hi = self.count
+
+        while lo < hi:
+            mid = (lo + hi) // 2
+
+            if self._getTime(mid) < since:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        return lo
+
+    #---------------------------------------------------------------------------
+    # the bits for ring indexes [start, end) as an integer, lowest bit first
+    def _getBits(self, start, end):
+        if start >= end: return 0
+
+        data = self.bits[start >> 3 : (end + 7) >> 3]
+        value = int(binascii.hexlify(bytes(data[::-1])), 16)
+
+        return (value >> (start & 7)) & ((1 << (end - start)) - 1)
+
+    #---------------------------------------------------------------------------
+    # the samples for [pos, count) as (bits, rtts), oldest first; the window
+    # may wrap around the end of the ring
+    def _getWindow(self, pos):
+        start = (self.first + pos) % self.capacity
+        length = self.count - pos
+        end = start + length
+
+        if end <= self.capacity:
+            return (self._getBits(start, end), self.rtts[start:end])
+
+        end -= self.capacity
+        head = self.capacity - start
+
+        bits = self._getBits(start, self.capacity) | (self._getBits(0, end) << head)
+        rtts = self.rtts[start:] + self.rtts[:end]
+
+        return (bits, rtts)
+
+    #---------------------------------------------------------------------------
+    # returns a dict of statistics for the samples in the last window seconds:
+    # uptime (0 - 1), flaps (changes between up and down), and the 50th and
+    # 95th percentile of the round trip times (in seconds, None if unknown)
+    def getStats(self, window=MAX_AGE, now=None):
+        if now is None: now = time.time()
+
+        pos = self._findPosition(int(now - window))
+        samples = self.count - pos
+
+        stats = { 'samples' : samples, 'uptime' : None, 'flaps' : 0,
+                  'rttP50' : None, 'rttP95' : None }
+
+        if samples == 0: return stats
+
+        bits, rtts = self._getWindow(pos)
+
+        stats['uptime'] = float(_popcount(bits)) / samples
+
+        # a flap is a bit that differs from the one after it
+        if samples > 1:
+            stats['flaps'] = _popcount((bits ^ (bits >> 1)) & ((1 << (samples - 1)) - 1))
+
+        values = sorted([ rtt for rtt in rtts if rtt != NO_RTT ])
+
+        if len(values) > 0:
+            stats['rttP50'] = _percentile(values, 50) / 1000.0
+            stats['rttP95'] = _percentile(values, 95) / 1000.0
+
+        return stats
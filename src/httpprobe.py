@@ -0,0 +1,256 @@
+## keep-alive HTTP status probes for Network Devices
+
+import collections
+import httplib
+import logging
+import select
+import socket
+import threading
+import time
+import urlparse
+
+# result of a single probe; status is None if no response was received, and
+# timedOut is set if that was because the probe ran out of time
+HttpResult = collections.namedtuple('HttpResult', ['status', 'latency', 'bytesRead', 'url', 'timedOut'])
+
+# status codes that mean the server does not support the request method
+_METHOD_NOT_SUPPORTED = (405, 501)
+
+# sent for a range request the server will not serve, e.g. an empty page
+_RANGE_NOT_SATISFIABLE = 416
+
+_REDIRECTS = (301, 302, 303, 307, 308)
+
+################################################################################
+# checks HTTP status using a pool of keep-alive connections for each host
+class HttpProbe():
+
+    #---------------------------------------------------------------------------
+    def __init__(self, timeout=5, maxBytes=4096, maxIdle=2, maxRedirects=5, resolver=None):
+        self.logger = logging.getLogger('Plugin.httpprobe.HttpProbe')
+        self.poolLock = threading.Lock()
+
+        # optional shared cache for host lookups; see resolver.Resolver
+        self.resolver = resolver
+
+        # (scheme, host, port) -> list of idle connections
+        self.pool = dict()
+
+        # number of new connections (and handshakes) made by the probe
+        self.connects = 0
+        self.requests = 0
+
+        self.updateProps(timeout=timeout, maxBytes=maxBytes, maxIdle=maxIdle,
+                         maxRedirects=maxRedirects)
+
+    #---------------------------------------------------------------------------
+    def updateProps(self, timeout=None, maxBytes=None, maxIdle=None, maxRedirects=None):
+        if timeout is not None:
+            self.timeout = timeout
+
+        if maxBytes is not None:
+            self.maxBytes = maxBytes
+
+        if maxIdle is not None:
+            self.maxIdle = maxIdle
+
+        if maxRedirects is not None:
+            self.maxRedirects = maxRedirects
+
+    #---------------------------------------------------------------------------
+    # an idle connection that is readable has been closed by the server
+    def _isStale(self, conn):
+        if conn.sock is None: return True
+
+        try:
+            rlist, wlist, xlist = select.select([ conn.sock ], [], [], 0)
+        except (select.error, socket.error, ValueError):
+            return True
+
+        return (len(rlist) > 0)
+
+    #---------------------------------------------------------------------------
+    # returns (conn, reused) for the given host
+    def _getConnection(self, key):
+        self.poolLock.acquire()
+        idle = self.pool.get(key, list())
+
+        conn = None
+
+        while conn is None and len(idle) > 0:
+            conn = idle.pop()
+
+            if self._isStale(conn):
+                conn.close()
+                conn = None
+
+        self.poolLock.release()
+
+        if conn is not None: return (conn, True)
+
+        scheme, host, port = key
+
+        if scheme == 'https':
+            conn = httplib.HTTPSConnection(host, port, timeout=self.timeout)
+        else:
+            conn = httplib.HTTPConnection(host, port, timeout=self.timeout)
+
+        # connect to the cached address; TLS still verifies the host name
+        if self.resolver is not None:
+            conn._create_connection = self._createConnection
+
+        self.connects += 1
+
+        return (conn, False)
+
+    #---------------------------------------------------------------------------
+    # replaces socket.create_connection for connections made by the probe
+    def _createConnection(self, address, timeout, source_address=None):
+        host, port = address
+
+        result = self.resolver.resolve(host)
+        if result is None: raise socket.gaierror(u'cannot resolve %s' % host)
+
+        return socket.create_connection((result[1], port), timeout, source_address)
+
+    #---------------------------------------------------------------------------
+    def _releaseConnection(self, key, conn):
+        self.poolLock.acquire()
+        idle = self.pool.setdefault(key, list())
+
+        if len(idle) < self.maxIdle:
+            idle.append(conn)
+            conn = None
+
+        self.poolLock.release()
+
+        if conn is not None: conn.close()
+
+    #---------------------------------------------------------------------------
+    # close all idle connections
+    def close(self):
+        self.poolLock.acquire()
+
+        for idle in self.pool.values():
+            for conn in idle: conn.close()
+
+        self.pool.clear()
+        self.poolLock.release()
+
+    #---------------------------------------------------------------------------
+    # seconds left before the deadline; raises socket.timeout if there are none
+    def _getRemaining(self, deadline):
+        remaining = deadline - time.time()
+        if remaining <= 0: raise socket.timeout('deadline exceeded')
+
+        return remaining
+
+    #---------------------------------------------------------------------------
+    # send a single request; returns (status, location, bytesRead)
+    def _request(self, url, method, deadline, limited=True):
+        parts = urlparse.urlsplit(url)
+        scheme = parts.scheme.lower()
+
+        port = parts.port
+        if port is None: port = 443 if scheme == 'https' else 80
+
+        key = (scheme, parts.hostname, port)
+
+        path = parts.path or '/'
+        if parts.query: path += '?' + parts.query
+
+        headers = { 'User-Agent' : 'indigo-netdev', 'Accept' : '*/*' }
+
+        # ask for no more than we are willing to read
+        if method == 'GET' and limited and self.maxBytes > 0:
+            headers['Range'] = 'bytes=0-%d' % (self.maxBytes - 1)
+
+        conn, reused = self._getConnection(key)
+
+        try:
+            self.requests += 1
+            resp = self._send(conn, method, path, headers, deadline)
+
+        except (httplib.HTTPException, socket.error) as e:
+            conn.close()
+
+            # the server may have dropped the connection while it was idle
+            if not reused or isinstance(e, socket.timeout): raise
+
+            conn, reused = self._getConnection(key)
+            resp = self._send(conn, method, path, headers, deadline)
+
+        try:
+            body = resp.read(self.maxBytes)
+        except (httplib.HTTPException, socket.error):
+            body = ''
+            resp.close()
+
+        bytesRead = len(body) + sum([ len(line) for line in resp.msg.headers ])
+
+        # only reuse the connection if the whole response has been read
+        if resp.isclosed() and not resp.will_close:
+            self._releaseConnection(key, conn)
+        else:
+            conn.close()
+
+        return (resp.status, resp.getheader('location'), bytesRead)
+
+    #---------------------------------------------------------------------------
+    # every socket operation is limited to the time left before the deadline
+    def _send(self, conn, method, path, headers, deadline):
+        conn.timeout = self._getRemaining(deadline)
+        if conn.sock is not None: conn.sock.settimeout(conn.timeout)
+
+        conn.request(method, path, headers=headers)
+        conn.sock.settimeout(self._getRemaining(deadline))
+
+        return conn.getresponse()
+
+    #---------------------------------------------------------------------------
+    # probe the url using HEAD or a range-limited GET; redirects are followed
+    # and the whole probe must finish within the timeout
+    def probe(self, url, method='HEAD', timeout=None):
+        if timeout is None: timeout = self.timeout
+
+        startTime = time.time()
+        deadline = startTime + timeout
+
+        bytesRead = 0
+        status = None
+        timedOut = False
+
+        try:
+            for hop in range(self.maxRedirects + 1):
+                status, location, count = self._request(url, method, deadline)
+                bytesRead += count
+
+                if status in _METHOD_NOT_SUPPORTED and method == 'HEAD':
+                    self.logger.debug(u'HEAD not supported by %s; using GET', url)
+                    method = 'GET'
+                    status, location, count = self._request(url, method, deadline)
+                    bytesRead += count
+
+                # the page is there, it just does not have the bytes we asked for
+                if status == _RANGE_NOT_SATISFIABLE and method == 'GET':
+                    self.logger.debug(u'range not satisfiable for %s; using full GET', url)
+                    status, location, count = self._request(url, method, deadline, limited=False)
+                    bytesRead += count
+
+                if status not in _REDIRECTS or location is None: break
+
+                url = urlparse.urljoin(url, location)
+                self.logger.debug(u'redirected to %s', url)
+
+        except socket.timeout:
+            self.logger.warn(u'%s - timed out after %.1f sec', url, timeout)
+            status = None
+            timedOut = True
+
+        except (httplib.HTTPException, socket.error, ValueError) as e:
+            self.logger.warn(u'%s - %s', url, str(e))
+            status = None
+
+        latency = time.time() - startTime
+
+        return HttpResult(status, latency, bytesRead, url, timedOut)
@@ -0,0 +1,234 @@
+## in-process ICMP echo probes for Network Devices
+
+import logging
+import os
+import select
+import socket
+import struct
+import sys
+import threading
+import time
+
+ICMP_ECHO_REPLY = 0
+ICMP_ECHO_REQUEST = 8
+
+#-------------------------------------------------------------------------------
+# standard internet checksum (RFC 1071)
+def checksum(data):
+    if len(data) % 2: data += b'\x00'
+
+    total = sum(struct.unpack('!%dH' % (len(data) // 2), data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += (total >> 16)
+
+    return (~total) & 0xFFFF
+
+#-------------------------------------------------------------------------------
+def buildEchoRequest(ident, seq, payload=b'netdev-ping'):
+    header = struct.pack('!BBHHH', ICMP_ECHO_REQUEST, 0, 0, ident, seq)
+    csum = checksum(header + payload)
+
+    return struct.pack('!BBHHH', ICMP_ECHO_REQUEST, 0, csum, ident, seq) + payload
+
+#-------------------------------------------------------------------------------
+# returns (type, ident, seq) for an ICMP packet, which may include an IP header
+def parseEchoReply(data):
+    data = bytearray(data)
+
+    # raw sockets (and datagram sockets on macOS) include the IPv4 header
+    if len(data) >= 20 and (data[0] >> 4) == 4:
+        data = data[(data[0] & 0x0F) * 4:]
+
+    if len(data) < 8: return None
+
+    icmpType, code, csum, ident, seq = struct.unpack('!BBHHH', bytes(data[:8]))
+
+    return (icmpType, ident, seq)
+
+#-------------------------------------------------------------------------------
+# returns the identifier that replies on the socket will carry; datagram
+# sockets on linux replace ours with the local port of the socket, while other
+# systems (including macOS) send it unchanged
+def getReplyIdent(sock, ident, platform=sys.platform):
+    if sock.type == socket.SOCK_DGRAM and platform.startswith('linux'):
+        return sock.getsockname()[1]
+
+    return ident
+
+################################################################################
+# sends echo requests to many hosts from a single socket
+class IcmpProbe():
+
+    #---------------------------------------------------------------------------
+    def __init__(self, timeout=5, maxAge=60, resolver=None):
+        self.logger = logging.getLogger('Plugin.icmp.IcmpProbe')
+        self.seqLock = threading.Lock()
+        self.resultLock = threading.Lock()
+
+        # optional shared cache for host lookups; see resolver.Resolver
+        self.resolver = resolver
+
+        self.ident = os.getpid() & 0xFFFF
+        self.sequence = 0
+
+        # None until we know if the system will let us open a socket
+        self.supported = None
+
+        # results from the last sweep, consumed by getRoundTripTime
+        self.results = dict()
+
+        self.updateProps(timeout=timeout, maxAge=maxAge)
+
+    #---------------------------------------------------------------------------
+    def updateProps(self, timeout=None, maxAge=None):
+        if timeout is not None:
+            self.timeout = timeout
+
+        if maxAge is not None:
+            self.maxAge = maxAge
+
+    #---------------------------------------------------------------------------
+    # prefer unprivileged datagram sockets, fall back to a raw socket
+    def _openSocket(self):
+        for socktype in (socket.SOCK_DGRAM, socket.SOCK_RAW):
+            try:
+                sock = socket.socket(socket.AF_INET, socktype, socket.IPPROTO_ICMP)
+                return sock
+            except socket.error as e:
+                self.logger.debug(u'cannot open ICMP socket (%d) - %s', socktype, str(e))
+
+        return None
+
+    #---------------------------------------------------------------------------
+    def isSupported(self):
+        if self.supported is None:
+            sock = self._openSocket()
+            self.supported = (sock is not None)
+            if sock is not None: sock.close()
+
+        return self.supported
+
+    #---------------------------------------------------------------------------
+    # returns the IPv4 address for the host, or None if it cannot be resolved
+    def _resolve(self, host):
+        if self.resolver is not None:
+            result = self.resolver.resolve(host, socket.AF_INET)
+            return None if result is None else result[1]
+
+        try:
+            return socket.gethostbyname(host)
+        except socket.error as e:
+            self.logger.debug(u'cannot resolve %s - %s', host, str(e))
+
+        return None
+
+    #---------------------------------------------------------------------------
+    def _nextSequence(self):
+        self.seqLock.acquire()
+
+        self.sequence = (self.sequence + 1) & 0xFFFF
+        seq = self.sequence
+
+        self.seqLock.release()
+
+        return seq
+
+    #---------------------------------------------------------------------------
+    # ping all hosts at once; returns { host : round trip seconds or None };
+    # timeouts may give a different timeout for some hosts
+    def sweep(self, hosts, timeout=None, save=True, timeouts=None):
+        if timeout is None: timeout = self.timeout
+        if timeouts is None: timeouts = dict()
+
+        sock = self._openSocket()
+
+        if sock is None:
+            self.supported = False
+            return None
+
+        results = dict()
+        pending = dict()  # seq -> (host, ip, sendTime, deadline)
+
+        for host in set(hosts):
+            results[host] = None
+
+            ip = self._resolve(host)
+            if ip is None: continue
+
+            seq = self._nextSequence()
+            packet = buildEchoRequest(self.ident, seq)
+
+            try:
+                sock.sendto(packet, (ip, 0))
+                sendTime = time.time()
+                pending[seq] = (host, ip, sendTime, sendTime + timeouts.get(host, timeout))
+            except socket.error as e:
+                self.logger.debug(u'cannot send echo to %s - %s', host, str(e))
+
+        # the socket is bound by the first send, so the local port is known now;
+        # every socket sees replies meant for other probes in the process
+        if len(pending) > 0:
+            replyIdent = getReplyIdent(sock, self.ident)
+
+        while len(pending) > 0:
+            now = time.time()
+
+            # stop waiting for hosts that are past their deadline
+            for seq, entry in list(pending.items()):
+                if now >= entry[3]: pending.pop(seq)
+
+            if len(pending) == 0: break
+
+            remaining = min([ entry[3] for entry in pending.values() ]) - now
+
+            rlist, wlist, xlist = select.select([ sock ], [], [], remaining)
+            if len(rlist) == 0: continue
+
+            data, addr = sock.recvfrom(1024)
+            recvTime = time.time()
+
+            reply = parseEchoReply(data)
+            if reply is None: continue
+
+            icmpType, ident, seq = reply
+
+            if icmpType != ICMP_ECHO_REPLY: continue
+            if ident != replyIdent: continue
+            if seq not in pending: continue
+
+            host, ip, sendTime, deadline = pending[seq]
+            if addr[0] != ip: continue
+
+            pending.pop(seq)
+            results[host] = recvTime - sendTime
+
+        sock.close()
+
+        if save:
+            self.resultLock.acquire()
+            tstamp = time.time()
+
+            for host, rtt in results.items():
+                self.results[host] = (tstamp, rtt)
+
+            self.resultLock.release()
+
+        return results
+
+    #---------------------------------------------------------------------------
+    # use the result from a recent sweep if there is one, otherwise ping now;
+    # returns the round trip time in seconds or None if the host did not reply
+    def getRoundTripTime(self, host, timeout=None):
+        self.resultLock.acquire()
+        result = self.results.pop(host, None)
+        self.resultLock.release()
+
+        if result is not None:
+            tstamp, rtt = result
+            if (time.time() - tstamp) < self.maxAge:
+                return rtt
+
+        results = self.sweep([ host ], timeout=timeout, save=False)
+        if results is None: return None
+
+        return results[host]
@@ -1,18 +1,52 @@
 ## Indigo plugin for monitoring network devices
 
 import logging
+import os
 import socket
+import threading
+import time
 
 import iplug
 import arp
 import wrapper
 import clients
+import scheduler
+import snapshot
+import workers
 
 ################################################################################
 class Plugin(iplug.ThreadedPlugin):
 
     wrappers = dict()
     arp_cache = arp.ArpCache()
+    arp_listener = arp.NeighborListener(arp_cache)
+    pool = workers.WorkerPool()
+    schedule = scheduler.Scheduler()
+    warmup = scheduler.WarmupQueue()
+
+    refreshInterval = 60
+    updateBudget = 60
+    nextArpRefresh = 0
+    pollLocalDevices = True
+
+    # device id -> saved check results, from the last snapshot or a device that
+    # was stopped; see saveSnapshot
+    deviceSnapshots = dict()
+    snapshotInterval = 900
+    nextSnapshot = 0
+
+    # saved results older than this are dropped
+    snapshotMaxAge = 86400
+
+    #---------------------------------------------------------------------------
+    def startup(self):
+        iplug.ThreadedPlugin.startup(self)
+        self.loadSnapshot()
+
+    #---------------------------------------------------------------------------
+    def shutdown(self):
+        self.saveSnapshot()
+        iplug.ThreadedPlugin.shutdown(self)
 
     #---------------------------------------------------------------------------
     def validatePrefsConfigUi(self, values):
@@ -20,7 +54,20 @@ class Plugin(iplug.ThreadedPlugin):
 
         iplug.validateConfig_Int('threadLoopDelay', values, errors, min=60, max=3600)
         iplug.validateConfig_Int('connectionTimeout', values, errors, min=0, max=300)
+        iplug.validateConfig_Int('updateBudget', values, errors, min=1, max=3600)
+        iplug.validateConfig_Int('adaptiveTimeoutMin', values, errors, min=10, max=60000)
+        iplug.validateConfig_Int('adaptiveTimeoutMax', values, errors, min=1, max=300)
+        iplug.validateConfig_Int('backoffLimit', values, errors, min=0, max=604800)
+        iplug.validateConfig_Int('probeShareWindow', values, errors, min=0, max=300)
         iplug.validateConfig_Int('arpCacheTimeout', values, errors, min=1, max=1440)
+        iplug.validateConfig_Int('pollingThreads', values, errors, min=1, max=64)
+        iplug.validateConfig_Int('stateHeartbeat', values, errors, min=0, max=86400)
+        iplug.validateConfig_Int('httpMaxBytes', values, errors, min=0, max=1048576)
+        iplug.validateConfig_Int('sshControlPersist', values, errors, min=0, max=86400)
+        iplug.validateConfig_Int('externalAddressTTL', values, errors, min=60, max=604800)
+        iplug.validateConfig_Int('dnsCacheTTL', values, errors, min=0, max=86400)
+        iplug.validateConfig_Int('snapshotInterval', values, errors, min=0, max=86400)
+        iplug.validateConfig_Int('historyWindow', values, errors, min=1, max=168)
 
         return ((len(errors) == 0), values, errors)
 
@@ -28,6 +75,9 @@ class Plugin(iplug.ThreadedPlugin):
     def validateDeviceConfigUi(self, values, typeId, devId):
         errors = indigo.Dict()
 
+        # common to all device types; zero uses the plugin refresh interval
+        iplug.validateConfig_Int('pollInterval', values, errors, min=0, max=86400)
+
         if typeId == 'service':
             wrapper.Service.validateConfig(values, errors)
         elif typeId == 'ping':
@@ -52,68 +102,399 @@ class Plugin(iplug.ThreadedPlugin):
 
         wrap = None
 
-        if typeId == 'service':
-            wrap = wrapper.Service(device)
-        elif typeId == 'ping':
-            wrap = wrapper.Ping(device)
-        elif typeId == 'http':
-            wrap = wrapper.HTTP(device)
-        elif typeId == 'local':
-            wrap = wrapper.Local(device, self.arp_cache)
-        elif typeId == 'ssh':
-            wrap = wrapper.SSH(device)
-        elif typeId == 'macos':
-            wrap = wrapper.macOS(device)
-        elif typeId == 'external_ip':
-            wrap = wrapper.ExternalIP(device)
-        else:
-            self.logger.error(u'unknown device type: %s', typeId)
+        try:
+            if typeId == 'service':
+                wrap = wrapper.Service(device)
+            elif typeId == 'ping':
+                wrap = wrapper.Ping(device)
+            elif typeId == 'http':
+                wrap = wrapper.HTTP(device, self.arp_cache)
+            elif typeId == 'local':
+                wrap = wrapper.Local(device, self.arp_cache)
+                wrap.subscribe(self.pushUpdate)
+            elif typeId == 'ssh':
+                wrap = wrapper.SSH(device, self.arp_cache)
+            elif typeId == 'macos':
+                wrap = wrapper.macOS(device, self.arp_cache)
+            elif typeId == 'external_ip':
+                wrap = wrapper.ExternalIP(device)
+            else:
+                self.logger.error(u'unknown device type: %s', typeId)
+
+        except ValueError as e:
+            self.logger.error(u'cannot start device %s - %s', device.name, str(e))
 
         self.wrappers[device.id] = wrap
 
-        # XXX we might want to make sure the device status is updated here...
-        # the problem with that is it makes for a long plugin startup if all
-        # devices update status - especially things like ping and http.
-        # !! when status is updated here, start the thread loop with a sleep !!
-        #if device.configured: wrap.updateStatus()
+        # the first update is queued for the warm-up workers rather than run
+        # here, so startup does not wait on any device; see runLoopStep
+        if wrap is not None:
+            wrap.pollInterval = self._getPollInterval(device)
+            saved = self.deviceSnapshots.pop(device.id, None)
+
+            # a device that was checked just before a restart keeps its result
+            # and its place in the schedule
+            if saved is not None and wrap.loadSnapshot(saved):
+                interval = wrap.getPollInterval()
+                delay = max(wrap.lastCheck + interval - time.time(), 0)
+                self.schedule.add(device.id, interval, delay=delay)
+            else:
+                self.warmup.add(device.id, wrap.warmupPriority, self.warmUpDevice, wrap)
+                self.schedule.add(device.id, wrap.pollInterval)
 
     #---------------------------------------------------------------------------
     def deviceStopComm(self, device):
         iplug.ThreadedPlugin.deviceStopComm(self, device)
-        self.wrappers.pop(device.id, None)
+
+        wrap = self.wrappers.pop(device.id, None)
+
+        if wrap is not None:
+            wrap.stop()
+
+            saved = wrap.getSnapshot()
+            if saved is not None: self.deviceSnapshots[device.id] = saved
+
+        self.warmup.remove(device.id)
+        self.schedule.remove(device.id)
+
+    #---------------------------------------------------------------------------
+    def _getPollInterval(self, device):
+        interval = int(device.pluginProps.get('pollInterval', 0) or 0)
+        if interval <= 0: interval = self.refreshInterval
+
+        return interval
 
     #---------------------------------------------------------------------------
     def loadPluginPrefs(self, prefs):
         iplug.ThreadedPlugin.loadPluginPrefs(self, prefs)
 
-        # global socket connection timeout - XXX does this affect all modules?
+        # devices without their own poll interval use the refresh interval
+        self.refreshInterval = self.getPrefAsInt(prefs, 'threadLoopDelay', 60)
+
+        for id, wrap in self.wrappers.items():
+            if wrap is None: continue
+
+            wrap.pollInterval = self._getPollInterval(wrap.device)
+            self.schedule.setInterval(id, wrap.getPollInterval())
+
+        # each check gets its own timeout, limited by the time left for the
+        # round of updates it belongs to; nothing relies on a global default
         sockTimeout = self.getPrefAsInt(prefs, 'connectionTimeout', 5)
-        socket.setdefaulttimeout(sockTimeout)
+        self.updateBudget = self.getPrefAsInt(prefs, 'updateBudget', 60)
+        clients.ClientBase.timeout = sockTimeout
+
+        # once a client has measured its host, the timeout follows the round
+        # trip time within these limits; the minimum is given in milliseconds
+        clients.RttEstimator.minTimeout = self.getPrefAsInt(prefs, 'adaptiveTimeoutMin', 250) / 1000.0
+        clients.RttEstimator.maxTimeout = self.getPrefAsInt(prefs, 'adaptiveTimeoutMax', 30)
+        clients.tcpProbe.updateProps(timeout=sockTimeout)
+        clients.icmpProbe.updateProps(timeout=sockTimeout)
+
+        # HTTP devices only read this much of the response body
+        httpMaxBytes = self.getPrefAsInt(prefs, 'httpMaxBytes', 4096)
+        clients.httpProbe.updateProps(timeout=sockTimeout, maxBytes=httpMaxBytes)
+
+        # devices checking the same target within this window share one probe
+        clients.probes.updateProps(window=self.getPrefAsInt(prefs, 'probeShareWindow', 5))
+
+        # host lookups are shared by all devices and refreshed before they expire
+        clients.dnsCache.updateProps(ttl=self.getPrefAsInt(prefs, 'dnsCacheTTL', 300))
+        clients.dnsCache.clear()
+
+        # SSH devices share one connection per host for this long when idle
+        clients.SSHClient.controlPersist = self.getPrefAsInt(prefs, 'sshControlPersist', 600)
+
+        # the external address is only looked up when the local address changes
+        # or the cached value expires; providers are given as comma separated urls
+        providers = dict()
+
+        for family, prefName in (('ipv4', 'externalIPv4Providers'), ('ipv6', 'externalIPv6Providers')):
+            urls = self.getPref(prefs, prefName, '') or ''
+            providers[family] = [ url.strip() for url in urls.split(',') if url.strip() ]
+
+        clients.externalAddress.updateProps(
+            ttl=self.getPrefAsInt(prefs, 'externalAddressTTL', 3600),
+            timeout=sockTimeout, providers=providers
+        )
+        clients.externalAddress.invalidate()
 
         # setup the arp cache with configured timeout
         arpTimeout = self.getPrefAsInt(prefs, 'arpCacheTimeout', 5)
-        arpCommand = self.getPref(prefs, 'arpCacheCommand', '/usr/sbin/arp -a')
+        arpCommand = self.getPref(prefs, 'arpCacheCommand', arp.DEFAULT_ARP_COMMAND)
+        arpSource = self.getPref(prefs, 'arpCacheSource', 'auto')
 
         # we cannot simply create a new ArpCache here since the instance is
         # passed to device wrappers during plugin initialization, so we just
         # update the properties of the table instead...
-        self.arp_cache.updateProps(timeout=arpTimeout, cmd=arpCommand)
+        self.arp_cache.updateProps(timeout=arpTimeout, cmd=arpCommand, source=arpSource)
+
+        # apply neighbor changes as they happen (linux only); the regular
+        # refresh still runs to pick up anything the listener missed
+        if self.getPref(prefs, 'arpListener', False):
+            self.arp_listener.start()
+        else:
+            self.arp_listener.stop()
+
+        # local devices are updated by the ARP cache as they come and go, so
+        # polling them is only needed as a safety net
+        self.pollLocalDevices = self.getPref(prefs, 'pollLocalDevices', True)
+
+        # number of devices that may be updated at the same time
+        poolSize = self.getPrefAsInt(prefs, 'pollingThreads', 8)
+        self.pool.resize(poolSize)
+        self.warmup.resize(poolSize)
+
+        # unchanged states are not sent to the server, except for lastActiveAt
+        # which is refreshed at this interval (shared by all wrappers)
+        wrapper.DeviceWrapper.heartbeat = self.getPrefAsInt(prefs, 'stateHeartbeat', 300)
+
+        # devices that keep failing are checked less often, up to this interval
+        wrapper.DeviceWrapper.backoffLimit = self.getPrefAsInt(prefs, 'backoffLimit', 3600)
+
+        # uptime and round trip states cover this many hours of history
+        wrapper.DeviceWrapper.historyWindow = self.getPrefAsInt(prefs, 'historyWindow', 24) * 3600
+
+        # the ARP table and last results are saved at this interval and when the
+        # plugin stops (0 = only when the plugin stops)
+        self.snapshotInterval = self.getPrefAsInt(prefs, 'snapshotInterval', 900)
+        self.nextSnapshot = time.time() + self.snapshotInterval
+
+    #---------------------------------------------------------------------------
+    # probe all plain TCP and ping targets in batches before devices are updated
+    def sweepTargets(self, wrappers, deadline):
+        services = dict()
+        hosts = dict()
+
+        # resolve any new or expired names together rather than one at a time
+        clients.dnsCache.prefetch([ wrap.client.address for wrap in wrappers
+                                    if isinstance(wrap.client, (clients.ServiceClient, clients.PingClient)) ],
+                                  socket.AF_INET)
+
+        # each target waits as long as its own client would
+        for wrap in wrappers:
+
+            if isinstance(wrap.client, clients.ServiceClient):
+                target = wrap.client.getProbeTarget()
+                if target is not None: services[target] = wrap.client.getTimeout(deadline)
+
+            elif isinstance(wrap.client, clients.PingClient):
+                hosts[wrap.client.address] = wrap.client.getTimeout(deadline)
+
+        timeout = min(clients.ClientBase.timeout, max(deadline - time.time(), 0))
+
+        if len(services) > 0:
+            clients.tcpProbe.sweep(services.keys(), timeout, timeouts=services)
+
+        if len(hosts) > 0 and clients.icmpProbe.isSupported():
+            clients.icmpProbe.sweep(hosts.keys(), timeout, timeouts=hosts)
+
+    #---------------------------------------------------------------------------
+    # update the given devices in the worker pool; all checks must finish
+    # within the update budget, so one slow device cannot hold up the loop
+    def updateDevices(self, deviceIds, wait=False):
+        startTime = time.time()
+        deadline = startTime + self.updateBudget
+        wrappers = dict()
+
+        # checks from the last round have (mostly) finished by now
+        stats = clients.probes.getStats(reset=True)
+
+        if stats['probes'] > 0:
+            self.logger.debug(u'last round: %d probes run, %d shared between devices',
+                              stats['probes'], stats['shared'])
+
+        for id in deviceIds:
+            wrap = self.wrappers.get(id)
+            if wrap is None: continue
+
+            # the warm-up will give this device its first state
+            if self.warmup.isPending(id): continue
+
+            # a device that is still updating from a previous round is late;
+            # the scheduler reports it, so we just skip it this time
+            if self.pool.isBusy(id):
+                self.logger.debug(u'%s is still updating; skipping', wrap.device.name)
+                continue
+
+            wrappers[id] = wrap
+
+        self.sweepTargets(wrappers.values(), deadline)
+
+        for id, wrap in wrappers.items():
+            self.pool.submit(id, self.updateDevice, wrap, deadline)
+
+        if wait:
+            self.pool.join()
+
+            self.logger.debug(u'refreshed %d devices in %.3f sec',
+                              len(wrappers), time.time() - startTime)
+
+    #---------------------------------------------------------------------------
+    # runs in the worker pool; the schedule follows any change in backoff
+    def updateDevice(self, wrap, deadline=None):
+        wrap.updateStatus(deadline)
+
+        interval = wrap.getPollInterval()
+
+        if self.schedule.updateInterval(wrap.device.id, interval):
+            self.logger.debug(u'%s: next update in %d sec', wrap.device.name, interval)
+
+    #---------------------------------------------------------------------------
+    # runs in the warm-up queue; the update itself goes through the worker pool
+    # so it never overlaps another update for the same device
+    def warmUpDevice(self, wrap):
+        done = threading.Event()
+        deadline = time.time() + self.updateBudget
+
+        self.pool.submit(wrap.device.id, self._warmUpDevice, wrap, deadline, done)
+        done.wait()
+
+    #---------------------------------------------------------------------------
+    def _warmUpDevice(self, wrap, deadline, done):
+        try:
+            self.updateDevice(wrap, deadline)
+        finally:
+            done.set()
+
+    #---------------------------------------------------------------------------
+    # update a single device outside of the regular schedule
+    def pushUpdate(self, wrap):
+        self.logger.debug(u'presence changed: %s', wrap.device.name)
+        self.pool.submit(wrap.device.id, self.updateDevice, wrap)
+
+    #---------------------------------------------------------------------------
+    # devices that are backing off are checked right away if their address
+    # shows up in the ARP table again
+    def wakeArrivedDevices(self, addrs):
+        ipAddrs = set(self.arp_cache.getIpAddresses(addrs))
+        if len(ipAddrs) == 0: return
+
+        for id, wrap in self.wrappers.items():
+            if wrap is None or wrap.backoffLevel == 0: continue
+
+            host = wrap.getHostAddress()
+            if host is None: continue
+
+            result = clients.dnsCache.resolve(host, socket.AF_INET)
+            if result is None or result[1] not in ipAddrs: continue
+
+            self.logger.debug(u'%s: found in ARP table; checking now', wrap.device.name)
+
+            wrap.resetBackoff()
+            self.schedule.reschedule(id, delay=0, interval=wrap.getPollInterval())
 
     #---------------------------------------------------------------------------
     def refreshAllDevices(self):
         # update all enabled and configured devices
-        for id in self.wrappers:
-            wrap = self.wrappers[id]
-            wrap.updateStatus()
+        self.updateDevices(list(self.wrappers.keys()), wait=True)
 
     #---------------------------------------------------------------------------
     def rebuildArpCache(self):
         self.arp_cache.rebuildArpCache()
 
+    #---------------------------------------------------------------------------
+    # the snapshot is kept next to the plugin preferences
+    def _getSnapshotPath(self):
+        folder = os.path.join(indigo.server.getInstallFolderPath(), 'Preferences', 'Plugins')
+        return os.path.join(folder, '%s.snapshot' % self.pluginId)
+
+    #---------------------------------------------------------------------------
+    # save the ARP table and the last result for each device
+    def saveSnapshot(self):
+        now = time.time()
+        devices = dict()
+
+        for id, saved in self.deviceSnapshots.items():
+            if now - saved['lastCheck'] < self.snapshotMaxAge:
+                devices[str(id)] = saved
+
+        for id, wrap in self.wrappers.items():
+            if wrap is None: continue
+
+            saved = wrap.getSnapshot()
+            if saved is not None: devices[str(id)] = saved
+
+        data = {
+            'arp' : self.arp_cache.getSnapshot(),
+            'devices' : devices
+        }
+
+        snapshot.save(self._getSnapshotPath(), data)
+
+    #---------------------------------------------------------------------------
+    # restore the last snapshot; entries that have since expired are skipped
+    def loadSnapshot(self):
+        data = snapshot.load(self._getSnapshotPath())
+        if data is None: return
+
+        count = self.arp_cache.loadSnapshot(data.get('arp', list()))
+
+        self.deviceSnapshots = dict([ (int(id), saved)
+                                      for id, saved in data.get('devices', dict()).items() ])
+
+        self.logger.debug(u'restored %d ARP entries and %d device results',
+                          count, len(self.deviceSnapshots))
+
+    #---------------------------------------------------------------------------
+    def logResolverStats(self):
+        stats = clients.dnsCache.getStats()
+
+        self.logger.info(u'DNS cache: %d entries, %d hits, %d misses, %d negative hits',
+                         stats['entries'], stats['hits'], stats['misses'], stats['negativeHits'])
+        self.logger.info(u'DNS cache: %.1f%% hit rate, %d failures, %d refreshes, %.1f ms per lookup',
+                         stats['hitRate'] * 100, stats['failures'], stats['refreshes'],
+                         stats['avgLookupTime'] * 1000)
+
+    #---------------------------------------------------------------------------
+    def logProbeStats(self):
+        stats = clients.probes.getStats()
+
+        total = stats['totalProbes'] + stats['totalShared']
+        saved = (float(stats['totalShared']) / total) if total else 0.0
+
+        self.logger.info(u'Probes: %d run, %d shared between devices (%.1f%% saved)',
+                         stats['totalProbes'], stats['totalShared'], saved * 100)
+
+        stats = self.warmup.getStats()
+
+        self.logger.info(u'Warm-up: %d devices, first state in %.1f sec avg, %.1f sec max (%d pending)',
+                         stats['finished'], stats['avgWait'], stats['maxWait'], stats['pending'])
+
+    #---------------------------------------------------------------------------
+    # wake up whenever the next device is due rather than on a fixed delay
+    def runConcurrentThread(self):
+        try:
+            while True:
+                self.runLoopStep()
+                self.sleep(self.schedule.getNextDelay(self.refreshInterval))
+        except self.StopThread:
+            pass
+
     #---------------------------------------------------------------------------
     def runLoopStep(self):
-        self.arp_cache.refreshArpCache()
-        self.refreshAllDevices()
+        now = time.time()
+
+        # the ARP table is shared by all devices, so it follows the plugin interval
+        if now >= self.nextArpRefresh:
+            diff = self.arp_cache.refreshArpCache()
+            self.wakeArrivedDevices(diff.arrived)
+            self.nextArpRefresh = now + self.refreshInterval
+
+        # local devices need the ARP table, so warm-up waits for the first read
+        self.warmup.start()
+
+        if self.snapshotInterval > 0 and now >= self.nextSnapshot:
+            self.saveSnapshot()
+            self.nextSnapshot = now + self.snapshotInterval
+
+        dueIds = self.schedule.popDue(now)
+
+        if not self.pollLocalDevices:
+            dueIds = [ id for id in dueIds
+                       if not isinstance(self.wrappers.get(id), wrapper.Local) ]
+
+        if len(dueIds) > 0:
+            self.updateDevices(dueIds)
 
     #---------------------------------------------------------------------------
     # Relay / Dimmer Action callback
@@ -148,7 +529,7 @@ class Plugin(iplug.ThreadedPlugin):
 
         #### STATUS REQUEST ####
         if act == indigo.kDeviceGeneralAction.RequestStatus:
-            wrap.updateStatus()
+            self.pool.submit(device.id, self.updateDevice, wrap)
 
         #### BEEP ####
         elif act == indigo.kDeviceGeneralAction.Beep:
@@ -0,0 +1,218 @@
+## shared DNS resolution cache for Network Devices
+
+import logging
+import socket
+import threading
+import time
+
+#-------------------------------------------------------------------------------
+# returns the address family if the host is already a literal IP address
+def getAddressFamily(host):
+    for family in (socket.AF_INET, socket.AF_INET6):
+        try:
+            socket.inet_pton(family, host)
+            return family
+        except (socket.error, TypeError, ValueError, UnicodeError):
+            pass
+
+    return None
+
+#-------------------------------------------------------------------------------
+# default lookup; returns a list of (family, address) for the host
+def getaddrinfo(host, family=socket.AF_UNSPEC):
+    results = list()
+
+    for info in socket.getaddrinfo(host, None, family, socket.SOCK_STREAM):
+        entry = (info[0], info[4][0])
+        if entry not in results: results.append(entry)
+
+    return results
+
+################################################################################
+# caches host lookups for all clients; entries are refreshed in the background
+# before they expire so a slow resolver does not hold up device updates
+class Resolver():
+
+    #---------------------------------------------------------------------------
+    def __init__(self, ttl=300, negativeTtl=30, refreshAhead=0.8, lookup=getaddrinfo):
+        self.logger = logging.getLogger('Plugin.resolver.Resolver')
+        self.cacheLock = threading.Lock()
+
+        # lookup(host, family) returns a list of (family, address)
+        self.lookup = lookup
+
+        # (host, family) -> (results, tstamp); results is empty for failures
+        self.cache = dict()
+
+        # keys currently being refreshed in the background
+        self.refreshing = set()
+
+        self.resetStats()
+        self.updateProps(ttl=ttl, negativeTtl=negativeTtl, refreshAhead=refreshAhead)
+
+    #---------------------------------------------------------------------------
+    def updateProps(self, ttl=None, negativeTtl=None, refreshAhead=None):
+        if ttl is not None:
+            self.ttl = ttl
+
+        if negativeTtl is not None:
+            self.negativeTtl = negativeTtl
+
+        if refreshAhead is not None:
+            self.refreshAhead = refreshAhead
+
+    #---------------------------------------------------------------------------
+    def resetStats(self):
+        self.hits = 0
+        self.misses = 0
+        self.negativeHits = 0
+        self.failures = 0
+        self.refreshes = 0
+        self.lookupTime = 0.0
+
+    #---------------------------------------------------------------------------
+    # returns a dict of counters and derived rates
+    def getStats(self):
+        lookups = self.hits + self.misses
+        requests = lookups + self.negativeHits
+        resolved = self.misses + self.refreshes
+
+        return {
+            'entries' : len(self.cache),
+            'hits' : self.hits,
+            'misses' : self.misses,
+            'negativeHits' : self.negativeHits,
+            'failures' : self.failures,
+            'refreshes' : self.refreshes,
+            'hitRate' : (float(self.hits + self.negativeHits) / requests) if requests else 0.0,
+            'avgLookupTime' : (self.lookupTime / resolved) if resolved else 0.0
+        }
+
+    #---------------------------------------------------------------------------
+    # run the real lookup and store the result; returns the results list
+    def _lookup(self, key):
+        host, family = key
+        startTime = time.time()
+
+        try:
+            results = self.lookup(host, family)
+        except (socket.error, UnicodeError) as e:
+            self.logger.debug(u'cannot resolve %s - %s', host, str(e))
+            results = list()
+
+        elapsed = time.time() - startTime
+
+        self.cacheLock.acquire()
+
+        self.lookupTime += elapsed
+        if len(results) == 0: self.failures += 1
+
+        self.cache[key] = (results, time.time())
+        self.refreshing.discard(key)
+
+        self.cacheLock.release()
+
+        self.logger.debug(u'resolved %s in %.3f sec - %s', host, elapsed, results)
+
+        return results
+
+    #---------------------------------------------------------------------------
+    def _refresh(self, key):
+        self.cacheLock.acquire()
+        self.refreshes += 1
+        self.cacheLock.release()
+
+        self._lookup(key)
+
+    #---------------------------------------------------------------------------
+    # failed lookups are kept for a shorter time than good ones
+    def _isFresh(self, entry, now):
+        results, tstamp = entry
+        ttl = self.ttl if len(results) > 0 else min(self.ttl, self.negativeTtl)
+
+        return (now - tstamp) < ttl
+
+    #---------------------------------------------------------------------------
+    # returns all (family, address) results for the host; empty if unknown
+    def resolveAll(self, host, family=socket.AF_UNSPEC):
+        literal = getAddressFamily(host)
+
+        if literal is not None:
+            return [ (literal, host) ]
+
+        key = (host, family)
+        now = time.time()
+
+        self.cacheLock.acquire()
+        entry = self.cache.get(key)
+
+        if entry is not None and self._isFresh(entry, now):
+            results, tstamp = entry
+
+            if len(results) == 0:
+                self.negativeHits += 1
+                self.cacheLock.release()
+                return results
+
+            self.hits += 1
+
+            # refresh entries that are close to expiring in the background
+            age = now - tstamp
+            startRefresh = (age >= self.ttl * self.refreshAhead and key not in self.refreshing)
+            if startRefresh: self.refreshing.add(key)
+
+            self.cacheLock.release()
+
+            if startRefresh:
+                thread = threading.Thread(target=self._refresh, args=(key,))
+                thread.daemon = True
+                thread.start()
+
+            return results
+
+        self.misses += 1
+        self.cacheLock.release()
+
+        return self._lookup(key)
+
+    #---------------------------------------------------------------------------
+    # returns the first (family, address) for the host or None
+    def resolve(self, host, family=socket.AF_UNSPEC):
+        results = self.resolveAll(host, family)
+        if len(results) == 0: return None
+
+        return results[0]
+
+    #---------------------------------------------------------------------------
+    # look up several hosts at once so cache misses do not add up
+    def prefetch(self, hosts, family=socket.AF_UNSPEC, maxThreads=16):
+        if self.ttl <= 0: return
+
+        now = time.time()
+        pending = list()
+
+        self.cacheLock.acquire()
+
+        for host in set(hosts):
+            if getAddressFamily(host) is not None: continue
+
+            entry = self.cache.get((host, family))
+            if entry is None or not self._isFresh(entry, now):
+                pending.append(host)
+
+        self.cacheLock.release()
+
+        while len(pending) > 0:
+            batch = pending[:maxThreads]
+            pending = pending[maxThreads:]
+
+            threads = [ threading.Thread(target=self.resolveAll, args=(host, family)) for host in batch ]
+
+            for thread in threads: thread.start()
+            for thread in threads: thread.join()
+
+    #---------------------------------------------------------------------------
+    def clear(self):
+        self.cacheLock.acquire()
+        self.cache.clear()
+        self.cacheLock.release()
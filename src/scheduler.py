@@ -0,0 +1,348 @@
+## schedules periodic device updates for Network Devices
+
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+
+#-------------------------------------------------------------------------------
+# the highest backoff level that keeps the interval within the limit (in
+# seconds); a limit of 0 disables backoff
+def getMaxBackoffLevel(interval, limit):
+    if interval <= 0 or limit <= 0: return 0
+
+    level = 0
+
+    while (interval << (level + 1)) <= limit:
+        level += 1
+
+    return level
+
+#-------------------------------------------------------------------------------
+# the backoff level after a number of failed checks in a row; the interval
+# doubles for each failure past the threshold, as long as it stays within the
+# limit, and goes back to the base interval after a successful check
+def getBackoffLevel(failures, threshold, interval, limit):
+    steps = max(failures - threshold + 1, 0)
+
+    return min(steps, getMaxBackoffLevel(interval, limit))
+
+################################################################################
+# keeps the next due time for each key in a heap; keys are spread across their
+# interval when added so updates do not all fire at once
+class Scheduler():
+
+    #---------------------------------------------------------------------------
+    def __init__(self, tolerance=5):
+        self.logger = logging.getLogger('Plugin.scheduler.Scheduler')
+        self.lock = threading.Lock()
+
+        # heap of (due, count, key); stale items are skipped when popped
+        self.queue = list()
+        self.counter = itertools.count()
+
+        # key -> (due, interval) for all scheduled keys
+        self.entries = dict()
+
+        # how late (in seconds) an update may run before it is reported
+        self.tolerance = tolerance
+        self.lateCount = 0
+
+    #---------------------------------------------------------------------------
+    def __len__(self): return len(self.entries)
+    def __contains__(self, key): return key in self.entries
+
+    #---------------------------------------------------------------------------
+    def _push(self, key, due, interval):
+        # lock must be held by caller
+        self.entries[key] = (due, interval)
+        heapq.heappush(self.queue, (due, next(self.counter), key))
+
+    #---------------------------------------------------------------------------
+    # schedule a key; by default the first update is at a random offset within
+    # the interval to spread the load
+    def add(self, key, interval, delay=None):
+        if delay is None: delay = random.uniform(0, interval)
+
+        self.lock.acquire()
+        self._push(key, time.time() + delay, interval)
+        self.lock.release()
+
+    #---------------------------------------------------------------------------
+    def remove(self, key):
+        self.lock.acquire()
+        self.entries.pop(key, None)
+        self.lock.release()
+
+    #---------------------------------------------------------------------------
+    # move the next update for a key; the interval is unchanged unless given
+    def reschedule(self, key, delay=0, interval=None):
+        self.lock.acquire()
+
+        entry = self.entries.get(key)
+
+        if entry is not None:
+            due, current = entry
+            if interval is None: interval = current
+            self._push(key, time.time() + delay, interval)
+
+        self.lock.release()
+
+    #---------------------------------------------------------------------------
+    # when the interval for a key has changed (e.g. by backing off), the next
+    # update is one new interval from now; returns True if it was rescheduled
+    def updateInterval(self, key, interval):
+        current = self.getInterval(key)
+        if current is None or current == interval: return False
+
+        self.reschedule(key, delay=interval, interval=interval)
+
+        return True
+
+    #---------------------------------------------------------------------------
+    # change the interval for a key without disturbing its place in the queue,
+    # unless the new interval means it should run sooner
+    def setInterval(self, key, interval):
+        self.lock.acquire()
+
+        entry = self.entries.get(key)
+
+        if entry is not None:
+            due = min(entry[0], time.time() + interval)
+            self._push(key, due, interval)
+
+        self.lock.release()
+
+    #---------------------------------------------------------------------------
+    def getInterval(self, key):
+        entry = self.entries.get(key)
+        if entry is None: return None
+
+        return entry[1]
+
+    #---------------------------------------------------------------------------
+    # seconds until the next key is due, limited to maxDelay
+    def getNextDelay(self, maxDelay, now=None):
+        if now is None: now = time.time()
+
+        self.lock.acquire()
+
+        # drop stale items from the top of the heap
+        while len(self.queue) > 0:
+            due, count, key = self.queue[0]
+            if self.entries.get(key, (None,))[0] == due: break
+            heapq.heappop(self.queue)
+
+        delay = maxDelay
+
+        if len(self.queue) > 0:
+            delay = min(max(self.queue[0][0] - now, 0), maxDelay)
+
+        self.lock.release()
+
+        return delay
+
+    #---------------------------------------------------------------------------
+    # returns all keys that are due and schedules their next update
+    def popDue(self, now=None):
+        if now is None: now = time.time()
+
+        dueKeys = list()
+
+        self.lock.acquire()
+
+        while len(self.queue) > 0 and self.queue[0][0] <= now:
+            due, count, key = heapq.heappop(self.queue)
+
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != due: continue
+
+            interval = entry[1]
+            late = now - due
+
+            if late > self.tolerance:
+                self.lateCount += 1
+                self.logger.warn(u'update for %s is running %.1f sec late', key, late)
+
+            # stay on the original cadence unless a whole interval was missed,
+            # in which case skip ahead rather than letting updates pile up
+            nextDue = due + interval
+            if nextDue <= now: nextDue = now + interval
+
+            self._push(key, nextDue, interval)
+            dueKeys.append(key)
+
+        self.lock.release()
+
+        return dueKeys
+
+################################################################################
+# runs the first update for each key in the background, lowest priority first,
+# with a limited number of workers; nothing runs until the queue is started,
+# and the workers exit whenever the queue is empty
+class WarmupQueue():
+
+    #---------------------------------------------------------------------------
+    def __init__(self, size=4):
+        self.logger = logging.getLogger('Plugin.scheduler.WarmupQueue')
+        self.lock = threading.Condition()
+
+        # heap of (priority, count, key); removed keys are skipped when popped
+        self.queue = list()
+        self.counter = itertools.count()
+
+        # key -> (count, func, args, addedAt) for keys waiting to run
+        self.pending = dict()
+
+        # keys that are running now
+        self.active = set()
+
+        self.size = size
+        self.workers = 0
+        self.running = False
+
+        # seconds from add to the end of the first update, for finished keys
+        self.finished = 0
+        self.totalWait = 0.0
+        self.maxWait = 0.0
+
+    #---------------------------------------------------------------------------
+    def __len__(self): return len(self.pending)
+
+    #---------------------------------------------------------------------------
+    def resize(self, size):
+        self.lock.acquire()
+        self.size = size
+        self._startWorkers()
+        self.lock.release()
+
+    #---------------------------------------------------------------------------
+    # start working through the queue; keys added later run as they arrive
+    def start(self):
+        self.lock.acquire()
+
+        if not self.running:
+            self.logger.debug(u'starting warm-up: %d pending', len(self.pending))
+            self.running = True
+            self._startWorkers()
+
+        self.lock.release()
+
+    #---------------------------------------------------------------------------
+    def _startWorkers(self):
+        # lock must be held by caller
+        if not self.running: return
+
+        while self.workers < self.size and self.workers < len(self.pending):
+            worker = threading.Thread(target=self._run)
+            worker.daemon = True
+            worker.start()
+
+            self.workers += 1
+
+    #---------------------------------------------------------------------------
+    # queue the first update for a key, replacing any that has not run yet
+    def add(self, key, priority, func, *args):
+        self.lock.acquire()
+
+        count = next(self.counter)
+        self.pending[key] = (count, func, args, time.time())
+        heapq.heappush(self.queue, (priority, count, key))
+
+        self._startWorkers()
+        self.lock.release()
+
+    #---------------------------------------------------------------------------
+    def remove(self, key):
+        self.lock.acquire()
+        self.pending.pop(key, None)
+        self.lock.notify_all()
+        self.lock.release()
+
+    #---------------------------------------------------------------------------
+    # true if the key is waiting for (or running) its first update
+    def isPending(self, key):
+        self.lock.acquire()
+        pending = (key in self.pending or key in self.active)
+        self.lock.release()
+
+        return pending
+
+    #---------------------------------------------------------------------------
+    def join(self):
+        self.lock.acquire()
+
+        while len(self.pending) > 0 or len(self.active) > 0:
+            self.lock.wait()
+
+        self.lock.release()
+
+    #---------------------------------------------------------------------------
+    # returns the number of finished keys and their wait for a first update
+    def getStats(self):
+        self.lock.acquire()
+
+        stats = {
+            'finished' : self.finished,
+            'pending' : len(self.pending) + len(self.active),
+            'avgWait' : (self.totalWait / self.finished) if self.finished else 0.0,
+            'maxWait' : self.maxWait
+        }
+
+        self.lock.release()
+
+        return stats
+
+    #---------------------------------------------------------------------------
+    def _next(self):
+        # lock must be held by caller
+        while len(self.queue) > 0:
+            priority, count, key = heapq.heappop(self.queue)
+
+            entry = self.pending.get(key)
+            if entry is None or entry[0] != count: continue
+
+            del self.pending[key]
+
+            return (key, entry)
+
+        return (None, None)
+
+    #---------------------------------------------------------------------------
+    def _run(self):
+        self.lock.acquire()
+
+        while True:
+            key, entry = self._next()
+            if key is None: break
+
+            count, func, args, addedAt = entry
+
+            self.active.add(key)
+            self.lock.release()
+
+            try:
+                func(*args)
+            except Exception as e:
+                self.logger.error(u'warm-up for %s failed: %s', key, str(e))
+
+            wait = time.time() - addedAt
+
+            self.lock.acquire()
+            self.active.discard(key)
+
+            self.finished += 1
+            self.totalWait += wait
+            self.maxWait = max(self.maxWait, wait)
+
+            if len(self.pending) == 0 and len(self.active) == 0:
+                self.logger.debug(u'warm-up finished: %d devices; first state in %.3f sec avg, %.3f sec max',
+                                  self.finished, self.totalWait / self.finished, self.maxWait)
+
+            self.lock.notify_all()
+
+        self.workers -= 1
+        self.lock.notify_all()
+        self.lock.release()
@@ -0,0 +1,67 @@
+## saves plugin state between restarts for Network Devices
+
+import json
+import logging
+import os
+import tempfile
+import time
+import zlib
+
+# files written with a different version are ignored
+VERSION = 1
+
+logger = logging.getLogger('Plugin.snapshot')
+
+#-------------------------------------------------------------------------------
+# write the data as compressed JSON; the file is replaced in a single step so
+# a crash while saving leaves the last snapshot in place
+def save(path, data):
+    data = dict(data)
+    data['version'] = VERSION
+    data['savedAt'] = time.time()
+
+    raw = zlib.compress(json.dumps(data, separators=(',', ':')))
+
+    folder = os.path.dirname(path) or '.'
+    tmpPath = None
+
+    try:
+        fd, tmpPath = tempfile.mkstemp(prefix='.snapshot-', dir=folder)
+
+        with os.fdopen(fd, 'wb') as fp:
+            fp.write(raw)
+
+        os.rename(tmpPath, path)
+
+    except (IOError, OSError) as e:
+        logger.warn(u'cannot save snapshot %s - %s', path, str(e))
+
+        if tmpPath is not None and os.path.exists(tmpPath): os.remove(tmpPath)
+
+        return False
+
+    logger.debug(u'saved %d bytes to %s', len(raw), path)
+
+    return True
+
+#-------------------------------------------------------------------------------
+# returns the saved data, or None if there is no usable snapshot
+def load(path):
+    try:
+        with open(path, 'rb') as fp:
+            raw = fp.read()
+    except (IOError, OSError) as e:
+        logger.debug(u'no snapshot at %s - %s', path, str(e))
+        return None
+
+    try:
+        data = json.loads(zlib.decompress(raw))
+    except (zlib.error, ValueError) as e:
+        logger.warn(u'cannot read snapshot %s - %s', path, str(e))
+        return None
+
+    if not isinstance(data, dict) or data.get('version') != VERSION:
+        logger.warn(u'ignoring snapshot from another version: %s', path)
+        return None
+
+    return data
@@ -0,0 +1,44 @@
+## decides which device states need to be sent to the server for Network Devices
+
+import numbers
+import time
+
+#-------------------------------------------------------------------------------
+# true if a numeric state moved by more than the tolerance, as a fraction of
+# the value the server already has
+def _isSignificant(old, new, tolerance):
+    if not isinstance(old, numbers.Number) or not isinstance(new, numbers.Number):
+        return True
+
+    return abs(new - old) > tolerance * abs(old)
+
+#-------------------------------------------------------------------------------
+# returns the states that differ from those the server already has, as the
+# list of { 'key', 'value' } dicts that updateStatesOnServer takes; states in
+# tolerances only count if they changed by more than their tolerance, unless
+# force is set
+def getChangedStates(pushed, states, tolerances=None, force=False):
+    if tolerances is None: tolerances = dict()
+
+    changed = list()
+
+    for key, value in states.items():
+        old = pushed.get(key)
+        if old == value: continue
+
+        if key in tolerances and not force:
+            if not _isSignificant(old, value, tolerances[key]): continue
+
+        changed.append({ 'key' : key, 'value' : value })
+
+    return changed
+
+#-------------------------------------------------------------------------------
+# the lastActiveAt timestamp is refreshed when the device becomes active, and
+# otherwise only once per heartbeat (in seconds)
+def isHeartbeatDue(wasActive, lastHeartbeat, heartbeat, now=None):
+    if now is None: now = time.time()
+
+    if wasActive is True and (now - lastHeartbeat) < heartbeat: return False
+
+    return True
@@ -0,0 +1,231 @@
+## non-blocking TCP connection probes for Network Devices
+
+import errno
+import logging
+import select
+import socket
+import threading
+import time
+
+# connect() results that mean the connection is still in progress
+_IN_PROGRESS = (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY)
+
+################################################################################
+# minimal wrapper over the best available polling mechanism
+class Poller():
+
+    #---------------------------------------------------------------------------
+    def __init__(self):
+        self.fds = set()
+
+        # poll() takes milliseconds, epoll() takes seconds
+        self.scale = 1
+
+        if hasattr(select, 'epoll'):
+            self.impl = select.epoll()
+            self.mask = select.EPOLLOUT | select.EPOLLERR | select.EPOLLHUP
+        elif hasattr(select, 'poll'):
+            self.impl = select.poll()
+            self.mask = select.POLLOUT | select.POLLERR | select.POLLHUP
+            self.scale = 1000
+        else:
+            self.impl = None
+
+    #---------------------------------------------------------------------------
+    def register(self, fd):
+        self.fds.add(fd)
+        if self.impl is not None: self.impl.register(fd, self.mask)
+
+    #---------------------------------------------------------------------------
+    def unregister(self, fd):
+        self.fds.discard(fd)
+        if self.impl is not None: self.impl.unregister(fd)
+
+    #---------------------------------------------------------------------------
+    # returns a list of file descriptors that are ready for writing
+    def poll(self, timeout):
+        if self.impl is None:
+            rlist, wlist, xlist = select.select([], list(self.fds), list(self.fds), timeout)
+            return set(wlist) | set(xlist)
+
+        events = self.impl.poll(timeout * self.scale)
+
+        return [ fd for fd, event in events ]
+
+    #---------------------------------------------------------------------------
+    def close(self):
+        if hasattr(self.impl, 'close'): self.impl.close()
+
+################################################################################
+# probes many (address, port) targets at once using non-blocking connects
+class TcpProbe():
+
+    #---------------------------------------------------------------------------
+    def __init__(self, timeout=5, maxConcurrent=256, maxAge=60, resolver=None):
+        self.logger = logging.getLogger('Plugin.tcp.TcpProbe')
+        self.resultLock = threading.Lock()
+
+        # optional shared cache for host lookups; see resolver.Resolver
+        self.resolver = resolver
+
+        # results from the last sweep, consumed by isReachable
+        self.results = dict()
+
+        self.updateProps(timeout=timeout, maxConcurrent=maxConcurrent, maxAge=maxAge)
+
+    #---------------------------------------------------------------------------
+    def updateProps(self, timeout=None, maxConcurrent=None, maxAge=None):
+        if timeout is not None:
+            self.timeout = timeout
+
+        if maxConcurrent is not None:
+            self.maxConcurrent = maxConcurrent
+
+        if maxAge is not None:
+            self.maxAge = maxAge
+
+    #---------------------------------------------------------------------------
+    # start a connection to the target; returns the socket if the connection is
+    # pending, True / False if the result is already known
+    def _connect(self, target):
+        address, port = target
+
+        # only IPv4 addresses are probed; a name that also has an IPv6 address
+        # should not be reported closed because the host has no IPv6 service
+        if self.resolver is not None:
+            result = self.resolver.resolve(address, socket.AF_INET)
+
+            if result is None:
+                self.logger.debug(u'cannot resolve %s', address)
+                return False
+
+            family, ip = result
+            sockaddr = (ip, port)
+
+        else:
+            try:
+                family, socktype, proto, name, sockaddr = socket.getaddrinfo(
+                    address, port, socket.AF_INET, socket.SOCK_STREAM)[0]
+            except socket.error as e:
+                self.logger.debug(u'cannot resolve %s - %s', address, str(e))
+                return False
+
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.setblocking(0)
+
+        err = sock.connect_ex(sockaddr)
+
+        if err in _IN_PROGRESS:
+            return sock
+
+        sock.close()
+        return (err == 0)
+
+    #---------------------------------------------------------------------------
+    # probe all targets in a single event loop; returns { target : (available, rtt) }
+    # where rtt is the time until the target answered, or None if it did not
+    def _sweep(self, targets, timeout, timeouts):
+        waiting = list(set(targets))
+        self.logger.debug(u'sweeping %d TCP targets', len(waiting))
+
+        results = dict()
+        pending = dict()  # fd -> (target, sock, startTime, deadline)
+
+        poller = Poller()
+        startTime = time.time()
+
+        while len(waiting) > 0 or len(pending) > 0:
+
+            # keep the window full of in-flight connections
+            while len(waiting) > 0 and len(pending) < self.maxConcurrent:
+                target = waiting.pop()
+
+                connectTime = time.time()
+                sock = self._connect(target)
+
+                if isinstance(sock, bool):
+                    results[target] = (sock, (time.time() - connectTime) if sock else None)
+                else:
+                    deadline = connectTime + timeouts.get(target, timeout)
+                    pending[sock.fileno()] = (target, sock, connectTime, deadline)
+                    poller.register(sock.fileno())
+
+            if len(pending) == 0: continue
+
+            now = time.time()
+            nextDeadline = min([ entry[3] for entry in pending.values() ])
+
+            for fd in poller.poll(max(nextDeadline - now, 0)):
+                target, sock, connectTime, deadline = pending.pop(fd)
+                poller.unregister(fd)
+
+                # a refused connection is still an answer from the host
+                rtt = time.time() - connectTime
+
+                err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                results[target] = ((err == 0), rtt)
+                sock.close()
+
+            # anything past its deadline is unreachable
+            now = time.time()
+
+            for fd, (target, sock, connectTime, deadline) in list(pending.items()):
+                if now < deadline: continue
+
+                pending.pop(fd)
+                poller.unregister(fd)
+
+                results[target] = (False, None)
+                sock.close()
+
+        poller.close()
+
+        self.logger.debug(u'TCP sweep finished in %.3f sec', time.time() - startTime)
+
+        return results
+
+    #---------------------------------------------------------------------------
+    # probe all targets at once; returns { target : available }; timeouts may
+    # give a different timeout for some targets
+    def sweep(self, targets, timeout=None, save=True, timeouts=None):
+        if timeout is None: timeout = self.timeout
+        if timeouts is None: timeouts = dict()
+
+        results = self._sweep(targets, timeout, timeouts)
+
+        if save:
+            self.resultLock.acquire()
+            tstamp = time.time()
+
+            for target, (available, rtt) in results.items():
+                self.results[target] = (tstamp, available, rtt)
+
+            self.resultLock.release()
+
+        return dict([ (target, available) for target, (available, rtt) in results.items() ])
+
+    #---------------------------------------------------------------------------
+    # use the result from a recent sweep if there is one, otherwise probe now;
+    # returns (available, rtt) as described in _sweep
+    def probe(self, address, port, timeout=None):
+        target = (address, port)
+
+        self.resultLock.acquire()
+        result = self.results.pop(target, None)
+        self.resultLock.release()
+
+        if result is not None:
+            tstamp, available, rtt = result
+            if (time.time() - tstamp) < self.maxAge:
+                return (available, rtt)
+
+        if timeout is None: timeout = self.timeout
+
+        # this result was requested directly; don't save it for later
+        results = self._sweep([ target ], timeout, dict())
+
+        return results[target]
+
+    #---------------------------------------------------------------------------
+    def isReachable(self, address, port, timeout=None):
+        return self.probe(address, port, timeout)[0]
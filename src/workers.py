@@ -0,0 +1,133 @@
+## a pool of worker threads for device updates in Network Devices
+
+import collections
+import logging
+import threading
+
+################################################################################
+# a bounded pool of worker threads; tasks that share a key run in the order
+# they were submitted and never at the same time
+class WorkerPool():
+
+    #---------------------------------------------------------------------------
+    def __init__(self, size=8):
+        self.logger = logging.getLogger('Plugin.workers.WorkerPool')
+        self.lock = threading.Condition()
+
+        self.size = size
+        self.workers = list()
+
+        # keys that have tasks waiting and are not currently running
+        self.ready = collections.deque()
+
+        # pending tasks for each key, in submission order
+        self.pending = dict()
+
+        # keys that currently have a task running in a worker
+        self.active = set()
+
+    #---------------------------------------------------------------------------
+    def resize(self, size):
+        self.lock.acquire()
+
+        self.logger.debug(u'resizing worker pool: %d', size)
+        self.size = size
+
+        # new workers are only needed now if there is work waiting
+        if len(self.ready) > 0: self._startWorkers()
+
+        # wake idle workers so extras can exit
+        self.lock.notify_all()
+        self.lock.release()
+
+    #---------------------------------------------------------------------------
+    def _startWorkers(self):
+        # lock must be held by caller
+        self.workers = [ w for w in self.workers if w.is_alive() ]
+
+        while len(self.workers) < self.size:
+            worker = threading.Thread(target=self._run)
+            worker.daemon = True
+            worker.start()
+
+            self.workers.append(worker)
+
+    #---------------------------------------------------------------------------
+    def submit(self, key, func, *args):
+        self.lock.acquire()
+
+        tasks = self.pending.get(key)
+
+        if tasks is None:
+            tasks = collections.deque()
+            self.pending[key] = tasks
+
+        tasks.append((func, args))
+
+        # a key is only ready if it is not already running or waiting
+        if len(tasks) == 1 and key not in self.active:
+            self.ready.append(key)
+
+        self._startWorkers()
+
+        # join() waits on the same condition, so wake everyone; otherwise the
+        # only wakeup could go to a joiner and the task would sit in the queue
+        self.lock.notify_all()
+        self.lock.release()
+
+    #---------------------------------------------------------------------------
+    # true if the key has a task waiting or running
+    def isBusy(self, key):
+        self.lock.acquire()
+        busy = (key in self.pending or key in self.active)
+        self.lock.release()
+
+        return busy
+
+    #---------------------------------------------------------------------------
+    def join(self):
+        self.lock.acquire()
+
+        while len(self.pending) > 0 or len(self.active) > 0:
+            self.lock.wait()
+
+        self.lock.release()
+
+    #---------------------------------------------------------------------------
+    def _run(self):
+        self.lock.acquire()
+
+        while True:
+            if len(self.workers) > self.size:
+                self.workers.remove(threading.current_thread())
+                break
+
+            if len(self.ready) == 0:
+                self.lock.wait()
+                continue
+
+            key = self.ready.popleft()
+            tasks = self.pending[key]
+            func, args = tasks.popleft()
+
+            if len(tasks) == 0:
+                self.pending.pop(key)
+
+            self.active.add(key)
+            self.lock.release()
+
+            try:
+                func(*args)
+            except Exception as e:
+                self.logger.error(u'worker task failed: %s', str(e))
+
+            self.lock.acquire()
+            self.active.discard(key)
+
+            # more work may have been queued for this key while it was running
+            if key in self.pending:
+                self.ready.append(key)
+
+            self.lock.notify_all()
+
+        self.lock.release()
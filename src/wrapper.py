@@ -2,11 +2,15 @@
 
 import logging
 import urllib2
+import urlparse
 import time
 
 import arp
 import clients
+import history
 import iplug
+import scheduler
+import statediff
 
 # TODO set setErrorStateOnServer(msg) appropriately
 
@@ -14,31 +18,272 @@ import iplug
 # wrapper base class for device types
 class DeviceWrapper():
 
+    # minimum seconds between updates that would only refresh lastActiveAt
+    heartbeat = 300
+
+    # states last sent to the server, seeded from the device on first use
+    pushedStates = None
+    lastHeartbeat = 0
+
+    # statistics change a little with every check, so they are only sent when
+    # they move by more than this fraction, or once per heartbeat
+    statTolerances = { 'uptime' : 0.01, 'rttMedian' : 0.1, 'rttP95' : 0.1 }
+    lastStatsPush = 0
+
+    # seconds between regular updates, set by the plugin
+    pollInterval = 60
+
+    # after this many failed checks in a row, the poll interval doubles with
+    # each further failure up to the limit (in seconds); 0 disables backoff
+    backoffThreshold = 3
+    backoffLimit = 3600
+
+    failures = 0
+    backoffLevel = 0
+
+    # time and result of the last completed check
+    lastCheck = None
+    lastResult = None
+
+    # results of recent checks, created on the first check; statistics for
+    # the states cover this many seconds (set by the plugin)
+    history = None
+    historyWindow = 86400
+
+    # cheap checks to run before the client, if any; see _createPipeline
+    pipeline = None
+
+    # order of the first update after startup: 0 for the ARP table, 1 for a
+    # single probe, 2 for a full request or remote command
+    warmupPriority = 2
+
     #---------------------------------------------------------------------------
     def __init__(self, device):
         raise NotImplementedError()
 
     #---------------------------------------------------------------------------
-    # basic check to see if the virtual device is responding
-    def updateStatus(self):
+    # an update that starts after the deadline is skipped rather than reported
+    # as timed out, since the device was never checked
+    def _isOverdue(self, deadline):
+        if deadline is None or time.time() < deadline: return False
+
+        self.logger.warn(u'%s: no time left in this update; skipping', self.device.name)
+
+        return True
+
+    #---------------------------------------------------------------------------
+    # basic check to see if the virtual device is responding; the check must
+    # finish by the deadline (if given)
+    def updateStatus(self, deadline=None):
+        if self._isOverdue(deadline): return
+
         device = self.device
+        states = dict()
+
+        available = self._checkStatus(deadline, states)
+
+        if available is None:
+            self.logger.debug(u'%s TIMED OUT', device.name)
+            states['active'] = False
+            states['status'] = 'Timed Out'
 
-        if self.client.isAvailable():
+        elif available:
             self.logger.debug(u'%s is AVAILABLE', device.name)
-            device.updateStateOnServer('active', True)
-            device.updateStateOnServer('status', 'Active')
-            device.updateStateOnServer('lastActiveAt', time.strftime('%c'))
+            states['active'] = True
+            states['status'] = 'Active'
+
+            if self._isHeartbeatDue():
+                states['lastActiveAt'] = time.strftime('%c')
 
         else:
             self.logger.debug(u'%s is UNAVAILABLE', device.name)
-            device.updateStateOnServer('active', False)
-            device.updateStateOnServer('status', 'Inactive')
+            states['active'] = False
+            states['status'] = 'Inactive'
+
+        self._updateBackoff(available, states)
+
+        self.updateDeviceInfo(states)
+        self.pushStates(states)
+
+    #---------------------------------------------------------------------------
+    # look for a host in the neighbor table, then try to connect to the port,
+    # before running the full check with the client
+    def _createPipeline(self, address, port, arpTable, name):
+        stages = list()
+
+        if arpTable is not None:
+            stages.append(('arp', clients.NeighborClient(address, arpTable)))
+
+        stages.append(('tcp', clients.ServiceClient(address, port)))
+        stages.append((name, self.client))
+
+        self.pipeline = clients.ProbePipeline(stages)
+
+    #---------------------------------------------------------------------------
+    # returns the result of the client check, using the pipeline if there is one
+    def _checkStatus(self, deadline, states):
+        if self.pipeline is None:
+            available = self.client.isAvailable(deadline)
+        else:
+            available = self.pipeline.isAvailable(deadline)
+            states['checkStage'] = self.pipeline.decidedBy
+
+        self.lastCheck = time.time()
+        self.lastResult = available
+
+        self._updateHistory(available, states)
+
+        return available
+
+    #---------------------------------------------------------------------------
+    def _getHistory(self):
+        if self.history is None:
+            capacity = history.getCapacity(self.pollInterval)
+            self.history = history.AvailabilityHistory(capacity)
+
+        return self.history
+
+    #---------------------------------------------------------------------------
+    # record the check and report uptime and round trip statistics; a timed
+    # out check counts as down
+    def _updateHistory(self, available, states):
+        rtt = self.client.lastRtt if available else None
+        self._getHistory().append(self.lastCheck, available is True, rtt)
+
+        stats = self.history.getStats(self.historyWindow, self.lastCheck)
+
+        states['uptime'] = round(stats['uptime'] * 100, 1)
+        states['flapCount'] = stats['flaps']
+
+        if stats['rttP50'] is not None:
+            states['rttMedian'] = round(stats['rttP50'] * 1000, 2)
+            states['rttP95'] = round(stats['rttP95'] * 1000, 2)
+
+    #---------------------------------------------------------------------------
+    # count failed checks in a row; see scheduler.getBackoffLevel
+    def _updateBackoff(self, available, states):
+        if available:
+            self.failures = 0
+        else:
+            self.failures += 1
+
+        level = scheduler.getBackoffLevel(self.failures, self.backoffThreshold,
+                                          self.pollInterval, self.backoffLimit)
+
+        if level != self.backoffLevel:
+            self.logger.debug(u'%s: backoff level %d', self.device.name, level)
+
+        self.backoffLevel = level
+        states['backoffLevel'] = level
+
+    #---------------------------------------------------------------------------
+    # called when there is a sign the device is back; the next check decides
+    def resetBackoff(self):
+        self.failures = 0
+        self.backoffLevel = 0
+
+    #---------------------------------------------------------------------------
+    # the last check and backoff, to be saved across a restart; None if the
+    # device has not been checked yet
+    def getSnapshot(self):
+        if self.lastCheck is None: return None
+
+        return {
+            'lastCheck' : self.lastCheck,
+            'lastResult' : self.lastResult,
+            'failures' : self.failures,
+            'backoffLevel' : self.backoffLevel
+        }
+
+    #---------------------------------------------------------------------------
+    # restore a saved snapshot; the result is only used while it would still be
+    # current, i.e. the next update is not yet due - returns True if it was
+    def loadSnapshot(self, data):
+        lastCheck = data.get('lastCheck')
+        if lastCheck is None: return False
+
+        # the limit or poll interval may have changed since the snapshot
+        level = min(data.get('backoffLevel', 0),
+                    scheduler.getMaxBackoffLevel(self.pollInterval, self.backoffLimit))
+
+        if time.time() - lastCheck >= (self.pollInterval << level): return False
+
+        self.lastCheck = lastCheck
+        self.lastResult = data.get('lastResult')
+        self.failures = data.get('failures', 0)
+        self.backoffLevel = level
 
-        self.updateDeviceInfo()
+        # a device that was up skips the cheap checks on its first update, and
+        # the saved check counts towards its uptime
+        if self.pipeline is not None:
+            self.pipeline.lastResult = self.lastResult
+
+        self._getHistory().append(lastCheck, self.lastResult is True)
+
+        return True
+
+    #---------------------------------------------------------------------------
+    # seconds until the next regular update, including any backoff
+    def getPollInterval(self):
+        return (self.pollInterval << self.backoffLevel)
+
+    #---------------------------------------------------------------------------
+    # the network host for the device, if it has one
+    def getHostAddress(self):
+        return getattr(self.client, 'address', None)
+
+    #---------------------------------------------------------------------------
+    # the timestamp is refreshed when the device becomes active, otherwise only
+    # once per heartbeat
+    def _isHeartbeatDue(self):
+        now = time.time()
+        pushed = self._getPushedStates()
+
+        if not statediff.isHeartbeatDue(pushed.get('active'), self.lastHeartbeat, self.heartbeat, now):
+            return False
+
+        self.lastHeartbeat = now
+
+        return True
+
+    #---------------------------------------------------------------------------
+    def _getPushedStates(self):
+        if self.pushedStates is None:
+            self.pushedStates = dict(self.device.states.items())
+
+        return self.pushedStates
 
     #---------------------------------------------------------------------------
-    # sub-classes should overide this for their custom states
-    def updateDeviceInfo(self): pass
+    # send only the states that differ from what the server already has, in a
+    # single round trip
+    def pushStates(self, states):
+        pushed = self._getPushedStates()
+
+        now = time.time()
+        force = (now - self.lastStatsPush) >= self.heartbeat
+
+        changed = statediff.getChangedStates(pushed, states, self.statTolerances, force)
+        if force: self.lastStatsPush = now
+
+        if len(changed) == 0: return
+
+        self.logger.debug(u'%s: updating %d states', self.device.name, len(changed))
+        self.device.updateStatesOnServer(changed)
+
+        # states held back stay compared to the value the server has
+        pushed.update([ (item['key'], item['value']) for item in changed ])
+
+    #---------------------------------------------------------------------------
+    # sub-classes should overide this to add their custom states
+    def updateDeviceInfo(self, states): pass
+
+    #---------------------------------------------------------------------------
+    # called when the device stops; releases any resources held by the client
+    def stop(self):
+        if self.pipeline is not None:
+            self.pipeline.close()
+        else:
+            self.client.close()
 
     #---------------------------------------------------------------------------
     @staticmethod
@@ -49,6 +294,9 @@ class DeviceWrapper():
 # base wrapper class for relay-type devices
 class RelayDeviceWrapper(DeviceWrapper):
 
+    # relay devices have no status state, so a timeout is shown as an error
+    timedOut = False
+
     #---------------------------------------------------------------------------
     def __init__(self, device):
         raise NotImplementedError()
@@ -65,22 +313,41 @@ class RelayDeviceWrapper(DeviceWrapper):
 
     #---------------------------------------------------------------------------
     # basic check to see if the virtual device is responding
-    def updateStatus(self):
+    def updateStatus(self, deadline=None):
+        if self._isOverdue(deadline): return
+
         device = self.device
+        states = dict()
+
+        available = self._checkStatus(deadline, states)
 
-        if self.client.isAvailable():
+        if available:
             self.logger.debug(u'%s is AVAILABLE', device.name)
-            device.updateStateOnServer('onOffState', 'on')
+            states['onOffState'] = True
         else:
             self.logger.debug(u'%s is UNAVAILABLE', device.name)
-            device.updateStateOnServer('onOffState', 'off')
+            states['onOffState'] = False
+
+        self._updateBackoff(available, states)
 
-        self.updateDeviceInfo()
+        self.updateDeviceInfo(states)
+        self.pushStates(states)
+
+        if available is None:
+            self.logger.debug(u'%s TIMED OUT', device.name)
+            device.setErrorStateOnServer(u'timed out')
+            self.timedOut = True
+
+        elif self.timedOut:
+            device.setErrorStateOnServer(None)
+            self.timedOut = False
 
 ################################################################################
 # plugin device wrapper for Network Service devices
 class Service(DeviceWrapper):
 
+    warmupPriority = 1
+
     #---------------------------------------------------------------------------
     def __init__(self, device):
         self.logger = logging.getLogger('Plugin.wrapper.Service')
@@ -102,6 +369,8 @@ class Service(DeviceWrapper):
 # plugin device wrapper for Ping Status devices
 class Ping(DeviceWrapper):
 
+    warmupPriority = 1
+
     #---------------------------------------------------------------------------
     def __init__(self, device):
         self.logger = logging.getLogger('Plugin.wrapper.Ping')
@@ -111,6 +380,13 @@ class Ping(DeviceWrapper):
         self.device = device
         self.client = clients.PingClient(address)
 
+    #---------------------------------------------------------------------------
+    def updateDeviceInfo(self, states):
+        rtt = self.client.roundTripTime
+
+        if rtt is not None:
+            states['roundTripTime'] = round(rtt * 1000, 2)
+
     #---------------------------------------------------------------------------
     @staticmethod
     def validateConfig(values, errors):
@@ -134,31 +410,54 @@ class ExternalIP(DeviceWrapper):
             self.client = clients.IPv6AddressClient()
 
     #---------------------------------------------------------------------------
-    def updateDeviceInfo(self):
+    def updateDeviceInfo(self, states):
         # the worker (client) keeps a record of the current address...
         addr = self.client.current_address
 
         device = self.device
 
+        # replacing props is expensive, so only do it when the address changes
         props = device.pluginProps
-        props['address'] = addr
-        device.replacePluginPropsOnServer(props)
+
+        if props.get('address') != addr:
+            props['address'] = addr
+            device.replacePluginPropsOnServer(props)
 
         if addr is not None:
-            device.updateStateOnServer('lastKnownAddress', addr)
+            states['lastKnownAddress'] = addr
 
 ################################################################################
 # plugin device wrapper for HTTP Status devices
 class HTTP(DeviceWrapper):
 
     #---------------------------------------------------------------------------
-    def __init__(self, device):
+    def __init__(self, device, arpTable=None):
         self.logger = logging.getLogger('Plugin.wrapper.HTTP')
 
         url = device.pluginProps['url']
+        method = device.pluginProps.get('probeMethod', 'HEAD')
 
         self.device = device
-        self.client = clients.HttpClient(url)
+        self.client = clients.HttpClient(url, method)
+
+        parts = urlparse.urlsplit(url)
+        port = parts.port
+        if port is None: port = 443 if parts.scheme.lower() == 'https' else 80
+
+        if parts.hostname is not None:
+            self._createPipeline(parts.hostname, port, arpTable, 'http')
+
+    #---------------------------------------------------------------------------
+    def getHostAddress(self):
+        return urlparse.urlsplit(self.client.url).hostname
+
+    #---------------------------------------------------------------------------
+    def updateDeviceInfo(self, states):
+        if self.client.latency is not None:
+            states['responseTime'] = round(self.client.latency * 1000, 2)
+
+        if self.client.bytesRead is not None:
+            states['bytesRead'] = self.client.bytesRead
 
     #---------------------------------------------------------------------------
     @staticmethod
@@ -175,6 +474,8 @@ class HTTP(DeviceWrapper):
 # plugin device wrapper for Local Device types
 class Local(DeviceWrapper):
 
+    warmupPriority = 0
+
     #---------------------------------------------------------------------------
     def __init__(self, device, arpTable):
         self.logger = logging.getLogger('Plugin.wrapper.Local')
@@ -184,6 +485,21 @@ class Local(DeviceWrapper):
         self.device = device
         self.client = clients.ArpClient(address, arpTable)
 
+    #---------------------------------------------------------------------------
+    # dispatch(wrapper) is called when the device arrives or expires in the
+    # ARP table, so the status can be updated between polling cycles
+    def subscribe(self, dispatch):
+        self.client.subscribe(lambda active: dispatch(self))
+
+    #---------------------------------------------------------------------------
+    # the client address is a MAC address; arrivals reach us by subscription
+    def getHostAddress(self): return None
+
+    #---------------------------------------------------------------------------
+    def stop(self):
+        self.client.unsubscribe()
+        self.client.close()
+
     #---------------------------------------------------------------------------
     @staticmethod
     def validateConfig(values, errors):
@@ -194,7 +510,7 @@ class Local(DeviceWrapper):
 class SSH(RelayDeviceWrapper):
 
     #---------------------------------------------------------------------------
-    def __init__(self, device):
+    def __init__(self, device, arpTable=None):
         self.logger = logging.getLogger('Plugin.wrapper.SSH')
 
         address = device.pluginProps['address']
@@ -208,6 +524,8 @@ class SSH(RelayDeviceWrapper):
         self.client = client
         self.device = device
 
+        self._createPipeline(address, port, arpTable, 'ssh')
+
     #---------------------------------------------------------------------------
     @staticmethod
     def validateConfig(values, errors):
@@ -235,7 +553,7 @@ class macOS(RelayDeviceWrapper):
     # XXX could we use remote management instead of SSH?
 
     #---------------------------------------------------------------------------
-    def __init__(self, device):
+    def __init__(self, device, arpTable=None):
         self.logger = logging.getLogger('Plugin.wrapper.macOS')
 
         address = device.pluginProps['address']
@@ -250,6 +568,8 @@ class macOS(RelayDeviceWrapper):
         self.client = client
         self.device = device
 
+        self._createPipeline(address, client.port, arpTable, 'ssh')
+
     #---------------------------------------------------------------------------
     @staticmethod
     def validateConfig(values, errors):
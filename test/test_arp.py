@@ -2,6 +2,10 @@
 
 import logging
 import unittest
+import tempfile
+import threading
+import socket
+import struct
 import time
 
 import arp
@@ -11,6 +15,23 @@ from uuid import getnode
 # keep logging output to a minumim for testing
 logging.basicConfig(level=logging.ERROR)
 
+#-------------------------------------------------------------------------------
+# build a netlink neighbor message the way the kernel would send it
+def buildNeighborMessage(ip, mac, state, msgType=arp.RTM_NEWNEIGH, ifindex=2):
+    attrs = b''
+
+    dst = socket.inet_pton(socket.AF_INET, ip)
+    attrs += struct.pack('=HH', 4 + len(dst), arp.NDA_DST) + dst
+
+    if mac is not None:
+        lladdr = bytes(bytearray([ int(byte, 16) for byte in mac.split(':') ]))
+        attrs += struct.pack('=HH', 4 + len(lladdr), arp.NDA_LLADDR) + lladdr + b'\x00\x00'
+
+    ndmsg = struct.pack('=BBHiHBB', socket.AF_INET, 0, 0, ifindex, state, 0, 1)
+    header = struct.pack('=LHHLL', 16 + len(ndmsg) + len(attrs), msgType, 0, 0, 0)
+
+    return header + ndmsg + attrs
+
 ################################################################################
 class ArpCacheTestBase(unittest.TestCase):
 
@@ -37,6 +58,43 @@ class ArpCacheTestBase(unittest.TestCase):
         cache._updateCacheLines(lines)
         return cache
 
+################################################################################
+class MacAddressTest(unittest.TestCase):
+
+    #---------------------------------------------------------------------------
+    def test_ParseAddress(self):
+        self.assertEqual(arp.parseMacAddress('30:2a:43:b2:01:2f'), 0x302a43b2012f)
+        self.assertEqual(arp.parseMacAddress('30:2A:43:B2:01:2F'), 0x302a43b2012f)
+        self.assertEqual(arp.parseMacAddress(' 30-2a-43-b2-01-2f\n'), 0x302a43b2012f)
+
+    #---------------------------------------------------------------------------
+    def test_UnpaddedOctets(self):
+        self.assertEqual(arp.parseMacAddress('0:2a:43:4:b:51'), 0x002a43040b51)
+
+    #---------------------------------------------------------------------------
+    def test_InvalidAddress(self):
+        self.assertIsNone(arp.parseMacAddress('(incomplete)'))
+        self.assertIsNone(arp.parseMacAddress('30:2a:43:b2:01'))
+        self.assertIsNone(arp.parseMacAddress('30:2a:43:b2:01:2f:00'))
+        self.assertIsNone(arp.parseMacAddress('30:2a:43:b2:01:zz'))
+        self.assertIsNone(arp.parseMacAddress('302:a4:3b:20:12:f'))
+        self.assertIsNone(arp.parseMacAddress(''))
+        self.assertIsNone(arp.parseMacAddress(None))
+        self.assertIsNone(arp.parseMacAddress(1 << 48))
+
+    #---------------------------------------------------------------------------
+    def test_FormatAddress(self):
+        self.assertEqual(arp.formatMacAddress(0x002a43040b51), '00:2a:43:04:0b:51')
+
+    #---------------------------------------------------------------------------
+    def test_NormalizedLookup(self):
+        cache = arp.ArpCache(cmd=None)
+        cache._updateCacheLine('? (10.0.0.1) at 0:2a:43:4:b:51 on en0 ifscope [ethernet]')
+
+        self.assertTrue(cache.isActive(0x002a43040b51))
+        self.assertTrue(cache.isActive('00:2A:43:04:0B:51'))
+        self.assertFalse(cache.isActive(0x002a43040b52))
+
 ################################################################################
 class ArpCacheContainerTest(unittest.TestCase):
 
@@ -165,6 +223,141 @@ class ArpTableParsingUnitTest(ArpCacheTestBase):
         self.assertTrue(cache.isActive('20:a2:04:b3:0c:ed'))
         self.assertTrue(cache.isActive('20:a2:4:b3:c:ed'))
 
+################################################################################
+class NeighborTableFormatTest(unittest.TestCase):
+
+    #---------------------------------------------------------------------------
+    def _parse(self, data, tableFormat):
+        self.assertEqual(arp.detectTableFormat(data), tableFormat)
+        return list(arp.parseNeighborTable(data))
+
+    #---------------------------------------------------------------------------
+    def test_MacArpTable(self):
+        entries = self._parse(
+            '? (10.0.0.1) at 30:2a:43:b2:1:2f on en0 ifscope [ethernet]\n'
+            '? (10.0.0.5) at (incomplete) on en0 ifscope [ethernet]\n'
+            '? (224.0.0.251) at 1:0:5e:0:0:fb on en0 ifscope permanent [ethernet]\n',
+            'arp'
+        )
+
+        self.assertEqual(entries, [
+            arp.NeighborEntry('10.0.0.1', '30:2a:43:b2:1:2f', 'en0', None),
+            arp.NeighborEntry('10.0.0.5', None, 'en0', 'INCOMPLETE'),
+            arp.NeighborEntry('224.0.0.251', '1:0:5e:0:0:fb', 'en0', 'PERMANENT')
+        ])
+
+    #---------------------------------------------------------------------------
+    def test_LinuxArpTable(self):
+        entries = self._parse(
+            'router.lan (10.0.0.1) at 30:2a:43:b2:01:2f [ether] on eth0\n'
+            '? (10.0.0.5) at <incomplete> on eth0\n'
+            '? (10.0.0.9) at ab:12:cd:34:ef:56 [ether] PERM on wlan0\n',
+            'arp'
+        )
+
+        self.assertEqual(entries, [
+            arp.NeighborEntry('10.0.0.1', '30:2a:43:b2:01:2f', 'eth0', None),
+            arp.NeighborEntry('10.0.0.5', None, 'eth0', 'INCOMPLETE'),
+            arp.NeighborEntry('10.0.0.9', 'ab:12:cd:34:ef:56', 'wlan0', 'PERMANENT')
+        ])
+
+    #---------------------------------------------------------------------------
+    def test_IpNeighTable(self):
+        entries = self._parse(
+            '10.0.0.1 dev eth0 lladdr 30:2a:43:b2:01:2f router REACHABLE\n'
+            '10.0.0.5 dev eth0  INCOMPLETE\n'
+            '10.0.0.6 dev eth0  FAILED\n'
+            'fe80::1 dev eth0 lladdr ab:12:cd:34:ef:56 STALE\n',
+            'ip'
+        )
+
+        self.assertEqual(entries, [
+            arp.NeighborEntry('10.0.0.1', '30:2a:43:b2:01:2f', 'eth0', 'REACHABLE'),
+            arp.NeighborEntry('10.0.0.5', None, 'eth0', 'INCOMPLETE'),
+            arp.NeighborEntry('10.0.0.6', None, 'eth0', 'FAILED'),
+            arp.NeighborEntry('fe80::1', 'ab:12:cd:34:ef:56', 'eth0', 'STALE')
+        ])
+
+    #---------------------------------------------------------------------------
+    def test_ProcNetArpTable(self):
+        entries = self._parse(
+            'IP address       HW type     Flags       HW address            Mask     Device\n'
+            '10.0.0.1         0x1         0x2         30:2a:43:b2:01:2f     *        eth0\n'
+            '10.0.0.5         0x1         0x0         00:00:00:00:00:00     *        eth0\n',
+            'proc'
+        )
+
+        self.assertEqual(entries, [
+            arp.NeighborEntry('10.0.0.1', '30:2a:43:b2:01:2f', 'eth0', 'REACHABLE'),
+            arp.NeighborEntry('10.0.0.5', None, 'eth0', 'INCOMPLETE')
+        ])
+
+    #---------------------------------------------------------------------------
+    def test_UnknownFormat(self):
+        self.assertIsNone(arp.detectTableFormat('no neighbors here\n'))
+        self.assertEqual(list(arp.parseNeighborTable('no neighbors here\n')), [])
+
+    #---------------------------------------------------------------------------
+    def test_CommandSourceFormats(self):
+        source = arp.CommandSource(
+            'echo "10.0.0.1 dev eth0 lladdr 30:2a:43:b2:01:2f REACHABLE"'
+        )
+
+        entries = source.getEntries()
+
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0].iface, 'eth0')
+
+################################################################################
+class NeighborTableParserBenchmark(unittest.TestCase):
+
+    size = 50000
+
+    #---------------------------------------------------------------------------
+    def _buildTable(self, line):
+        lines = list()
+
+        for idx in range(self.size):
+            mac = '02:00:00:%02x:%02x:%02x' % ((idx >> 16) & 0xFF, (idx >> 8) & 0xFF, idx & 0xFF)
+            ip = '10.%d.%d.%d' % (idx >> 16, (idx >> 8) & 0xFF, idx & 0xFF)
+            lines.append(line % { 'ip' : ip, 'mac' : mac })
+
+        return '\n'.join(lines)
+
+    #---------------------------------------------------------------------------
+    def _timeParse(self, line, tableFormat):
+        data = self._buildTable(line)
+
+        startTime = time.time()
+        entries = list(arp.parseNeighborTable(data))
+        parseTime = time.time() - startTime
+
+        self.assertEqual(arp.detectTableFormat(data), tableFormat)
+        self.assertEqual(len(entries), self.size)
+
+        logging.getLogger('test_arp').debug(
+            '%s: %d lines in %.3f sec (%d lines/sec)',
+            tableFormat, self.size, parseTime, self.size / parseTime
+        )
+
+        self.assertLess(parseTime, 2.0)
+
+    #---------------------------------------------------------------------------
+    def test_MacArpTable(self):
+        self._timeParse('? (%(ip)s) at %(mac)s on en0 ifscope [ethernet]', 'arp')
+
+    #---------------------------------------------------------------------------
+    def test_LinuxArpTable(self):
+        self._timeParse('? (%(ip)s) at %(mac)s [ether] on eth0', 'arp')
+
+    #---------------------------------------------------------------------------
+    def test_IpNeighTable(self):
+        self._timeParse('%(ip)s dev eth0 lladdr %(mac)s REACHABLE', 'ip')
+
+    #---------------------------------------------------------------------------
+    def test_ProcNetArpTable(self):
+        self._timeParse('%(ip)-16s 0x1         0x2         %(mac)s     *        eth0', 'proc')
+
 ################################################################################
 class ArpTablePurgeUnitTest(ArpCacheTestBase):
 
@@ -288,3 +481,708 @@ class ArpTableActiveExpiredUnitTest(ArpCacheTestBase):
         self.assertFalse(cache.isActive('inactive'))
         self.assertFalse(cache.isActive('ancient'))
 
+
+################################################################################
+class NeighborSourceTest(unittest.TestCase):
+
+    #---------------------------------------------------------------------------
+    def test_CommandSource(self):
+        source = arp.CommandSource(
+            'echo "? (10.0.0.1) at 30:2a:43:b2:01:2f on en0 ifscope [ethernet]"'
+        )
+
+        entries = source.getEntries()
+
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0].ip, '10.0.0.1')
+        self.assertEqual(entries[0].mac, '30:2a:43:b2:01:2f')
+        self.assertEqual(entries[0].iface, 'en0')
+
+    #---------------------------------------------------------------------------
+    def test_MissingCommand(self):
+        source = arp.CommandSource('/path/does/not/exist')
+        self.assertIsNone(source.getEntries())
+
+    #---------------------------------------------------------------------------
+    def test_ProcNetArpSource(self):
+        table = tempfile.NamedTemporaryFile(mode='w', suffix='.arp')
+
+        table.write(
+            'IP address       HW type     Flags       HW address            Mask     Device\n'
+            '192.168.1.1      0x1         0x2         30:2a:43:b2:01:2f     *        eth0\n'
+            '192.168.1.9      0x1         0x0         00:00:00:00:00:00     *        eth0\n'
+            '192.168.1.5      0x1         0x6         ab:12:cd:34:ef:56     *        wlan0\n'
+        )
+        table.flush()
+
+        entries = arp.ProcNetArpSource(table.name).getEntries()
+        table.close()
+
+        self.assertEqual(entries, [
+            arp.NeighborEntry('192.168.1.1', '30:2a:43:b2:01:2f', 'eth0', 'REACHABLE'),
+            arp.NeighborEntry('192.168.1.9', None, 'eth0', 'INCOMPLETE'),
+            arp.NeighborEntry('192.168.1.5', 'ab:12:cd:34:ef:56', 'wlan0', 'PERMANENT')
+        ])
+
+    #---------------------------------------------------------------------------
+    def test_MissingProcFile(self):
+        source = arp.ProcNetArpSource('/path/does/not/exist')
+        self.assertIsNone(source.getEntries())
+
+    #---------------------------------------------------------------------------
+    def test_ParseNetlinkMessages(self):
+        data = buildNeighborMessage('10.0.0.1', '30:2a:43:b2:01:2f', 0x02)
+        data += buildNeighborMessage('10.0.0.2', None, 0x01)
+
+        messages = list(arp.parseNeighborMessages(data, { 2 : 'eth0' }))
+
+        self.assertEqual(messages, [
+            (arp.RTM_NEWNEIGH, arp.NeighborEntry('10.0.0.1', '30:2a:43:b2:01:2f', 'eth0', 'REACHABLE')),
+            (arp.RTM_NEWNEIGH, arp.NeighborEntry('10.0.0.2', None, 'eth0', 'INCOMPLETE'))
+        ])
+
+    #---------------------------------------------------------------------------
+    def test_NetlinkSource(self):
+        if not arp.NetlinkSource.isSupported():
+            self.skipTest('netlink is not available')
+
+        entries = arp.NetlinkSource().getEntries()
+        self.assertIsNotNone(entries)
+
+    #---------------------------------------------------------------------------
+    def test_CustomCommandOverride(self):
+        source = arp.createSource('auto', '/usr/sbin/arp -an')
+
+        self.assertIsInstance(source, arp.CommandSource)
+        self.assertEqual(source.cmd, '/usr/sbin/arp -an')
+
+    #---------------------------------------------------------------------------
+    def test_NoCommandNoSource(self):
+        self.assertIsNone(arp.createSource('auto', None))
+        self.assertIsNone(arp.createSource('command', None))
+
+    #---------------------------------------------------------------------------
+    def test_CacheSkipsInactiveEntries(self):
+        cache = arp.ArpCache(cmd=None)
+
+        cache._updateCacheEntries([
+            arp.NeighborEntry('10.0.0.1', '30:2a:43:b2:01:2f', 'eth0', 'REACHABLE'),
+            arp.NeighborEntry('10.0.0.2', 'ab:12:cd:34:ef:56', 'eth0', 'FAILED'),
+            arp.NeighborEntry('10.0.0.3', '11:22:33:44:55:66', 'eth0', None)
+        ])
+
+        self.assertTrue(cache.isActive('30:2a:43:b2:01:2f'))
+        self.assertFalse(cache.isActive('ab:12:cd:34:ef:56'))
+        self.assertTrue(cache.isActive('11:22:33:44:55:66'))
+
+################################################################################
+class ArpSubscriptionTest(unittest.TestCase):
+
+    #---------------------------------------------------------------------------
+    def setUp(self):
+        self.cache = arp.ArpCache(timeout=5, cmd=None)
+        self.cache.source = FakeNeighborSource()
+
+        self.events = list()
+        self.cache.subscribe('02:00:00:00:00:01', self.events.append)
+
+    #---------------------------------------------------------------------------
+    def _entry(self, mac='02:00:00:00:00:01'):
+        return arp.NeighborEntry('10.0.0.1', mac, 'eth0', 'REACHABLE')
+
+    #---------------------------------------------------------------------------
+    def test_ArrivalNotifies(self):
+        self.cache.source.entries = [ self._entry() ]
+        self.cache.refreshArpCache()
+
+        self.assertEqual(self.events, [ True ])
+
+        # a stable table is not news
+        self.cache.refreshArpCache()
+        self.assertEqual(self.events, [ True ])
+
+    #---------------------------------------------------------------------------
+    def test_ExpiryNotifies(self):
+        self.cache.source.entries = [ self._entry() ]
+        self.cache.refreshArpCache()
+
+        # the device leaves, but is still active until it expires
+        self.cache.source.entries = list()
+        self.cache.refreshArpCache()
+        self.assertEqual(self.events, [ True ])
+
+        self.cache['02:00:00:00:00:01'] = time.time() - 600
+        self.cache.refreshArpCache()
+        self.assertEqual(self.events, [ True, False ])
+
+    #---------------------------------------------------------------------------
+    def test_ReturnBeforeExpiry(self):
+        self.cache.source.entries = [ self._entry() ]
+        self.cache.refreshArpCache()
+
+        self.cache.source.entries = list()
+        self.cache.refreshArpCache()
+
+        self.cache.source.entries = [ self._entry() ]
+        self.cache.refreshArpCache()
+
+        self.assertEqual(self.events, [ True ])
+
+    #---------------------------------------------------------------------------
+    def test_OtherDevicesIgnored(self):
+        self.cache.source.entries = [ self._entry('02:00:00:00:00:02') ]
+        self.cache.refreshArpCache()
+
+        self.assertEqual(self.events, [])
+
+    #---------------------------------------------------------------------------
+    def test_NeighborEvents(self):
+        self.cache.applyNeighborEvent(arp.RTM_NEWNEIGH, self._entry())
+        self.cache.applyNeighborEvent(arp.RTM_NEWNEIGH, self._entry())
+
+        failed = arp.NeighborEntry('10.0.0.1', '02:00:00:00:00:01', 'eth0', 'FAILED')
+        self.cache.applyNeighborEvent(arp.RTM_NEWNEIGH, failed)
+
+        self.assertEqual(self.events, [ True, False ])
+
+    #---------------------------------------------------------------------------
+    def test_Unsubscribe(self):
+        self.cache.unsubscribe('02:00:00:00:00:01', self.events.append)
+
+        self.cache.source.entries = [ self._entry() ]
+        self.cache.refreshArpCache()
+
+        self.assertEqual(self.events, [])
+        self.assertEqual(len(self.cache.subscribers), 0)
+
+    #---------------------------------------------------------------------------
+    # callbacks run after the lock is released, so they may query the cache
+    def test_CallbackQueriesCache(self):
+        results = list()
+
+        def callback(active):
+            results.append(self.cache.isActive('02:00:00:00:00:01'))
+
+        self.cache.subscribe('02:00:00:00:00:01', callback)
+
+        self.cache.source.entries = [ self._entry() ]
+        self.cache.refreshArpCache()
+
+        self.assertEqual(results, [ True ])
+
+################################################################################
+# replays recorded netlink messages in place of a netlink socket
+class FakeNetlinkSocket():
+
+    #---------------------------------------------------------------------------
+    def __init__(self, messages):
+        self.messages = list(messages)
+
+    #---------------------------------------------------------------------------
+    def recv(self, bufsize):
+        if len(self.messages) == 0: return b''
+        return self.messages.pop(0)
+
+################################################################################
+class NeighborListenerTest(unittest.TestCase):
+
+    #---------------------------------------------------------------------------
+    def _replay(self, cache, messages):
+        listener = arp.NeighborListener(cache, FakeNetlinkSocket(messages))
+
+        self.assertTrue(listener.start())
+        listener.thread.join(5)
+
+        self.assertFalse(listener.isRunning())
+
+    #---------------------------------------------------------------------------
+    def test_NewNeighbor(self):
+        cache = arp.ArpCache(timeout=1, cmd=None)
+
+        self._replay(cache, [
+            buildNeighborMessage('10.0.0.1', '30:2a:43:b2:01:2f', 0x02)
+        ])
+
+        self.assertTrue(cache.isActive('30:2a:43:b2:01:2f'))
+
+    #---------------------------------------------------------------------------
+    def test_IncompleteNeighbor(self):
+        cache = arp.ArpCache(timeout=1, cmd=None)
+
+        self._replay(cache, [
+            buildNeighborMessage('10.0.0.1', '30:2a:43:b2:01:2f', 0x01)
+        ])
+
+        self.assertFalse(cache.isActive('30:2a:43:b2:01:2f'))
+
+    #---------------------------------------------------------------------------
+    def test_FailedNeighbor(self):
+        cache = arp.ArpCache(timeout=1, cmd=None)
+
+        self._replay(cache, [
+            buildNeighborMessage('10.0.0.1', '30:2a:43:b2:01:2f', 0x02),
+            buildNeighborMessage('10.0.0.1', '30:2a:43:b2:01:2f', 0x20)
+        ])
+
+        self.assertFalse(cache.isActive('30:2a:43:b2:01:2f'))
+
+    #---------------------------------------------------------------------------
+    # failed entries have no MAC address; the IP stays unreachable until seen
+    def test_UnreachableAddress(self):
+        cache = arp.ArpCache(timeout=1, cmd=None)
+
+        self._replay(cache, [
+            buildNeighborMessage('10.0.0.1', None, 0x20),
+        ])
+
+        self.assertTrue(cache.isUnreachable('10.0.0.1'))
+        self.assertFalse(cache.isUnreachable('10.0.0.2'))
+
+        self._replay(cache, [
+            buildNeighborMessage('10.0.0.1', '30:2a:43:b2:01:2f', 0x02)
+        ])
+
+        self.assertFalse(cache.isUnreachable('10.0.0.1'))
+
+    #---------------------------------------------------------------------------
+    # deleted entries stay active until they expire normally
+    def test_DeletedNeighbor(self):
+        cache = arp.ArpCache(timeout=1, cmd=None)
+
+        self._replay(cache, [
+            buildNeighborMessage('10.0.0.1', '30:2a:43:b2:01:2f', 0x02) +
+            buildNeighborMessage('10.0.0.1', '30:2a:43:b2:01:2f', 0x04, msgType=arp.RTM_DELNEIGH)
+        ])
+
+        self.assertTrue(cache.isActive('30:2a:43:b2:01:2f'))
+
+    #---------------------------------------------------------------------------
+    def test_MultipleMessagesInBuffer(self):
+        cache = arp.ArpCache(timeout=1, cmd=None)
+
+        self._replay(cache, [
+            buildNeighborMessage('10.0.0.1', '11:22:33:44:55:66', 0x02) +
+            buildNeighborMessage('10.0.0.2', 'aa:bb:cc:dd:ee:ff', 0x04),
+            buildNeighborMessage('10.0.0.3', '12:34:56:78:9a:bc', 0x08)
+        ])
+
+        self.assertEqual(cache.getActiveDeviceCount(), 3)
+
+    #---------------------------------------------------------------------------
+    def test_LiveListener(self):
+        if not arp.NetlinkSource.isSupported():
+            self.skipTest('netlink is not available')
+
+        listener = arp.NeighborListener(arp.ArpCache(cmd=None))
+
+        self.assertTrue(listener.start())
+        self.assertTrue(listener.isRunning())
+
+        listener.stop()
+        self.assertFalse(listener.isRunning())
+
+################################################################################
+class ArpCacheExpiryBenchmark(unittest.TestCase):
+
+    expired = 100
+
+    #---------------------------------------------------------------------------
+    def _buildCache(self, size):
+        cache = arp.ArpCache(timeout=5, cmd=None)
+        now = time.time()
+
+        for idx in range(size - self.expired):
+            cache._touch('current-%d' % idx, now - (idx % 240))
+
+        for idx in range(self.expired):
+            cache._touch('expired-%d' % idx, now - 600 - idx)
+
+        return cache
+
+    #---------------------------------------------------------------------------
+    def _timePurge(self, size):
+        cache = self._buildCache(size)
+
+        startTime = time.time()
+        cache.purgeExpiredDevices()
+        purgeTime = time.time() - startTime
+
+        self.assertEqual(len(cache), size - self.expired)
+
+        startTime = time.time()
+        for idx in range(1000): cache.getActiveDeviceCount()
+        countTime = (time.time() - startTime) / 1000
+
+        self.assertEqual(cache.getActiveDeviceCount(), size - self.expired)
+
+        return (purgeTime, countTime)
+
+    #---------------------------------------------------------------------------
+    # purge cost follows the number of expired entries, not the table size
+    def test_Purge10kAnd100k(self):
+        purge10k, count10k = self._timePurge(10000)
+        purge100k, count100k = self._timePurge(100000)
+
+        logging.getLogger('test_arp').debug(
+            'purge: 10k=%.6f 100k=%.6f, count: 10k=%.6f 100k=%.6f',
+            purge10k, purge100k, count10k, count100k
+        )
+
+        self.assertLess(purge10k, 0.05)
+        self.assertLess(purge100k, 0.05)
+
+        self.assertLess(count10k, 0.001)
+        self.assertLess(count100k, 0.001)
+
+################################################################################
+class ArpCacheConcurrencyTest(unittest.TestCase):
+
+    slow_arp = 'sh -c "sleep 1; echo \'? (10.0.0.2) at ab:12:cd:34:ef:56 on en0\'"'
+
+    #---------------------------------------------------------------------------
+    # lookups should not wait for a slow arp command to finish
+    def test_LookupDuringSlowRefresh(self):
+        cache = arp.ArpCache(timeout=5, cmd=self.slow_arp)
+        cache._updateCacheLine('? (10.0.0.1) at 11:22:33:44:55:66 on en0')
+
+        refresh = threading.Thread(target=cache.refreshArpCache)
+        refresh.start()
+
+        slowest = 0
+        lookups = 0
+
+        while refresh.is_alive():
+            startTime = time.time()
+            self.assertTrue(cache.isActive('11:22:33:44:55:66'))
+            slowest = max(slowest, time.time() - startTime)
+            lookups += 1
+
+        refresh.join()
+
+        self.assertGreater(lookups, 100)
+        self.assertLess(slowest, 0.05)
+
+        self.assertTrue(cache.isActive('11:22:33:44:55:66'))
+        self.assertTrue(cache.isActive('ab:12:cd:34:ef:56'))
+
+    #---------------------------------------------------------------------------
+    def test_RebuildDuringLookups(self):
+        cache = arp.ArpCache(timeout=5, cmd=self.slow_arp)
+        cache._updateCacheLine('? (10.0.0.1) at 11:22:33:44:55:66 on en0')
+        cache._updateCacheLine('? (10.0.0.2) at ab:12:cd:34:ef:56 on en0')
+
+        rebuild = threading.Thread(target=cache.rebuildArpCache)
+        rebuild.start()
+
+        startTime = time.time()
+
+        # the old table stays in place while the (slow) command runs
+        while time.time() - startTime < 0.8:
+            self.assertTrue(cache.isActive('11:22:33:44:55:66'))
+
+        # a device in both the old and the new table is seen through the swap
+        while rebuild.is_alive():
+            self.assertTrue(cache.isActive('ab:12:cd:34:ef:56'))
+
+        rebuild.join()
+
+        self.assertFalse(cache.isActive('11:22:33:44:55:66'))
+        self.assertTrue(cache.isActive('ab:12:cd:34:ef:56'))
+
+        # a larger table from a fast source, so lookups land on the swap itself
+        entries = [ arp.NeighborEntry('10.1.%d.%d' % (idx // 250, idx % 250), '02:00:00:00:%02x:%02x'
+                                      % (idx >> 8, idx & 0xFF), 'eth0', 'REACHABLE') for idx in range(2000) ]
+
+        cache.source = FakeNeighborSource(entries + [
+            arp.NeighborEntry('10.0.0.2', 'ab:12:cd:34:ef:56', 'en0', 'REACHABLE')
+        ])
+
+        def rebuildAll():
+            for idx in range(20): cache.rebuildArpCache()
+
+        rebuild = threading.Thread(target=rebuildAll)
+        rebuild.start()
+
+        lookups = 0
+
+        while rebuild.is_alive():
+            self.assertTrue(cache.isActive('ab:12:cd:34:ef:56'))
+            lookups += 1
+
+        rebuild.join()
+
+        self.assertEqual(cache.source.reads, 20)
+        self.assertGreater(lookups, 0)
+
+    #---------------------------------------------------------------------------
+    # a device that keeps leaving and returning to the table stays active
+    def test_ArrivalDuringLookups(self):
+        cache = arp.ArpCache(timeout=5, cmd=None)
+        entry = arp.NeighborEntry('10.0.0.2', 'ab:12:cd:34:ef:56', 'en0', 'REACHABLE')
+
+        cache.source = FakeNeighborSource([ entry ])
+        cache.refreshArpCache()
+
+        def refreshAll():
+            for idx in range(200):
+                cache.source.entries = [ entry ] if (idx % 2) else list()
+                cache.refreshArpCache()
+
+        refresh = threading.Thread(target=refreshAll)
+        refresh.start()
+
+        while refresh.is_alive():
+            self.assertTrue(cache.isActive('ab:12:cd:34:ef:56'))
+
+        refresh.join()
+
+        self.assertTrue(cache.isActive('ab:12:cd:34:ef:56'))
+
+################################################################################
+# replaces the neighbor source with a table the test can change
+class FakeNeighborSource(arp.NeighborSource):
+
+    #---------------------------------------------------------------------------
+    def __init__(self, entries=None):
+        self.entries = list(entries or [])
+        self.reads = 0
+
+    #---------------------------------------------------------------------------
+    def getEntries(self):
+        self.reads += 1
+        return list(self.entries)
+
+################################################################################
+class ArpTableDiffTest(unittest.TestCase):
+
+    #---------------------------------------------------------------------------
+    def _entry(self, idx, state='REACHABLE', iface='eth0'):
+        mac = '02:00:00:%02x:%02x:%02x' % ((idx >> 16) & 0xFF, (idx >> 8) & 0xFF, idx & 0xFF)
+        return arp.NeighborEntry('10.%d.%d.%d' % (idx >> 16, (idx >> 8) & 0xFF, idx & 0xFF), mac, iface, state)
+
+    #---------------------------------------------------------------------------
+    def _buildCache(self, entries):
+        cache = arp.ArpCache(timeout=5, cmd=None)
+        cache.source = FakeNeighborSource(entries)
+        return cache
+
+    #---------------------------------------------------------------------------
+    def test_FirstRefreshArrivals(self):
+        cache = self._buildCache([ self._entry(1), self._entry(2) ])
+        diff = cache.refreshArpCache()
+
+        self.assertEqual(sorted(diff.arrived), [ 0x020000000001, 0x020000000002 ])
+        self.assertEqual(diff.departed, [])
+        self.assertEqual(diff.changed, [])
+
+        self.assertEqual(cache.getActiveDeviceCount(), 2)
+
+    #---------------------------------------------------------------------------
+    def test_IpAddressesForArrivals(self):
+        cache = self._buildCache([ self._entry(1), self._entry(2) ])
+        cache.refreshArpCache()
+
+        cache.source.entries.append(self._entry(3))
+        diff = cache.refreshArpCache()
+
+        self.assertEqual(cache.getIpAddresses(diff.arrived), [ '10.0.0.3' ])
+        self.assertEqual(cache.getIpAddresses([ '02:00:00:00:00:01' ]), [ '10.0.0.1' ])
+        self.assertEqual(cache.getIpAddresses([ 0x020000000009 ]), [])
+
+    #---------------------------------------------------------------------------
+    def test_StableTableNoChanges(self):
+        cache = self._buildCache([ self._entry(1), self._entry(2) ])
+
+        cache.refreshArpCache()
+        diff = cache.refreshArpCache()
+
+        self.assertEqual(diff, arp.ArpDiff([], [], [], []))
+        self.assertIs(cache.lastDiff, diff)
+
+    #---------------------------------------------------------------------------
+    def test_Departure(self):
+        cache = self._buildCache([ self._entry(1), self._entry(2) ])
+        cache.refreshArpCache()
+
+        cache.source.entries.pop()
+        diff = cache.refreshArpCache()
+
+        self.assertEqual(diff.departed, [ 0x020000000002 ])
+
+        # departed devices stay active until they expire
+        self.assertTrue(cache.isActive(0x020000000002))
+        self.assertEqual(cache.getActiveDeviceCount(), 2)
+
+    #---------------------------------------------------------------------------
+    # counting is a read; expired devices are only dropped by the refresh
+    def test_CountDoesNotPurge(self):
+        cache = self._buildCache([ self._entry(1) ])
+        cache.refreshArpCache()
+
+        events = list()
+        cache.subscribe(0x020000000001, events.append)
+
+        cache.source.entries = list()
+        cache.refreshArpCache()
+        cache[0x020000000001] = time.time() - 600
+
+        self.assertEqual(cache.getActiveDeviceCount(), 1)
+        self.assertEqual(events, [])
+
+        cache.refreshArpCache()
+
+        self.assertEqual(cache.getActiveDeviceCount(), 0)
+        self.assertEqual(events, [ False ])
+
+    #---------------------------------------------------------------------------
+    def test_DepartureExpires(self):
+        cache = self._buildCache([ self._entry(1) ])
+        cache.refreshArpCache()
+
+        # pretend the last refresh was long ago
+        present, presentAt = cache.current
+        cache.current = (present, presentAt - 600)
+
+        cache.source.entries = list()
+        diff = cache.refreshArpCache()
+
+        self.assertEqual(diff.departed, [ 0x020000000001 ])
+        self.assertEqual(diff.expired, [ 0x020000000001 ])
+        self.assertFalse(cache.isActive(0x020000000001))
+
+    #---------------------------------------------------------------------------
+    def test_ChangedEntry(self):
+        cache = self._buildCache([ self._entry(1) ])
+        cache.refreshArpCache()
+
+        cache.source.entries = [ self._entry(1, iface='wlan0') ]
+        diff = cache.refreshArpCache()
+
+        self.assertEqual(diff.changed, [ 0x020000000001 ])
+        self.assertEqual(diff.arrived, [])
+        self.assertEqual(diff.departed, [])
+
+    #---------------------------------------------------------------------------
+    def test_DeviceWithTwoAddresses(self):
+        first = self._entry(1)
+        second = arp.NeighborEntry('fe80::1', first.mac, 'eth0', 'STALE')
+
+        cache = self._buildCache([ first, second ])
+        cache.refreshArpCache()
+
+        cache.source.entries = [ second ]
+        diff = cache.refreshArpCache()
+
+        self.assertEqual(diff.departed, [])
+        self.assertEqual(cache.getActiveDeviceCount(), 1)
+
+    #---------------------------------------------------------------------------
+    def test_FailedEntryDeparts(self):
+        cache = self._buildCache([ self._entry(1) ])
+        cache.refreshArpCache()
+
+        cache.source.entries = [ self._entry(1, state='FAILED') ]
+        diff = cache.refreshArpCache()
+
+        self.assertEqual(diff.departed, [ 0x020000000001 ])
+
+    #---------------------------------------------------------------------------
+    # unresolved entries in the table mark the IP unreachable until it is seen
+    def test_UnresolvedEntry(self):
+        cache = self._buildCache([ self._entry(1),
+                                   arp.NeighborEntry('10.0.0.2', None, 'en0', 'INCOMPLETE') ])
+        cache.refreshArpCache()
+
+        self.assertTrue(cache.isUnreachable('10.0.0.2'))
+        self.assertFalse(cache.isUnreachable('10.0.0.1'))
+        self.assertEqual(cache.getActiveDeviceCount(), 1)
+
+        cache.source.entries = [ self._entry(1), self._entry(2) ]
+        cache.refreshArpCache()
+
+        self.assertFalse(cache.isUnreachable('10.0.0.2'))
+
+    #---------------------------------------------------------------------------
+    # the unreachable mark expires with the rest of the table
+    def test_UnresolvedEntryExpires(self):
+        cache = self._buildCache([ arp.NeighborEntry('10.0.0.2', None, 'en0', 'INCOMPLETE') ])
+        cache.refreshArpCache()
+
+        cache.unreachable['10.0.0.2'] -= 600
+        cache.refreshArpCache()
+
+        self.assertFalse(cache.isUnreachable('10.0.0.2'))
+        self.assertNotIn('10.0.0.2', cache.unreachable)
+
+    #---------------------------------------------------------------------------
+    # a refresh of an unchanged table should cost little beyond reading it
+    def test_StableTableBenchmark(self):
+        cache = self._buildCache([ self._entry(idx) for idx in range(2000) ])
+
+        startTime = time.time()
+        cache.refreshArpCache()
+        firstTime = time.time() - startTime
+
+        startTime = time.time()
+        for idx in range(10): cache.refreshArpCache()
+        stableTime = (time.time() - startTime) / 10
+
+        self.assertEqual(cache.getActiveDeviceCount(), 2000)
+        self.assertLess(stableTime, firstTime / 4)
+
+################################################################################
+class ArpSnapshotTest(unittest.TestCase):
+
+    #---------------------------------------------------------------------------
+    def test_SnapshotRoundTrip(self):
+        cache = arp.ArpCache(timeout=5, cmd=None)
+        cache.source = FakeNeighborSource([
+            arp.NeighborEntry('10.0.0.1', '02:00:00:00:00:01', 'eth0', 'REACHABLE'),
+            arp.NeighborEntry('10.0.0.2', '02:00:00:00:00:02', 'eth0', 'STALE')
+        ])
+
+        cache.refreshArpCache()
+        cache['02:00:00:00:00:03'] = time.time() - 60
+
+        entries = cache.getSnapshot()
+        self.assertEqual(len(entries), 3)
+
+        # a quiet device is still active after a restart
+        restored = arp.ArpCache(timeout=5, cmd=None)
+        self.assertEqual(restored.loadSnapshot(entries), 3)
+
+        self.assertTrue(restored.isActive('02:00:00:00:00:01'))
+        self.assertTrue(restored.isActive('02:00:00:00:00:03'))
+
+    #---------------------------------------------------------------------------
+    def test_ExpiredEntriesSkipped(self):
+        now = time.time()
+        cache = arp.ArpCache(timeout=5, cmd=None)
+
+        entries = [ (0x020000000001, now - 60), (0x020000000002, now - 600) ]
+
+        self.assertEqual(cache.loadSnapshot(entries), 1)
+        self.assertTrue(cache.isActive(0x020000000001))
+        self.assertFalse(cache.isActive(0x020000000002))
+
+    #---------------------------------------------------------------------------
+    # restored entries expire on the normal schedule
+    def test_RestoredEntriesExpire(self):
+        now = time.time()
+        cache = arp.ArpCache(timeout=5, cmd=None)
+
+        cache.loadSnapshot([ (0x020000000001, now - 290) ])
+        self.assertTrue(cache.isActive(0x020000000001))
+
+        cache.timeout = 4
+        self.assertEqual(cache.purgeExpiredDevices(), [ 0x020000000001 ])
+
+    #---------------------------------------------------------------------------
+    # a device seen since the snapshot keeps the newer time
+    def test_NewerSightingKept(self):
+        cache = arp.ArpCache(timeout=5, cmd=None)
+        now = time.time()
+
+        cache[0x020000000001] = now
+        self.assertEqual(cache.loadSnapshot([ (0x020000000001, now - 60) ]), 0)
+        self.assertEqual(cache[0x020000000001], now)
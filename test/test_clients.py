@@ -2,7 +2,13 @@
 
 import logging
 import unittest
+import tempfile
+import shutil
+import time
+import socket
+import os
 
+import arp
 import clients
 
 # keep logging output to a minumim for testing
@@ -35,6 +41,216 @@ class BasicLocalCommands(unittest.TestCase):
         available = client.isAvailable()
         self.assertTrue(available)
 
+    #---------------------------------------------------------------------------
+    def test_FailedCommand(self):
+        client = clients.LocalCommand('/bin/false')
+        self.assertFalse(client.isAvailable())
+
+    #---------------------------------------------------------------------------
+    # a command that runs over the timeout is killed and reported as None
+    def test_CommandTimeout(self):
+        client = clients.LocalCommand('sleep 10')
+        client.timeout = 0.5
+
+        startTime = time.time()
+        self.assertIsNone(client.isAvailable())
+
+        self.assertLess(time.time() - startTime, 2)
+
+    #---------------------------------------------------------------------------
+    # children left running by the command are killed along with it
+    def test_TimeoutWithChildProcess(self):
+        client = clients.LocalCommand('sh -c "sleep 3 & sleep 5"')
+        client.timeout = 0.5
+
+        startTime = time.time()
+        self.assertIsNone(client.isAvailable())
+
+        self.assertLess(time.time() - startTime, 2)
+
+    #---------------------------------------------------------------------------
+    # a child that outlives the command does not hold up the check
+    def test_BackgroundChildProcess(self):
+        client = clients.LocalCommand('sh -c "sleep 5 &"')
+
+        startTime = time.time()
+        self.assertTrue(client.isAvailable())
+
+        self.assertLess(time.time() - startTime, 2)
+
+    #---------------------------------------------------------------------------
+    def test_DeadlineLimitsTimeout(self):
+        client = clients.LocalCommand('sleep 10')
+
+        startTime = time.time()
+        self.assertIsNone(client.isAvailable(deadline=time.time() + 0.5))
+
+        self.assertLess(time.time() - startTime, 2)
+
+################################################################################
+class ArpClientTests(unittest.TestCase):
+
+    #---------------------------------------------------------------------------
+    def test_LocalDevice(self):
+        cache = arp.ArpCache(cmd=None)
+        cache['30:2a:43:b2:01:2f'] = time.time()
+
+        client = clients.ArpClient('30:2A:43:B2:01:2F', cache)
+        self.assertTrue(client.isAvailable())
+
+    #---------------------------------------------------------------------------
+    def test_InvalidAddress(self):
+        cache = arp.ArpCache(cmd=None)
+        self.assertRaises(ValueError, clients.ArpClient, 'not-a-mac', cache)
+
+################################################################################
+class RttEstimatorTests(unittest.TestCase):
+
+    #---------------------------------------------------------------------------
+    def setUp(self):
+        self.rtt = clients.RttEstimator()
+        self.rtt.minTimeout = 0.01
+        self.rtt.maxTimeout = 10
+
+    #---------------------------------------------------------------------------
+    def test_DefaultTimeout(self):
+        self.assertEqual(self.rtt.getTimeout(5), 5)
+
+        # a timeout without any samples does not change anything
+        self.rtt.timedOut()
+        self.assertEqual(self.rtt.getTimeout(5), 5)
+
+    #---------------------------------------------------------------------------
+    def test_FirstSample(self):
+        self.rtt.update(0.1)
+
+        self.assertAlmostEqual(self.rtt.srtt, 0.1)
+        self.assertAlmostEqual(self.rtt.rttvar, 0.05)
+        self.assertAlmostEqual(self.rtt.getTimeout(5), 0.3)
+
+    #---------------------------------------------------------------------------
+    def test_SteadySamples(self):
+        for idx in range(50): self.rtt.update(0.02)
+
+        self.assertAlmostEqual(self.rtt.srtt, 0.02)
+        self.assertLess(self.rtt.getTimeout(5), 0.03)
+
+    #---------------------------------------------------------------------------
+    def test_Bounds(self):
+        self.rtt.update(0.0001)
+        self.assertEqual(self.rtt.getTimeout(5), 0.01)
+
+        self.rtt.update(60)
+        self.assertEqual(self.rtt.getTimeout(5), 10)
+
+    #---------------------------------------------------------------------------
+    def test_LimitedBackoff(self):
+        self.rtt.update(0.1)
+
+        self.rtt.timedOut()
+        self.assertAlmostEqual(self.rtt.getTimeout(5), 0.3 * 2)
+
+        # the backoff stops at the default timeout
+        for idx in range(10): self.rtt.timedOut()
+        self.assertEqual(self.rtt.getTimeout(5), 5)
+
+        # any answer resets the backoff
+        self.rtt.update(0.1)
+        self.assertLess(self.rtt.getTimeout(5), 0.3)
+
+    #---------------------------------------------------------------------------
+    # the backoff applies to the minimum, so a short RTT can still grow
+    def test_BackoffFromMinimum(self):
+        self.rtt.minTimeout = 0.25
+
+        for idx in range(10): self.rtt.update(0.02)
+        self.assertEqual(self.rtt.getTimeout(5), 0.25)
+
+        self.rtt.timedOut()
+        self.assertEqual(self.rtt.getTimeout(5), 0.5)
+
+################################################################################
+# a LAN host that answered quickly and then went offline
+class AdaptiveTimeoutTests(unittest.TestCase):
+
+    checks = 5
+
+    #---------------------------------------------------------------------------
+    def setUp(self):
+        self.sockets = list()
+
+        # every check should reach the network
+        self.window = clients.probes.window
+        clients.probes.updateProps(window=0)
+
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(('127.0.0.1', 0))
+        server.listen(128)
+
+        self.sockets.append(server)
+        self.openPort = server.getsockname()[1]
+
+        # a listener that never accepts; once the backlog is full, connections
+        # from any other 127.x.x.x address hang until they time out
+        stalled = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        stalled.bind(('0.0.0.0', 0))
+        stalled.listen(0)
+
+        self.sockets.append(stalled)
+        self.stalledPort = stalled.getsockname()[1]
+
+        for idx in range(3):
+            filler = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            filler.setblocking(0)
+            filler.connect_ex(('127.0.0.1', self.stalledPort))
+            self.sockets.append(filler)
+
+        time.sleep(0.1)
+
+    #---------------------------------------------------------------------------
+    def tearDown(self):
+        for sock in self.sockets: sock.close()
+        clients.probes.updateProps(window=self.window)
+
+    #---------------------------------------------------------------------------
+    # returns the time spent checking the client while its host is down
+    def _timeOffline(self, client):
+        client.address = '127.0.0.2'
+        client.port = self.stalledPort
+
+        startTime = time.time()
+
+        for idx in range(self.checks):
+            self.assertFalse(client.isAvailable())
+
+        return time.time() - startTime
+
+    #---------------------------------------------------------------------------
+    def _createClient(self):
+        client = clients.ServiceClient('127.0.0.1', self.openPort)
+        client.timeout = 0.5
+        client.rtt.minTimeout = 0.02
+
+        return client
+
+    #---------------------------------------------------------------------------
+    def test_OfflineLanHost(self):
+        static = self._createClient()
+        staticTime = self._timeOffline(static)
+
+        adaptive = self._createClient()
+        for idx in range(10): self.assertTrue(adaptive.isAvailable())
+
+        adaptiveTime = self._timeOffline(adaptive)
+
+        logging.getLogger('test_clients').debug(
+            'offline for %d checks: static %.3f sec, adaptive %.3f sec',
+            self.checks, staticTime, adaptiveTime
+        )
+
+        self.assertGreaterEqual(staticTime, self.checks * 0.5)
+        self.assertLess(adaptiveTime, staticTime / 2)
+
 ################################################################################
 class BasicPingTests(unittest.TestCase):
 
@@ -79,6 +295,351 @@ class HttpStatusChecks(unittest.TestCase):
         available = client.isAvailable()
         self.assertFalse(available)
 
+################################################################################
+# records each ssh invocation in place of the real client
+class FakeSSHTests(unittest.TestCase):
+
+    #---------------------------------------------------------------------------
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.logfile = os.path.join(self.tmpdir, 'ssh.log')
+
+        fakessh = os.path.join(self.tmpdir, 'ssh')
+
+        with open(fakessh, 'w') as fp:
+            fp.write('#!/bin/sh\necho "$@" >> %s\n' % self.logfile)
+
+        os.chmod(fakessh, 0o755)
+
+        self.clients = list()
+        self.client = self._createClient()
+
+        self.window = clients.probes.window
+        clients.probes.updateProps(window=0)
+
+    #---------------------------------------------------------------------------
+    def tearDown(self):
+        for client in self.clients: client.close()
+
+        shutil.rmtree(self.tmpdir)
+        clients.probes.updateProps(window=self.window)
+        clients.probes.clear()
+
+    #---------------------------------------------------------------------------
+    def _createClient(self):
+        client = clients.SSHClient('localhost', port=2222, username='admin')
+        client.sshCommand = os.path.join(self.tmpdir, 'ssh')
+        client.commands['status'] = '/usr/bin/true'
+
+        self.clients.append(client)
+
+        return client
+
+    #---------------------------------------------------------------------------
+    # an SSH Server and a second device on the same host share the check
+    def test_SharedStatusCheck(self):
+        clients.probes.updateProps(window=5)
+        other = self._createClient()
+
+        self.assertTrue(self.client.isAvailable())
+        self.assertTrue(other.isAvailable())
+
+        self.assertEqual(len(self._getInvocations()), 1)
+
+        # the second client still learns its timeout from the shared check
+        self.assertIsNotNone(other.rtt.srtt)
+
+    #---------------------------------------------------------------------------
+    def _getInvocations(self):
+        if not os.path.exists(self.logfile): return list()
+
+        with open(self.logfile) as fp:
+            return [ line.split() for line in fp.read().splitlines() ]
+
+    #---------------------------------------------------------------------------
+    # the master connection stays in the background after the first check
+    def test_BackgroundMaster(self):
+        fakessh = os.path.join(self.tmpdir, 'ssh')
+
+        with open(fakessh, 'w') as fp:
+            fp.write('#!/bin/sh\n')
+            fp.write('if [ -c /dev/fd/2 ]; then echo devnull; else echo captured; fi >> %s\n' % self.logfile)
+            fp.write('sleep 5 &\n')
+
+        startTime = time.time()
+        self.assertTrue(self.client.isAvailable())
+
+        self.assertLess(time.time() - startTime, 2)
+        self.assertEqual(self._getInvocations(), [ [ 'devnull' ] ])
+
+    #---------------------------------------------------------------------------
+    def test_SharedConnection(self):
+        self.assertTrue(self.client.isAvailable())
+        self.assertTrue(self.client.isAvailable())
+
+        calls = self._getInvocations()
+        self.assertEqual(len(calls), 2)
+
+        for args in calls:
+            self.assertIn('ControlMaster=auto', args)
+            self.assertIn('ControlPersist=600', args)
+            self.assertIn('ControlPath=%s' % self.client.controlPath, args)
+            self.assertEqual(args[-4:], [ '-p', '2222', 'localhost', '/usr/bin/true' ])
+
+        # later checks use the timeout learned from the first one
+        self.assertIn('ConnectTimeout=5', calls[0])
+        self.assertIn('ConnectTimeout=1', calls[1])
+
+    #---------------------------------------------------------------------------
+    # clients for the same user, host and port use the same master
+    def test_SharedControlPath(self):
+        other = self._createClient()
+        elsewhere = self._createClient()
+        elsewhere.port = 2223
+
+        for client in (self.client, other, elsewhere): client.isAvailable()
+
+        self.assertEqual(self.client.controlPath, other.controlPath)
+        self.assertNotEqual(self.client.controlPath, elsewhere.controlPath)
+
+    #---------------------------------------------------------------------------
+    # the master stays up until the last client using it is closed
+    def test_CloseSharedControlConnection(self):
+        other = self._createClient()
+
+        self.client.isAvailable()
+        other.isAvailable()
+
+        controlPath = other.controlPath
+
+        self.client.close()
+        self.assertNotIn('exit', [ args[2] for args in self._getInvocations() ])
+
+        # checks still run over the shared connection
+        self.assertTrue(other.isAvailable())
+        self.assertIn('ControlPath=%s' % controlPath, self._getInvocations()[-1])
+
+        other.close()
+
+        args = self._getInvocations()[-1]
+        self.assertEqual(args[1:3], [ '-O', 'exit' ])
+        self.assertIn('ControlPath=%s' % controlPath, args)
+
+    #---------------------------------------------------------------------------
+    # connect to the cached address while checking the host key by name
+    def test_ResolvedHostName(self):
+        self.client.isAvailable()
+        args = self._getInvocations()[0]
+
+        address = clients.dnsCache.resolve('localhost')[1]
+
+        self.assertIn('HostName=%s' % address, args)
+        self.assertIn('HostKeyAlias=localhost', args)
+
+    #---------------------------------------------------------------------------
+    def test_CloseControlConnection(self):
+        self.client.isAvailable()
+        controlPath = self.client.controlPath
+
+        self.client.close()
+
+        args = self._getInvocations()[-1]
+
+        self.assertEqual(args[1:3], [ '-O', 'exit' ])
+        self.assertIn('ControlPath=%s' % controlPath, args)
+        self.assertEqual(args[-5:], [ '-l', 'admin', '-p', '2222', 'localhost' ])
+
+        self.assertIsNone(self.client.controlPath)
+
+    #---------------------------------------------------------------------------
+    # a host that answered quickly and then got slower is measured again after
+    # a single timed out check
+    def test_HostSlowsDown(self):
+        delayFile = os.path.join(self.tmpdir, 'delay')
+        fakessh = os.path.join(self.tmpdir, 'ssh')
+
+        with open(fakessh, 'w') as fp:
+            fp.write('#!/bin/sh\nsleep `cat %s`\n' % delayFile)
+
+        with open(delayFile, 'w') as fp: fp.write('0.02')
+
+        for idx in range(10): self.assertTrue(self.client.isAvailable())
+        self.assertEqual(self.client.getTimeout(), clients.RttEstimator.minTimeout)
+
+        with open(delayFile, 'w') as fp: fp.write('0.4')
+
+        self.assertIsNone(self.client.isAvailable())
+
+        for idx in range(3): self.assertTrue(self.client.isAvailable())
+
+    #---------------------------------------------------------------------------
+    def test_CloseUnusedClient(self):
+        self.client.close()
+        self.assertEqual(self._getInvocations(), [])
+
+    #---------------------------------------------------------------------------
+    def test_SharingDisabled(self):
+        self.client.controlPersist = 0
+        self.client.isAvailable()
+
+        args = self._getInvocations()[0]
+        self.assertNotIn('ControlMaster=auto', args)
+
+        self.client.close()
+        self.assertEqual(len(self._getInvocations()), 1)
+
+################################################################################
+# SSH devices behind a pipeline; the fake ssh only succeeds for the open port
+class ProbePipelineTestBase(unittest.TestCase):
+
+    delay = 0.05
+
+    #---------------------------------------------------------------------------
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.logfile = os.path.join(self.tmpdir, 'ssh.log')
+
+        self.window = clients.probes.window
+        clients.probes.updateProps(window=0)
+
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.bind(('127.0.0.1', 0))
+        self.server.listen(128)
+        self.openPort = self.server.getsockname()[1]
+
+        # nothing listens here, so connections are refused right away
+        closed = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        closed.bind(('127.0.0.1', 0))
+        self.closedPort = closed.getsockname()[1]
+        closed.close()
+
+        fakessh = os.path.join(self.tmpdir, 'ssh')
+
+        with open(fakessh, 'w') as fp:
+            fp.write('#!/bin/sh\necho "$@" >> %s\nsleep %s\n' % (self.logfile, self.delay))
+            fp.write('case "$*" in *"-p %d "*) exit 0;; esac\nexit 255\n' % self.openPort)
+
+        os.chmod(fakessh, 0o755)
+
+        self.arpTable = arp.ArpCache(cmd=None)
+
+    #---------------------------------------------------------------------------
+    def tearDown(self):
+        self.server.close()
+        shutil.rmtree(self.tmpdir)
+        clients.probes.updateProps(window=self.window)
+
+    #---------------------------------------------------------------------------
+    def _createClient(self, port):
+        client = clients.SSHClient('127.0.0.1', port=port)
+        client.sshCommand = os.path.join(self.tmpdir, 'ssh')
+        client.commands['status'] = '/usr/bin/true'
+        client.controlPersist = 0
+
+        return client
+
+    #---------------------------------------------------------------------------
+    def _createPipeline(self, port):
+        return clients.ProbePipeline([
+            ('arp', clients.NeighborClient('127.0.0.1', self.arpTable)),
+            ('tcp', clients.ServiceClient('127.0.0.1', port)),
+            ('ssh', self._createClient(port))
+        ])
+
+    #---------------------------------------------------------------------------
+    def _getInvocations(self):
+        if not os.path.exists(self.logfile): return list()
+
+        with open(self.logfile) as fp:
+            return fp.read().splitlines()
+
+################################################################################
+class ProbePipelineTests(ProbePipelineTestBase):
+
+    #---------------------------------------------------------------------------
+    def test_ClosedPort(self):
+        pipeline = self._createPipeline(self.closedPort)
+
+        self.assertFalse(pipeline.isAvailable())
+        self.assertEqual(pipeline.decidedBy, 'tcp')
+        self.assertEqual(self._getInvocations(), [])
+
+    #---------------------------------------------------------------------------
+    # once the device is up, only the full check runs
+    def test_OpenPort(self):
+        pipeline = self._createPipeline(self.openPort)
+
+        self.assertTrue(pipeline.isAvailable())
+        self.assertEqual(pipeline.decidedBy, 'ssh')
+
+        self.assertTrue(pipeline.isAvailable())
+        self.assertEqual(pipeline.decisions, { 'arp' : 0, 'tcp' : 0, 'ssh' : 2 })
+        self.assertEqual(len(self._getInvocations()), 2)
+
+    #---------------------------------------------------------------------------
+    def test_UnreachableNeighbor(self):
+        pipeline = self._createPipeline(self.openPort)
+
+        self.arpTable.applyNeighborEvent(arp.RTM_NEWNEIGH,
+                                         arp.NeighborEntry('127.0.0.1', None, 'lo', 'FAILED'))
+
+        self.assertFalse(pipeline.isAvailable())
+        self.assertEqual(pipeline.decidedBy, 'arp')
+
+        self.arpTable.applyNeighborEvent(arp.RTM_NEWNEIGH,
+                                         arp.NeighborEntry('127.0.0.1', '02:00:00:00:00:01', 'lo', 'REACHABLE'))
+
+        self.assertTrue(pipeline.isAvailable())
+        self.assertEqual(pipeline.decidedBy, 'ssh')
+
+    #---------------------------------------------------------------------------
+    def test_CloseStages(self):
+        pipeline = self._createPipeline(self.openPort)
+        ssh = pipeline.stages[-1][1]
+        ssh.controlPersist = 600
+
+        pipeline.isAvailable()
+        self.assertIsNotNone(ssh.controlPath)
+
+        pipeline.close()
+        self.assertIsNone(ssh.controlPath)
+
+################################################################################
+# most devices in the fleet are offline; the full check takes a while
+class ProbePipelineBenchmark(ProbePipelineTestBase):
+
+    online = 2
+    offline = 18
+
+    #---------------------------------------------------------------------------
+    def _timeChecks(self, clientList):
+        startTime = time.time()
+
+        for client in clientList: client.isAvailable()
+
+        return time.time() - startTime
+
+    #---------------------------------------------------------------------------
+    def test_MostlyOfflineFleet(self):
+        ports = [ self.openPort ] * self.online + [ self.closedPort ] * self.offline
+
+        direct = [ self._createClient(port) for port in ports ]
+        directTime = self._timeChecks(direct)
+        directCalls = len(self._getInvocations())
+
+        pipelines = [ self._createPipeline(port) for port in ports ]
+        pipelineTime = self._timeChecks(pipelines)
+        pipelineCalls = len(self._getInvocations()) - directCalls
+
+        logging.getLogger('test_clients').debug(
+            '%d online, %d offline: direct %d ssh calls, %.3f sec; pipeline %d ssh calls, %.3f sec',
+            self.online, self.offline, directCalls, directTime, pipelineCalls, pipelineTime
+        )
+
+        self.assertEqual(directCalls, len(ports))
+        self.assertEqual(pipelineCalls, self.online)
+        self.assertLess(pipelineTime, directTime / 2)
+
 ################################################################################
 class LocalHostSSH(unittest.TestCase):
 
@@ -0,0 +1,139 @@
+#!/usr/bin/env python2.7
+
+import logging
+import unittest
+import threading
+import time
+
+import coalesce
+
+# keep logging output to a minumim for testing
+logging.basicConfig(level=logging.ERROR)
+
+################################################################################
+# counts calls and optionally takes a while to answer
+class CountingProbe():
+
+    #---------------------------------------------------------------------------
+    def __init__(self, delay=0, fail=False):
+        self.delay = delay
+        self.fail = fail
+        self.calls = 0
+
+    #---------------------------------------------------------------------------
+    def __call__(self, value):
+        self.calls += 1
+
+        if self.delay > 0: time.sleep(self.delay)
+        if self.fail: raise IOError('probe failed')
+
+        return value
+
+################################################################################
+class ProbeCoalescerTest(unittest.TestCase):
+
+    #---------------------------------------------------------------------------
+    def setUp(self):
+        self.coalescer = coalesce.ProbeCoalescer(window=5)
+
+    #---------------------------------------------------------------------------
+    def test_SharedResult(self):
+        probe = CountingProbe()
+
+        for idx in range(5):
+            result = self.coalescer.run(('tcp', 'nas.local', 22), probe, True)
+            self.assertTrue(result)
+
+        stats = self.coalescer.getStats()
+
+        self.assertEqual(probe.calls, 1)
+        self.assertEqual(stats['probes'], 1)
+        self.assertEqual(stats['shared'], 4)
+
+    #---------------------------------------------------------------------------
+    def test_DifferentKeys(self):
+        probe = CountingProbe()
+
+        self.coalescer.run(('tcp', 'nas.local', 22), probe, True)
+        self.coalescer.run(('tcp', 'nas.local', 80), probe, True)
+        self.coalescer.run(('icmp', 'nas.local'), probe, 0.001)
+
+        self.assertEqual(probe.calls, 3)
+
+    #---------------------------------------------------------------------------
+    def test_ResultExpires(self):
+        probe = CountingProbe()
+        self.coalescer.updateProps(window=0.1)
+
+        self.coalescer.run('key', probe, 1)
+        time.sleep(0.2)
+        self.coalescer.run('key', probe, 2)
+
+        self.assertEqual(probe.calls, 2)
+
+    #---------------------------------------------------------------------------
+    def test_Disabled(self):
+        probe = CountingProbe()
+        self.coalescer.updateProps(window=0)
+
+        self.coalescer.run('key', probe, 1)
+        self.coalescer.run('key', probe, 1)
+
+        self.assertEqual(probe.calls, 2)
+
+    #---------------------------------------------------------------------------
+    # callers that ask while the probe is running wait for its result
+    def test_InFlight(self):
+        probe = CountingProbe(delay=0.2)
+        results = list()
+
+        def worker(): results.append(self.coalescer.run('key', probe, 42))
+
+        threads = [ threading.Thread(target=worker) for idx in range(8) ]
+
+        startTime = time.time()
+
+        for thread in threads: thread.start()
+        for thread in threads: thread.join()
+
+        self.assertEqual(probe.calls, 1)
+        self.assertEqual(results, [ 42 ] * 8)
+        self.assertLess(time.time() - startTime, 0.4)
+
+        self.assertEqual(self.coalescer.getStats()['shared'], 7)
+
+    #---------------------------------------------------------------------------
+    def test_FailedProbe(self):
+        probe = CountingProbe(fail=True)
+
+        self.assertRaises(IOError, self.coalescer.run, 'key', probe, 1)
+        self.assertRaises(IOError, self.coalescer.run, 'key', probe, 1)
+
+        self.assertEqual(probe.calls, 2)
+        self.assertEqual(self.coalescer.inflight, dict())
+
+    #---------------------------------------------------------------------------
+    def test_ResetStats(self):
+        probe = CountingProbe()
+
+        self.coalescer.run('key', probe, 1)
+        self.coalescer.run('key', probe, 1)
+
+        stats = self.coalescer.getStats(reset=True)
+        self.assertEqual((stats['probes'], stats['shared']), (1, 1))
+
+        self.coalescer.run('key', probe, 1)
+        stats = self.coalescer.getStats()
+
+        self.assertEqual((stats['probes'], stats['shared']), (0, 1))
+        self.assertEqual((stats['totalProbes'], stats['totalShared']), (1, 2))
+
+    #---------------------------------------------------------------------------
+    def test_Clear(self):
+        probe = CountingProbe()
+
+        self.coalescer.run('key', probe, 1)
+        self.coalescer.clear()
+        self.coalescer.run('key', probe, 1)
+
+        self.assertEqual(probe.calls, 2)
@@ -0,0 +1,222 @@
+#!/usr/bin/env python2.7
+
+import logging
+import unittest
+import threading
+import time
+
+import extip
+
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+
+# keep logging output to a minumim for testing
+logging.basicConfig(level=logging.ERROR)
+
+################################################################################
+# answers every request with a fixed body after an optional delay
+class StubProviderHandler(BaseHTTPRequestHandler):
+
+    #---------------------------------------------------------------------------
+    def log_message(self, format, *args): pass
+
+    #---------------------------------------------------------------------------
+    def do_GET(self):
+        server = self.server
+        server.requests += 1
+
+        if server.delay > 0: time.sleep(server.delay)
+
+        self.send_response(server.status)
+        self.send_header('Content-Length', str(len(server.body)))
+        self.end_headers()
+
+        self.wfile.write(server.body)
+
+################################################################################
+class StubProvider(ThreadingMixIn, HTTPServer):
+
+    daemon_threads = True
+
+    #---------------------------------------------------------------------------
+    def __init__(self, body, delay=0, status=200):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), StubProviderHandler)
+
+        self.body = body
+        self.delay = delay
+        self.status = status
+        self.requests = 0
+
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    #---------------------------------------------------------------------------
+    def getUrl(self):
+        return 'http://127.0.0.1:%d/' % self.server_address[1]
+
+    #---------------------------------------------------------------------------
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+################################################################################
+# lets tests control the local address instead of using the real route
+class FakeAddressService(extip.ExternalAddressService):
+
+    localAddress = '192.168.1.10'
+
+    #---------------------------------------------------------------------------
+    def _getLocalAddress(self, family):
+        return self.localAddress
+
+################################################################################
+class ParseResponseTest(unittest.TestCase):
+
+    #---------------------------------------------------------------------------
+    def test_PlainText(self):
+        self.assertEqual(extip.parseResponse('203.0.113.7\n'), '203.0.113.7')
+
+    #---------------------------------------------------------------------------
+    def test_Json(self):
+        self.assertEqual(extip.parseResponse('{"ip":"203.0.113.7"}'), '203.0.113.7')
+
+    #---------------------------------------------------------------------------
+    def test_BadJson(self):
+        self.assertIsNone(extip.parseResponse('{"ip":'))
+
+    #---------------------------------------------------------------------------
+    def test_ValidateAddress(self):
+        self.assertEqual(extip.validateAddress('ipv4', '203.0.113.7'), '203.0.113.7')
+        self.assertEqual(extip.validateAddress('ipv6', '2001:db8::7'), '2001:db8::7')
+
+        self.assertIsNone(extip.validateAddress('ipv4', '2001:db8::7'))
+        self.assertIsNone(extip.validateAddress('ipv4', '<html>'))
+        self.assertIsNone(extip.validateAddress('ipv4', None))
+
+################################################################################
+class ExternalAddressServiceTest(unittest.TestCase):
+
+    #---------------------------------------------------------------------------
+    def setUp(self):
+        self.providers = list()
+
+    #---------------------------------------------------------------------------
+    def tearDown(self):
+        for provider in self.providers: provider.stop()
+
+    #---------------------------------------------------------------------------
+    def _buildService(self, *providers, **props):
+        self.providers.extend(providers)
+
+        service = FakeAddressService(**props)
+        service.updateProps(providers={ 'ipv4' : [ p.getUrl() for p in providers ] })
+
+        return service
+
+    #---------------------------------------------------------------------------
+    def test_SingleProvider(self):
+        service = self._buildService(StubProvider('{"ip":"203.0.113.7"}'))
+        self.assertEqual(service.getAddress('ipv4'), '203.0.113.7')
+
+    #---------------------------------------------------------------------------
+    def test_CachedAddress(self):
+        provider = StubProvider('203.0.113.7')
+        service = self._buildService(provider)
+
+        for idx in range(10):
+            self.assertEqual(service.getAddress('ipv4'), '203.0.113.7')
+
+        self.assertEqual(provider.requests, 1)
+
+    #---------------------------------------------------------------------------
+    def test_LocalAddressChange(self):
+        provider = StubProvider('203.0.113.7')
+        service = self._buildService(provider)
+
+        service.getAddress('ipv4')
+        service.getAddress('ipv4')
+
+        service.localAddress = '10.0.0.10'
+        service.getAddress('ipv4')
+
+        self.assertEqual(provider.requests, 2)
+
+    #---------------------------------------------------------------------------
+    def test_ExpiredAddress(self):
+        provider = StubProvider('203.0.113.7')
+        service = self._buildService(provider, ttl=0)
+
+        service.getAddress('ipv4')
+        service.getAddress('ipv4')
+
+        self.assertEqual(provider.requests, 2)
+
+    #---------------------------------------------------------------------------
+    # a slow first provider is hedged by the next one after the delay
+    def test_HedgedRequest(self):
+        slow = StubProvider('203.0.113.1', delay=2)
+        fast = StubProvider('203.0.113.2')
+
+        service = self._buildService(slow, fast, hedgeDelay=0.2)
+
+        startTime = time.time()
+        addr = service.getAddress('ipv4')
+        elapsed = time.time() - startTime
+
+        self.assertEqual(addr, '203.0.113.2')
+        self.assertLess(elapsed, 1)
+
+    #---------------------------------------------------------------------------
+    # the first provider answers before the hedge delay, so no other is asked
+    def test_NoHedgeWhenFast(self):
+        first = StubProvider('203.0.113.1')
+        second = StubProvider('203.0.113.2')
+
+        service = self._buildService(first, second, hedgeDelay=1)
+
+        self.assertEqual(service.getAddress('ipv4'), '203.0.113.1')
+        self.assertEqual(second.requests, 0)
+
+    #---------------------------------------------------------------------------
+    # an invalid answer moves on to the next provider right away
+    def test_InvalidAnswer(self):
+        broken = StubProvider('<html>oops</html>')
+        good = StubProvider('203.0.113.2')
+
+        service = self._buildService(broken, good, hedgeDelay=5)
+
+        startTime = time.time()
+        addr = service.getAddress('ipv4')
+
+        self.assertEqual(addr, '203.0.113.2')
+        self.assertLess(time.time() - startTime, 1)
+
+    #---------------------------------------------------------------------------
+    def test_AllProvidersFail(self):
+        broken = StubProvider('', status=500)
+        service = self._buildService(broken, timeout=1)
+
+        self.assertIsNone(service.getAddress('ipv4'))
+
+        # nothing is cached, so the next lookup asks again
+        service.getAddress('ipv4')
+        self.assertEqual(broken.requests, 2)
+
+    #---------------------------------------------------------------------------
+    def test_Timeout(self):
+        slow = StubProvider('203.0.113.1', delay=3)
+        service = self._buildService(slow, timeout=0.5)
+
+        startTime = time.time()
+        self.assertIsNone(service.getAddress('ipv4'))
+        self.assertLess(time.time() - startTime, 1.5)
+
+    #---------------------------------------------------------------------------
+    def test_DefaultProviders(self):
+        service = extip.ExternalAddressService()
+
+        service.updateProps(providers={ 'ipv4' : [ 'http://127.0.0.1:1/' ] })
+        service.updateProps(providers={ 'ipv4' : [] })
+
+        self.assertEqual(service.providers['ipv4'], extip.DEFAULT_PROVIDERS['ipv4'])
@@ -0,0 +1,156 @@
+#!/usr/bin/env python2.7
+
+import logging
+import unittest
+import random
+import time
+
+import history
+
+# keep logging output to a minumim for testing
+logging.basicConfig(level=logging.ERROR)
+
+################################################################################
+class AvailabilityHistoryTest(unittest.TestCase):
+
+    now = 1500000000
+
+    #---------------------------------------------------------------------------
+    def _build(self, results, capacity=100, rtt=0.01):
+        hist = history.AvailabilityHistory(capacity)
+
+        for idx, available in enumerate(results):
+            hist.append(self.now + idx * 60, available, rtt if available else None)
+
+        # windows end one interval after the last sample
+        self.end = self.now + len(results) * 60
+
+        return hist
+
+    #---------------------------------------------------------------------------
+    def _getStats(self, hist, window=history.MAX_AGE):
+        return hist.getStats(window, now=self.end)
+
+    #---------------------------------------------------------------------------
+    def test_EmptyHistory(self):
+        hist = self._build([])
+        stats = self._getStats(hist)
+
+        self.assertEqual(stats['samples'], 0)
+        self.assertIsNone(stats['uptime'])
+        self.assertIsNone(stats['rttP50'])
+
+    #---------------------------------------------------------------------------
+    def test_Uptime(self):
+        stats = self._getStats(self._build([ True, True, True, False ]))
+
+        self.assertEqual(stats['samples'], 4)
+        self.assertEqual(stats['uptime'], 0.75)
+        self.assertEqual(stats['flaps'], 1)
+
+    #---------------------------------------------------------------------------
+    def test_Flaps(self):
+        stats = self._getStats(self._build([ True, False, True, False, False, True ]))
+        self.assertEqual(stats['flaps'], 4)
+
+    #---------------------------------------------------------------------------
+    # only the samples inside the window are counted
+    def test_Window(self):
+        hist = self._build([ False ] * 10 + [ True ] * 10)
+
+        stats = self._getStats(hist, window=10 * 60)
+
+        self.assertEqual(stats['samples'], 10)
+        self.assertEqual(stats['uptime'], 1.0)
+        self.assertEqual(stats['flaps'], 0)
+
+    #---------------------------------------------------------------------------
+    # the oldest samples are replaced once the ring is full
+    def test_Wraparound(self):
+        hist = self._build([ False ] * 7 + [ True ] * 5, capacity=8)
+        self.assertEqual(len(hist), 8)
+
+        stats = self._getStats(hist)
+
+        self.assertEqual(stats['samples'], 8)
+        self.assertEqual(stats['uptime'], 5 / 8.0)
+        self.assertEqual(stats['flaps'], 1)
+
+        # a window that crosses the end of the ring
+        stats = self._getStats(hist, window=6 * 60)
+
+        self.assertEqual(stats['samples'], 6)
+        self.assertEqual(stats['uptime'], 5 / 6.0)
+
+    #---------------------------------------------------------------------------
+    def test_RoundTripPercentiles(self):
+        hist = history.AvailabilityHistory(200)
+
+        for idx in range(100):
+            hist.append(self.now + idx, True, (idx + 1) / 1000.0)
+
+        hist.append(self.now + 100, False, None)
+
+        stats = hist.getStats(now=self.now + 101)
+
+        self.assertEqual(stats['rttP50'], 0.051)
+        self.assertEqual(stats['rttP95'], 0.095)
+
+    #---------------------------------------------------------------------------
+    # the results must match a plain scan of the same samples
+    def test_MatchesScan(self):
+        rand = random.Random(42)
+        results = [ rand.random() < 0.8 for idx in range(500) ]
+
+        hist = self._build(results, capacity=333)
+
+        for window in (1, 50, 200, 333, 1000):
+            stats = self._getStats(hist, window=window * 60)
+            expected = results[-min(window, 333):]
+
+            flaps = sum([ 1 for a, b in zip(expected, expected[1:]) if a != b ])
+
+            self.assertEqual(stats['samples'], len(expected))
+            self.assertEqual(stats['uptime'], float(sum(expected)) / len(expected))
+            self.assertEqual(stats['flaps'], flaps)
+
+    #---------------------------------------------------------------------------
+    def test_Capacity(self):
+        self.assertEqual(history.getCapacity(60), 10080)
+        self.assertEqual(history.getCapacity(3600), 168)
+        self.assertEqual(history.getCapacity(1), history.MAX_SAMPLES)
+
+################################################################################
+# a week of history for a large number of devices
+class AvailabilityHistoryBenchmark(unittest.TestCase):
+
+    devices = 1000
+
+    #---------------------------------------------------------------------------
+    def test_WeekOfHistory(self):
+        capacity = history.getCapacity(60)
+        hist = history.AvailabilityHistory(capacity)
+
+        now = time.time()
+        startTime = time.time()
+
+        for idx in range(capacity):
+            hist.append(now - (capacity - idx) * 60, idx % 100 != 0, 0.005)
+
+        appendTime = (time.time() - startTime) / capacity
+
+        startTime = time.time()
+        stats = hist.getStats(86400, now=now)
+        statsTime = time.time() - startTime
+
+        size = (hist.times.itemsize * len(hist.times) + hist.rtts.itemsize * len(hist.rtts) +
+                len(hist.bits))
+
+        logging.getLogger('test_history').debug(
+            '%d samples: %.2f usec/append, 24h stats in %.3f ms; %d bytes per device, %.1f MB for %d',
+            capacity, appendTime * 1e6, statsTime * 1000, size,
+            size * self.devices / 1048576.0, self.devices
+        )
+
+        self.assertEqual(stats['samples'], 1440)
+        self.assertLess(size * self.devices, 64 * 1048576)
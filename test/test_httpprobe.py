@@ -0,0 +1,254 @@
+#!/usr/bin/env python2.7
+
+import logging
+import unittest
+import threading
+import time
+
+import httpprobe
+
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+
+# keep logging output to a minumim for testing
+logging.basicConfig(level=logging.ERROR)
+
+################################################################################
+class TestRequestHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    # send each response in one write, like a real server
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    #---------------------------------------------------------------------------
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    #---------------------------------------------------------------------------
+    def log_message(self, format, *args): pass
+
+    #---------------------------------------------------------------------------
+    def _respond(self, body):
+        path = self.path
+
+        if path == '/redirect':
+            self.send_response(301)
+            self.send_header('Location', '/ok')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        elif path == '/missing':
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        elif path == '/nohead' and self.command == 'HEAD':
+            self.send_response(405)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        elif path == '/empty':
+            self.server.ranges.append(self.headers.get('Range'))
+
+            # an empty page cannot satisfy any range
+            if self.headers.get('Range') is not None:
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */0')
+            else:
+                self.send_response(200)
+
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        elif path == '/slow':
+            time.sleep(2)
+
+            self.send_response(200)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        elif path == '/large':
+            data = 'x' * 65536
+
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+
+            if body: self.wfile.write(data)
+
+        else:
+            self.server.ranges.append(self.headers.get('Range'))
+
+            self.send_response(200)
+            self.send_header('Content-Length', '2')
+            self.end_headers()
+
+            if body: self.wfile.write('ok')
+
+    #---------------------------------------------------------------------------
+    def do_GET(self): self._respond(True)
+    def do_HEAD(self): self._respond(False)
+
+################################################################################
+class TestServer(ThreadingMixIn, HTTPServer):
+
+    daemon_threads = True
+
+    #---------------------------------------------------------------------------
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), TestRequestHandler)
+        self.connections = 0
+        self.ranges = list()
+
+    #---------------------------------------------------------------------------
+    def getUrl(self, path):
+        return 'http://127.0.0.1:%d%s' % (self.server_address[1], path)
+
+################################################################################
+class HttpProbeTestBase(unittest.TestCase):
+
+    #---------------------------------------------------------------------------
+    def setUp(self):
+        self.server = TestServer()
+
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+        self.probe = httpprobe.HttpProbe(timeout=5, maxBytes=1024)
+
+    #---------------------------------------------------------------------------
+    def tearDown(self):
+        self.probe.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+################################################################################
+class HttpProbeTest(HttpProbeTestBase):
+
+    #---------------------------------------------------------------------------
+    def test_HeadRequest(self):
+        result = self.probe.probe(self.server.getUrl('/ok'))
+
+        self.assertEqual(result.status, 200)
+        self.assertGreater(result.bytesRead, 0)
+
+    #---------------------------------------------------------------------------
+    def test_RangeLimitedGet(self):
+        result = self.probe.probe(self.server.getUrl('/ok'), 'GET')
+
+        self.assertEqual(result.status, 200)
+        self.assertEqual(self.server.ranges, [ 'bytes=0-1023' ])
+
+    #---------------------------------------------------------------------------
+    # a page too short for the range is still there
+    def test_RangeNotSatisfiable(self):
+        result = self.probe.probe(self.server.getUrl('/empty'), 'GET')
+
+        self.assertEqual(result.status, 200)
+        self.assertEqual(self.server.ranges, [ 'bytes=0-1023', None ])
+
+    #---------------------------------------------------------------------------
+    def test_FollowRedirect(self):
+        result = self.probe.probe(self.server.getUrl('/redirect'))
+
+        self.assertEqual(result.status, 200)
+        self.assertEqual(result.url, self.server.getUrl('/ok'))
+
+    #---------------------------------------------------------------------------
+    def test_NotFound(self):
+        result = self.probe.probe(self.server.getUrl('/missing'))
+        self.assertEqual(result.status, 404)
+
+    #---------------------------------------------------------------------------
+    def test_HeadNotSupported(self):
+        result = self.probe.probe(self.server.getUrl('/nohead'))
+        self.assertEqual(result.status, 200)
+
+    #---------------------------------------------------------------------------
+    # the body is only read up to the limit; the connection cannot be reused
+    def test_ByteLimit(self):
+        result = self.probe.probe(self.server.getUrl('/large'), 'GET')
+
+        self.assertEqual(result.status, 200)
+        self.assertLess(result.bytesRead, 2048)
+
+        self.probe.probe(self.server.getUrl('/large'), 'GET')
+        self.assertEqual(self.probe.connects, 2)
+
+    #---------------------------------------------------------------------------
+    def test_ConnectionRefused(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+        result = self.probe.probe(self.server.getUrl('/ok'))
+        self.assertIsNone(result.status)
+
+    #---------------------------------------------------------------------------
+    def test_Timeout(self):
+        startTime = time.time()
+        result = self.probe.probe(self.server.getUrl('/slow'), timeout=0.5)
+
+        self.assertIsNone(result.status)
+        self.assertTrue(result.timedOut)
+        self.assertLess(time.time() - startTime, 1.5)
+
+    #---------------------------------------------------------------------------
+    # the connection is not retried once the time is up
+    def test_TimeoutOnPooledConnection(self):
+        self.probe.probe(self.server.getUrl('/ok'))
+        result = self.probe.probe(self.server.getUrl('/slow'), timeout=0.5)
+
+        self.assertTrue(result.timedOut)
+        self.assertEqual(self.probe.connects, 1)
+
+    #---------------------------------------------------------------------------
+    def test_ServerClosedIdleConnection(self):
+        self.probe.probe(self.server.getUrl('/ok'))
+
+        # drop the pooled connection from the server side
+        for idle in self.probe.pool.values():
+            for conn in idle: conn.sock.shutdown(2)
+
+        result = self.probe.probe(self.server.getUrl('/ok'))
+
+        self.assertEqual(result.status, 200)
+        self.assertEqual(self.probe.connects, 2)
+
+################################################################################
+class HttpProbeBenchmark(HttpProbeTestBase):
+
+    count = 1000
+
+    #---------------------------------------------------------------------------
+    def _timeProbes(self, probe):
+        url = self.server.getUrl('/ok')
+
+        startTime = time.time()
+
+        for idx in range(self.count):
+            result = probe.probe(url)
+            self.assertEqual(result.status, 200)
+
+        return (time.time() - startTime) / self.count
+
+    #---------------------------------------------------------------------------
+    def test_KeepAlive(self):
+        fresh = httpprobe.HttpProbe(maxIdle=0)
+        freshTime = self._timeProbes(fresh)
+        freshConnects = self.server.connections
+
+        pooledTime = self._timeProbes(self.probe)
+        pooledConnects = self.server.connections - freshConnects
+
+        logging.getLogger('test_httpprobe').debug(
+            'fresh: %d connections, %.6f sec/probe; pooled: %d connections, %.6f sec/probe',
+            freshConnects, freshTime, pooledConnects, pooledTime
+        )
+
+        self.assertEqual(freshConnects, self.count)
+        self.assertEqual(pooledConnects, 1)
+        self.assertLess(pooledTime, freshTime)
@@ -0,0 +1,161 @@
+#!/usr/bin/env python2.7
+
+import logging
+import unittest
+import socket
+import threading
+import time
+
+import icmp
+import clients
+
+from distutils.spawn import find_executable
+
+# keep logging output to a minumim for testing
+logging.basicConfig(level=logging.ERROR)
+
+################################################################################
+class IcmpPacketTest(unittest.TestCase):
+
+    #---------------------------------------------------------------------------
+    def test_ChecksumIsValid(self):
+        packet = icmp.buildEchoRequest(0x1234, 42)
+
+        # the checksum over a packet that includes its checksum is zero
+        self.assertEqual(icmp.checksum(packet), 0)
+
+    #---------------------------------------------------------------------------
+    def test_OddLengthChecksum(self):
+        packet = icmp.buildEchoRequest(0x1234, 42, payload=b'odd')
+        self.assertEqual(icmp.checksum(packet + b'\x00'), 0)
+
+    #---------------------------------------------------------------------------
+    def test_ParseBareReply(self):
+        packet = icmp.buildEchoRequest(0x1234, 42)
+        self.assertEqual(icmp.parseEchoReply(packet), (icmp.ICMP_ECHO_REQUEST, 0x1234, 42))
+
+    #---------------------------------------------------------------------------
+    def test_ParseReplyWithHeader(self):
+        header = b'\x45' + b'\x00' * 19
+        packet = icmp.buildEchoRequest(0x1234, 42)
+
+        self.assertEqual(icmp.parseEchoReply(header + packet), (icmp.ICMP_ECHO_REQUEST, 0x1234, 42))
+
+    #---------------------------------------------------------------------------
+    def test_ParseShortPacket(self):
+        self.assertIsNone(icmp.parseEchoReply(b'\x00\x00'))
+
+################################################################################
+class FakeIcmpSocket():
+
+    #---------------------------------------------------------------------------
+    def __init__(self, socktype, port=4321):
+        self.type = socktype
+        self.port = port
+
+    #---------------------------------------------------------------------------
+    def getsockname(self): return ('0.0.0.0', self.port)
+
+################################################################################
+class ReplyIdentTest(unittest.TestCase):
+
+    #---------------------------------------------------------------------------
+    def test_RawSocket(self):
+        sock = FakeIcmpSocket(socket.SOCK_RAW)
+        self.assertEqual(icmp.getReplyIdent(sock, 0x1234, 'linux2'), 0x1234)
+
+    #---------------------------------------------------------------------------
+    # linux replaces the identifier with the local port of the socket
+    def test_LinuxDatagramSocket(self):
+        sock = FakeIcmpSocket(socket.SOCK_DGRAM)
+        self.assertEqual(icmp.getReplyIdent(sock, 0x1234, 'linux2'), 4321)
+
+    #---------------------------------------------------------------------------
+    def test_MacDatagramSocket(self):
+        sock = FakeIcmpSocket(socket.SOCK_DGRAM)
+        self.assertEqual(icmp.getReplyIdent(sock, 0x1234, 'darwin'), 0x1234)
+
+################################################################################
+class IcmpProbeTest(unittest.TestCase):
+
+    #---------------------------------------------------------------------------
+    def setUp(self):
+        self.probe = icmp.IcmpProbe(timeout=1)
+
+        if not self.probe.isSupported():
+            self.skipTest('ICMP sockets are not available')
+
+    #---------------------------------------------------------------------------
+    def test_Loopback(self):
+        rtt = self.probe.getRoundTripTime('127.0.0.1')
+
+        self.assertIsNotNone(rtt)
+        self.assertLess(rtt, 1)
+
+    #---------------------------------------------------------------------------
+    def test_UnknownHost(self):
+        self.assertIsNone(self.probe.getRoundTripTime('host.invalid'))
+
+    #---------------------------------------------------------------------------
+    def test_SweepLoopback(self):
+        hosts = [ '127.0.0.%d' % idx for idx in range(1, 21) ]
+        results = self.probe.sweep(hosts)
+
+        self.assertEqual(len(results), 20)
+        self.assertNotIn(None, results.values())
+
+    #---------------------------------------------------------------------------
+    # each sweep only accepts the replies to its own requests
+    def test_ConcurrentSweeps(self):
+        other = icmp.IcmpProbe(timeout=1)
+        hosts = [ '127.0.0.%d' % idx for idx in range(1, 11) ]
+        results = list()
+
+        def sweep(probe):
+            results.append(probe.sweep(hosts))
+
+        threads = [ threading.Thread(target=sweep, args=(probe,)) for probe in (self.probe, other) ]
+
+        for thread in threads: thread.start()
+        for thread in threads: thread.join()
+
+        for result in results:
+            self.assertNotIn(None, result.values())
+
+################################################################################
+class IcmpBenchmark(unittest.TestCase):
+
+    iterations = 50
+
+    #---------------------------------------------------------------------------
+    def test_EngineVersusCommand(self):
+        probe = icmp.IcmpProbe(timeout=1)
+        pingCommand = find_executable('ping')
+
+        if not probe.isSupported():
+            self.skipTest('ICMP sockets are not available')
+
+        if pingCommand is None:
+            self.skipTest('ping command is not available')
+
+        startTime = time.time()
+
+        for idx in range(self.iterations):
+            self.assertIsNotNone(probe.getRoundTripTime('127.0.0.1'))
+
+        engineTime = time.time() - startTime
+
+        client = clients.PingClient('127.0.0.1')
+        startTime = time.time()
+
+        for idx in range(self.iterations):
+            self.assertTrue(client._exec(pingCommand, '-c1', '127.0.0.1'))
+
+        commandTime = time.time() - startTime
+
+        logging.getLogger('test_icmp').warn(
+            'loopback x%d - engine: %.3f sec, command: %.3f sec',
+            self.iterations, engineTime, commandTime
+        )
+
+        self.assertLess(engineTime, commandTime)
@@ -0,0 +1,145 @@
+#!/usr/bin/env python2.7
+
+import logging
+import unittest
+import socket
+import threading
+import time
+
+import resolver
+
+# keep logging output to a minumim for testing
+logging.basicConfig(level=logging.ERROR)
+
+################################################################################
+# answers from a fixed table and counts each lookup
+class StubLookup():
+
+    #---------------------------------------------------------------------------
+    def __init__(self, table, delay=0):
+        self.table = table
+        self.delay = delay
+        self.lookups = list()
+        self.lock = threading.Lock()
+
+    #---------------------------------------------------------------------------
+    def __call__(self, host, family):
+        self.lock.acquire()
+        self.lookups.append(host)
+        self.lock.release()
+
+        if self.delay > 0: time.sleep(self.delay)
+
+        addr = self.table.get(host)
+        if addr is None: raise socket.gaierror(u'unknown host: %s' % host)
+
+        return [ (socket.AF_INET, addr) ]
+
+################################################################################
+class ResolverTest(unittest.TestCase):
+
+    #---------------------------------------------------------------------------
+    def setUp(self):
+        self.lookup = StubLookup({ 'nas.local' : '10.0.0.5', 'tv.local' : '10.0.0.6' })
+        self.resolver = resolver.Resolver(ttl=300, negativeTtl=30, lookup=self.lookup)
+
+    #---------------------------------------------------------------------------
+    def test_CachedLookup(self):
+        for idx in range(10):
+            result = self.resolver.resolve('nas.local')
+            self.assertEqual(result, (socket.AF_INET, '10.0.0.5'))
+
+        stats = self.resolver.getStats()
+
+        self.assertEqual(self.lookup.lookups, [ 'nas.local' ])
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hits'], 9)
+        self.assertAlmostEqual(stats['hitRate'], 0.9)
+
+    #---------------------------------------------------------------------------
+    def test_LiteralAddress(self):
+        self.assertEqual(self.resolver.resolve('10.0.0.1'), (socket.AF_INET, '10.0.0.1'))
+        self.assertEqual(self.resolver.resolve('::1'), (socket.AF_INET6, '::1'))
+
+        self.assertEqual(self.lookup.lookups, [ ])
+
+    #---------------------------------------------------------------------------
+    def test_NegativeCache(self):
+        self.assertIsNone(self.resolver.resolve('missing.local'))
+        self.assertIsNone(self.resolver.resolve('missing.local'))
+
+        stats = self.resolver.getStats()
+
+        self.assertEqual(self.lookup.lookups, [ 'missing.local' ])
+        self.assertEqual(stats['failures'], 1)
+        self.assertEqual(stats['negativeHits'], 1)
+
+    #---------------------------------------------------------------------------
+    def test_NegativeCacheExpires(self):
+        self.resolver.updateProps(negativeTtl=0)
+
+        self.assertIsNone(self.resolver.resolve('missing.local'))
+        self.lookup.table['missing.local'] = '10.0.0.7'
+
+        self.assertEqual(self.resolver.resolve('missing.local'), (socket.AF_INET, '10.0.0.7'))
+
+    #---------------------------------------------------------------------------
+    def test_Expired(self):
+        self.resolver.updateProps(ttl=0)
+
+        self.resolver.resolve('nas.local')
+        self.resolver.resolve('nas.local')
+
+        self.assertEqual(self.lookup.lookups, [ 'nas.local', 'nas.local' ])
+
+    #---------------------------------------------------------------------------
+    # entries near expiry are still returned while a new lookup runs
+    def test_RefreshAhead(self):
+        self.resolver.updateProps(refreshAhead=0)
+
+        self.resolver.resolve('nas.local')
+        self.lookup.table['nas.local'] = '10.0.0.9'
+
+        self.assertEqual(self.resolver.resolve('nas.local'), (socket.AF_INET, '10.0.0.5'))
+
+        for idx in range(100):
+            if len(self.resolver.refreshing) == 0: break
+            time.sleep(0.01)
+
+        self.assertEqual(self.resolver.resolve('nas.local'), (socket.AF_INET, '10.0.0.9'))
+        self.assertGreaterEqual(self.resolver.getStats()['refreshes'], 1)
+
+    #---------------------------------------------------------------------------
+    def test_Prefetch(self):
+        self.lookup.delay = 0.2
+        hosts = [ 'nas.local', 'tv.local', 'nas.local', '10.0.0.1' ]
+
+        startTime = time.time()
+        self.resolver.prefetch(hosts)
+        elapsed = time.time() - startTime
+
+        # lookups run at the same time; duplicates and literals are skipped
+        self.assertEqual(sorted(self.lookup.lookups), [ 'nas.local', 'tv.local' ])
+        self.assertLess(elapsed, 0.4)
+
+        self.resolver.prefetch(hosts)
+        self.assertEqual(len(self.lookup.lookups), 2)
+
+        self.assertEqual(self.resolver.resolve('tv.local'), (socket.AF_INET, '10.0.0.6'))
+
+    #---------------------------------------------------------------------------
+    def test_Clear(self):
+        self.resolver.resolve('nas.local')
+        self.resolver.clear()
+        self.resolver.resolve('nas.local')
+
+        self.assertEqual(len(self.lookup.lookups), 2)
+        self.assertEqual(self.resolver.getStats()['entries'], 1)
+
+    #---------------------------------------------------------------------------
+    def test_Localhost(self):
+        real = resolver.Resolver()
+        result = real.resolve('localhost')
+
+        self.assertIsNotNone(result)
+        self.assertIn(result[0], (socket.AF_INET, socket.AF_INET6))
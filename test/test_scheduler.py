@@ -0,0 +1,348 @@
+#!/usr/bin/env python2.7
+
+import logging
+import unittest
+import threading
+import time
+
+import scheduler
+
+# keep logging output to a minumim for testing
+logging.basicConfig(level=logging.ERROR)
+
+################################################################################
+class BasicSchedulerTest(unittest.TestCase):
+
+    #---------------------------------------------------------------------------
+    def test_EmptySchedule(self):
+        sched = scheduler.Scheduler()
+
+        self.assertEqual(len(sched), 0)
+        self.assertEqual(sched.popDue(), [])
+        self.assertEqual(sched.getNextDelay(60), 60)
+
+    #---------------------------------------------------------------------------
+    def test_DueOrder(self):
+        sched = scheduler.Scheduler()
+        now = time.time()
+
+        sched.add('slow', 60, delay=20)
+        sched.add('fast', 10, delay=5)
+
+        self.assertEqual(sched.popDue(now + 1), [])
+        self.assertEqual(sched.popDue(now + 6), ['fast'])
+        self.assertEqual(sched.popDue(now + 21), ['fast', 'slow'])
+
+    #---------------------------------------------------------------------------
+    def test_PerKeyInterval(self):
+        sched = scheduler.Scheduler(tolerance=3600)
+        now = time.time()
+
+        sched.add('fast', 10, delay=0)
+        sched.add('slow', 60, delay=0)
+
+        counts = { 'fast' : 0, 'slow' : 0 }
+
+        for step in range(0, 600):
+            for key in sched.popDue(now + step):
+                counts[key] += 1
+
+        self.assertEqual(counts['fast'], 60)
+        self.assertEqual(counts['slow'], 10)
+
+    #---------------------------------------------------------------------------
+    def test_NextDelay(self):
+        sched = scheduler.Scheduler()
+        now = time.time()
+
+        sched.add('key', 60, delay=30)
+
+        self.assertAlmostEqual(sched.getNextDelay(60, now), 30, places=1)
+        self.assertEqual(sched.getNextDelay(10, now), 10)
+        self.assertEqual(sched.getNextDelay(60, now + 100), 0)
+
+    #---------------------------------------------------------------------------
+    def test_RemovedKeyIsNotDue(self):
+        sched = scheduler.Scheduler()
+
+        sched.add('key', 60, delay=0)
+        sched.remove('key')
+
+        self.assertEqual(sched.popDue(time.time() + 1), [])
+        self.assertNotIn('key', sched)
+
+    #---------------------------------------------------------------------------
+    def test_Reschedule(self):
+        sched = scheduler.Scheduler()
+        now = time.time()
+
+        sched.add('key', 60, delay=30)
+        sched.reschedule('key', delay=0)
+
+        self.assertEqual(sched.popDue(now + 1), ['key'])
+        self.assertEqual(sched.popDue(now + 30), [])
+
+    #---------------------------------------------------------------------------
+    def test_SetInterval(self):
+        sched = scheduler.Scheduler()
+        now = time.time()
+
+        sched.add('key', 600, delay=500)
+        sched.setInterval('key', 60)
+
+        self.assertEqual(sched.getInterval('key'), 60)
+        self.assertEqual(sched.popDue(now + 61), ['key'])
+
+################################################################################
+class BackoffTest(unittest.TestCase):
+
+    #---------------------------------------------------------------------------
+    # a few failures are tolerated before the interval grows
+    def test_BelowThreshold(self):
+        for failures in range(3):
+            self.assertEqual(scheduler.getBackoffLevel(failures, 3, 60, 3600), 0)
+
+    #---------------------------------------------------------------------------
+    # the interval doubles with each failure past the threshold
+    def test_IntervalGrows(self):
+        levels = [ scheduler.getBackoffLevel(failures, 3, 60, 3600) for failures in range(3, 8) ]
+        self.assertEqual(levels, [ 1, 2, 3, 4, 5 ])
+
+    #---------------------------------------------------------------------------
+    # 60 << 5 = 1920 is the last interval within an hour
+    def test_IntervalCapped(self):
+        self.assertEqual(scheduler.getMaxBackoffLevel(60, 3600), 5)
+
+        for failures in (8, 20, 1000):
+            level = scheduler.getBackoffLevel(failures, 3, 60, 3600)
+
+            self.assertEqual(level, 5)
+            self.assertLessEqual(60 << level, 3600)
+
+    #---------------------------------------------------------------------------
+    # a successful check clears the failures and with them the backoff
+    def test_ResetOnSuccess(self):
+        self.assertEqual(scheduler.getBackoffLevel(6, 3, 60, 3600), 4)
+        self.assertEqual(scheduler.getBackoffLevel(0, 3, 60, 3600), 0)
+
+    #---------------------------------------------------------------------------
+    def test_BackoffDisabled(self):
+        self.assertEqual(scheduler.getBackoffLevel(10, 3, 60, 0), 0)
+        self.assertEqual(scheduler.getBackoffLevel(10, 3, 60, 60), 0)
+        self.assertEqual(scheduler.getBackoffLevel(10, 3, 0, 3600), 0)
+
+    #---------------------------------------------------------------------------
+    # a longer interval moves the next update out by the new interval
+    def test_UpdateInterval(self):
+        sched = scheduler.Scheduler()
+        now = time.time()
+
+        sched.add('key', 60, delay=0)
+
+        self.assertFalse(sched.updateInterval('key', 60))
+        self.assertEqual(sched.popDue(now + 1), [ 'key' ])
+
+        self.assertTrue(sched.updateInterval('key', 120))
+        self.assertEqual(sched.getInterval('key'), 120)
+
+        self.assertEqual(sched.popDue(now + 100), [])
+        self.assertEqual(sched.popDue(now + 121), [ 'key' ])
+
+        # the first check after the device is back returns to the base interval
+        self.assertTrue(sched.updateInterval('key', 60))
+        self.assertEqual(sched.getInterval('key'), 60)
+
+    #---------------------------------------------------------------------------
+    def test_UpdateUnknownKey(self):
+        sched = scheduler.Scheduler()
+        self.assertFalse(sched.updateInterval('key', 120))
+        self.assertNotIn('key', sched)
+
+################################################################################
+class SchedulerSpreadTest(unittest.TestCase):
+
+    #---------------------------------------------------------------------------
+    # keys added together should not all come due in the same second
+    def test_SpreadAcrossInterval(self):
+        sched = scheduler.Scheduler()
+        now = time.time()
+
+        for key in range(100):
+            sched.add(key, 60)
+
+        buckets = [ len(sched.popDue(now + second)) for second in range(61) ]
+
+        self.assertEqual(sum(buckets), 100)
+        self.assertLess(max(buckets), 20)
+
+################################################################################
+class SchedulerLatenessTest(unittest.TestCase):
+
+    #---------------------------------------------------------------------------
+    def test_LateIsReported(self):
+        sched = scheduler.Scheduler(tolerance=5)
+        now = time.time()
+
+        sched.add('key', 60, delay=0)
+
+        sched.popDue(now + 2)
+        self.assertEqual(sched.lateCount, 0)
+
+        sched.popDue(now + 70)
+        self.assertEqual(sched.lateCount, 1)
+
+    #---------------------------------------------------------------------------
+    # a missed interval should not cause a burst of catch-up updates
+    def test_NoCatchUpBurst(self):
+        sched = scheduler.Scheduler(tolerance=3600)
+        now = time.time()
+
+        sched.add('key', 10, delay=0)
+
+        self.assertEqual(sched.popDue(now + 100), ['key'])
+        self.assertEqual(sched.popDue(now + 100), [])
+        self.assertEqual(sched.popDue(now + 110), ['key'])
+
+    #---------------------------------------------------------------------------
+    # small delays keep the original cadence instead of drifting
+    def test_NoDrift(self):
+        sched = scheduler.Scheduler(tolerance=3600)
+        now = time.time()
+
+        sched.add('key', 10, delay=0)
+
+        self.assertEqual(sched.popDue(now + 3), ['key'])
+        self.assertEqual(sched.popDue(now + 10.1), ['key'])
+
+################################################################################
+class WarmupQueueTestBase(unittest.TestCase):
+
+    #---------------------------------------------------------------------------
+    def setUp(self):
+        self.lock = threading.Lock()
+        self.order = list()
+        self.running = 0
+        self.maxRunning = 0
+
+    #---------------------------------------------------------------------------
+    def _update(self, key, delay=0):
+        self.lock.acquire()
+        self.running += 1
+        self.maxRunning = max(self.maxRunning, self.running)
+        self.lock.release()
+
+        time.sleep(delay)
+
+        self.lock.acquire()
+        self.running -= 1
+        self.order.append(key)
+        self.lock.release()
+
+################################################################################
+class WarmupQueueTest(WarmupQueueTestBase):
+
+    #---------------------------------------------------------------------------
+    def test_NothingRunsUntilStarted(self):
+        queue = scheduler.WarmupQueue()
+        queue.add('key', 0, self._update, 'key')
+
+        time.sleep(0.1)
+
+        self.assertEqual(self.order, [])
+        self.assertTrue(queue.isPending('key'))
+
+        queue.start()
+        queue.join()
+
+        self.assertEqual(self.order, ['key'])
+        self.assertFalse(queue.isPending('key'))
+
+    #---------------------------------------------------------------------------
+    def test_PriorityOrder(self):
+        queue = scheduler.WarmupQueue(size=1)
+
+        queue.add('ssh', 2, self._update, 'ssh')
+        queue.add('ping', 1, self._update, 'ping')
+        queue.add('local', 0, self._update, 'local')
+        queue.add('http', 2, self._update, 'http')
+
+        queue.start()
+        queue.join()
+
+        self.assertEqual(self.order, ['local', 'ping', 'ssh', 'http'])
+
+    #---------------------------------------------------------------------------
+    def test_BoundedConcurrency(self):
+        queue = scheduler.WarmupQueue(size=3)
+
+        for idx in range(12):
+            queue.add(idx, 0, self._update, idx, 0.02)
+
+        queue.start()
+        queue.join()
+
+        self.assertEqual(len(self.order), 12)
+        self.assertLessEqual(self.maxRunning, 3)
+
+    #---------------------------------------------------------------------------
+    def test_RemovedKey(self):
+        queue = scheduler.WarmupQueue()
+
+        queue.add('keep', 0, self._update, 'keep')
+        queue.add('drop', 0, self._update, 'drop')
+        queue.remove('drop')
+
+        queue.start()
+        queue.join()
+
+        self.assertEqual(self.order, ['keep'])
+
+    #---------------------------------------------------------------------------
+    # keys added after the start run right away
+    def test_AddAfterStart(self):
+        queue = scheduler.WarmupQueue()
+        queue.start()
+
+        queue.add('late', 0, self._update, 'late')
+        queue.join()
+
+        self.assertEqual(self.order, ['late'])
+        self.assertEqual(queue.getStats()['finished'], 1)
+
+################################################################################
+# a restart with many devices, a few of them slow to check
+class WarmupQueueBenchmark(WarmupQueueTestBase):
+
+    cheap = 1000
+    slow = 8
+
+    #---------------------------------------------------------------------------
+    def test_StartupWithManyDevices(self):
+        queue = scheduler.WarmupQueue(size=4)
+
+        startTime = time.time()
+
+        for idx in range(self.slow):
+            queue.add(('slow', idx), 2, self._update, ('slow', idx), 0.1)
+
+        for idx in range(self.cheap):
+            queue.add(('cheap', idx), 0, self._update, ('cheap', idx))
+
+        addTime = time.time() - startTime
+
+        queue.start()
+        queue.join()
+
+        stats = queue.getStats()
+
+        logging.getLogger('test_scheduler').debug(
+            '%d devices queued in %.3f sec; first state in %.3f sec avg, %.3f sec max',
+            stats['finished'], addTime, stats['avgWait'], stats['maxWait']
+        )
+
+        self.assertEqual(stats['finished'], self.cheap + self.slow)
+        self.assertLess(addTime, 0.5)
+
+        # the slow devices are the last to get a state
+        self.assertEqual(set(self.order[-self.slow:]),
+                         set([ ('slow', idx) for idx in range(self.slow) ]))
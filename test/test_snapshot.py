@@ -0,0 +1,87 @@
+#!/usr/bin/env python2.7
+
+import logging
+import unittest
+import tempfile
+import shutil
+import os
+
+import snapshot
+
+# keep logging output to a minumim for testing
+logging.basicConfig(level=logging.ERROR)
+
+################################################################################
+class SnapshotTest(unittest.TestCase):
+
+    #---------------------------------------------------------------------------
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'netdev.snapshot')
+
+    #---------------------------------------------------------------------------
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    #---------------------------------------------------------------------------
+    def test_SaveAndLoad(self):
+        data = {
+            'arp' : [ (0x302a43b2012f, 1500000000.5) ],
+            'devices' : { '1234' : { 'lastCheck' : 1500000000.5, 'lastResult' : True } }
+        }
+
+        self.assertTrue(snapshot.save(self.path, data))
+
+        loaded = snapshot.load(self.path)
+
+        self.assertEqual(loaded['arp'], [ [ 0x302a43b2012f, 1500000000.5 ] ])
+        self.assertEqual(loaded['devices'], data['devices'])
+        self.assertEqual(loaded['version'], snapshot.VERSION)
+
+        # only the snapshot is left behind
+        self.assertEqual(os.listdir(self.tmpdir), [ 'netdev.snapshot' ])
+
+    #---------------------------------------------------------------------------
+    def test_MissingFile(self):
+        self.assertIsNone(snapshot.load(self.path))
+
+    #---------------------------------------------------------------------------
+    def test_CorruptFile(self):
+        with open(self.path, 'wb') as fp:
+            fp.write('not a snapshot')
+
+        self.assertIsNone(snapshot.load(self.path))
+
+    #---------------------------------------------------------------------------
+    def test_OtherVersion(self):
+        snapshot.save(self.path, { 'arp' : list() })
+
+        version = snapshot.VERSION
+        snapshot.VERSION = version + 1
+
+        try:
+            self.assertIsNone(snapshot.load(self.path))
+        finally:
+            snapshot.VERSION = version
+
+    #---------------------------------------------------------------------------
+    def test_MissingFolder(self):
+        path = os.path.join(self.tmpdir, 'missing', 'netdev.snapshot')
+        self.assertFalse(snapshot.save(path, dict()))
+
+    #---------------------------------------------------------------------------
+    # a few thousand devices should still make a small file
+    def test_CompactSize(self):
+        data = {
+            'arp' : [ (0x020000000000 + idx, 1500000000.0 + idx) for idx in range(5000) ],
+            'devices' : dict([ (str(idx), { 'lastCheck' : 1500000000.0 + idx, 'lastResult' : True,
+                                            'failures' : 0, 'backoffLevel' : 0 })
+                               for idx in range(5000) ])
+        }
+
+        snapshot.save(self.path, data)
+
+        size = os.path.getsize(self.path)
+        logging.getLogger('test_snapshot').debug('10000 entries in %d bytes', size)
+
+        self.assertLess(size, 200 * 1024)
@@ -0,0 +1,132 @@
+#!/usr/bin/env python2.7
+
+import logging
+import unittest
+
+import statediff
+
+# keep logging output to a minumim for testing
+logging.basicConfig(level=logging.ERROR)
+
+################################################################################
+class ChangedStatesTest(unittest.TestCase):
+
+    #---------------------------------------------------------------------------
+    def setUp(self):
+        self.pushed = { 'active' : True, 'status' : 'Active', 'lastActiveAt' : 'Mon 09:00' }
+
+    #---------------------------------------------------------------------------
+    def test_UnchangedStates(self):
+        states = { 'active' : True, 'status' : 'Active' }
+        self.assertEqual(statediff.getChangedStates(self.pushed, states), [])
+
+    #---------------------------------------------------------------------------
+    def test_ChangedStates(self):
+        states = { 'active' : False, 'status' : 'Inactive' }
+        changed = statediff.getChangedStates(self.pushed, states)
+
+        self.assertEqual(sorted(changed), sorted([
+            { 'key' : 'active', 'value' : False },
+            { 'key' : 'status', 'value' : 'Inactive' }
+        ]))
+
+    #---------------------------------------------------------------------------
+    # only the states that changed are sent
+    def test_PartialChange(self):
+        states = { 'active' : True, 'status' : 'Timed Out' }
+        changed = statediff.getChangedStates(self.pushed, states)
+
+        self.assertEqual(changed, [ { 'key' : 'status', 'value' : 'Timed Out' } ])
+
+    #---------------------------------------------------------------------------
+    def test_NewState(self):
+        changed = statediff.getChangedStates(self.pushed, { 'uptime' : 100.0 })
+        self.assertEqual(changed, [ { 'key' : 'uptime', 'value' : 100.0 } ])
+
+################################################################################
+class StateToleranceTest(unittest.TestCase):
+
+    tolerances = { 'uptime' : 0.01, 'rttMedian' : 0.1 }
+
+    #---------------------------------------------------------------------------
+    def setUp(self):
+        self.pushed = { 'uptime' : 99.0, 'rttMedian' : 2.5, 'flapCount' : 3 }
+
+    #---------------------------------------------------------------------------
+    # small changes in statistics are held back
+    def test_SmallChange(self):
+        states = { 'uptime' : 98.9, 'rttMedian' : 2.61, 'flapCount' : 3 }
+        self.assertEqual(statediff.getChangedStates(self.pushed, states, self.tolerances), [])
+
+    #---------------------------------------------------------------------------
+    def test_LargeChange(self):
+        states = { 'uptime' : 97.5, 'rttMedian' : 2.61, 'flapCount' : 4 }
+        changed = statediff.getChangedStates(self.pushed, states, self.tolerances)
+
+        self.assertEqual(sorted(changed), sorted([
+            { 'key' : 'uptime', 'value' : 97.5 },
+            { 'key' : 'flapCount', 'value' : 4 }
+        ]))
+
+    #---------------------------------------------------------------------------
+    # the heartbeat sends statistics even when they barely moved
+    def test_ForcedChange(self):
+        states = { 'uptime' : 98.9, 'rttMedian' : 2.5 }
+        changed = statediff.getChangedStates(self.pushed, states, self.tolerances, force=True)
+
+        self.assertEqual(changed, [ { 'key' : 'uptime', 'value' : 98.9 } ])
+
+    #---------------------------------------------------------------------------
+    # a statistic with no value yet is always sent
+    def test_FirstValue(self):
+        changed = statediff.getChangedStates(dict(), { 'rttMedian' : 2.5 }, self.tolerances)
+        self.assertEqual(changed, [ { 'key' : 'rttMedian', 'value' : 2.5 } ])
+
+    #---------------------------------------------------------------------------
+    # slow drift is measured from the value last sent, so it is sent eventually
+    def test_SlowDrift(self):
+        pushed = dict(self.pushed)
+        pushes = 0
+
+        for idx in range(1, 21):
+            states = { 'uptime' : 99.0 - idx * 0.2 }
+            changed = statediff.getChangedStates(pushed, states, self.tolerances)
+
+            pushed.update([ (item['key'], item['value']) for item in changed ])
+            pushes += len(changed)
+
+        self.assertGreater(pushes, 0)
+        self.assertLess(pushes, 5)
+        self.assertLess(abs(pushed['uptime'] - 95.0), 1.0)
+
+################################################################################
+class HeartbeatTest(unittest.TestCase):
+
+    #---------------------------------------------------------------------------
+    def test_BecameActive(self):
+        self.assertTrue(statediff.isHeartbeatDue(False, 1000, 300, now=1010))
+        self.assertTrue(statediff.isHeartbeatDue(None, 1000, 300, now=1010))
+
+    #---------------------------------------------------------------------------
+    def test_StillActive(self):
+        self.assertFalse(statediff.isHeartbeatDue(True, 1000, 300, now=1010))
+        self.assertTrue(statediff.isHeartbeatDue(True, 1000, 300, now=1300))
+
+    #---------------------------------------------------------------------------
+    # an active device with no other changes is only pushed at the heartbeat
+    def test_HeartbeatForcesPush(self):
+        pushed = { 'active' : True, 'status' : 'Active', 'lastActiveAt' : 'Mon 09:00' }
+        lastHeartbeat = 1000
+        pushes = list()
+
+        for now, stamp in ((1100, 'Mon 09:01'), (1200, 'Mon 09:03'), (1300, 'Mon 09:05')):
+            states = { 'active' : True, 'status' : 'Active' }
+
+            if statediff.isHeartbeatDue(pushed['active'], lastHeartbeat, 300, now):
+                states['lastActiveAt'] = stamp
+                lastHeartbeat = now
+
+            pushes.append(statediff.getChangedStates(pushed, states))
+            pushed.update(states)
+
+        self.assertEqual(pushes, [ [], [], [ { 'key' : 'lastActiveAt', 'value' : 'Mon 09:05' } ] ])
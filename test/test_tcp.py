@@ -0,0 +1,169 @@
+#!/usr/bin/env python2.7
+
+import logging
+import unittest
+import socket
+import time
+
+import tcp
+import resolver
+
+# keep logging output to a minumim for testing
+logging.basicConfig(level=logging.ERROR)
+
+################################################################################
+class TcpProbeTestBase(unittest.TestCase):
+
+    #---------------------------------------------------------------------------
+    def setUp(self):
+        self.sockets = list()
+
+    #---------------------------------------------------------------------------
+    def tearDown(self):
+        for sock in self.sockets: sock.close()
+
+    #---------------------------------------------------------------------------
+    def _openPort(self, backlog=5):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(('127.0.0.1', 0))
+        sock.listen(backlog)
+
+        self.sockets.append(sock)
+
+        return sock.getsockname()[1]
+
+    #---------------------------------------------------------------------------
+    def _closedPort(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+
+        return port
+
+    #---------------------------------------------------------------------------
+    # a listener that never accepts; once the backlog is full, new connections
+    # hang until they time out (any 127.x.x.x address reaches it on linux)
+    def _stalledPort(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(('0.0.0.0', 0))
+        sock.listen(0)
+
+        self.sockets.append(sock)
+        port = sock.getsockname()[1]
+
+        for idx in range(3):
+            filler = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            filler.setblocking(0)
+            filler.connect_ex(('127.0.0.1', port))
+            self.sockets.append(filler)
+
+        time.sleep(0.1)
+
+        return port
+
+################################################################################
+class BasicTcpProbeTest(TcpProbeTestBase):
+
+    #---------------------------------------------------------------------------
+    def test_OpenPort(self):
+        port = self._openPort()
+        probe = tcp.TcpProbe(timeout=1)
+
+        self.assertTrue(probe.isReachable('127.0.0.1', port))
+
+    #---------------------------------------------------------------------------
+    def test_ClosedPort(self):
+        port = self._closedPort()
+        probe = tcp.TcpProbe(timeout=1)
+
+        self.assertFalse(probe.isReachable('127.0.0.1', port))
+
+    #---------------------------------------------------------------------------
+    def test_UnknownHost(self):
+        probe = tcp.TcpProbe(timeout=1)
+        self.assertFalse(probe.isReachable('host.invalid', 80))
+
+    #---------------------------------------------------------------------------
+    # names are resolved to IPv4 addresses even when IPv6 is listed first
+    def test_ResolvesIPv4(self):
+        port = self._openPort()
+
+        def lookup(host, family):
+            results = [ (socket.AF_INET, '127.0.0.1') ]
+
+            if family == socket.AF_UNSPEC:
+                results.insert(0, (socket.AF_INET6, '::1'))
+
+            return results
+
+        probe = tcp.TcpProbe(timeout=1, resolver=resolver.Resolver(lookup=lookup))
+
+        self.assertTrue(probe.isReachable('dual.example', port))
+
+    #---------------------------------------------------------------------------
+    def test_MixedSweep(self):
+        openPorts = [ self._openPort() for idx in range(10) ]
+        closedPorts = [ self._closedPort() for idx in range(10) ]
+
+        targets = [ ('127.0.0.1', port) for port in openPorts + closedPorts ]
+
+        probe = tcp.TcpProbe(timeout=1)
+        results = probe.sweep(targets)
+
+        self.assertEqual(len(results), 20)
+
+        for port in openPorts:
+            self.assertTrue(results[('127.0.0.1', port)])
+
+        for port in closedPorts:
+            self.assertFalse(results[('127.0.0.1', port)])
+
+    #---------------------------------------------------------------------------
+    def test_SweepResultsAreConsumed(self):
+        port = self._openPort()
+        probe = tcp.TcpProbe(timeout=1)
+
+        probe.sweep([ ('127.0.0.1', port) ])
+        self.assertIn(('127.0.0.1', port), probe.results)
+
+        self.assertTrue(probe.isReachable('127.0.0.1', port))
+        self.assertNotIn(('127.0.0.1', port), probe.results)
+
+    #---------------------------------------------------------------------------
+    def test_StalledTimeout(self):
+        port = self._stalledPort()
+        probe = tcp.TcpProbe(timeout=0.5)
+
+        startTime = time.time()
+        self.assertFalse(probe.isReachable('127.0.0.2', port))
+
+        self.assertLess(time.time() - startTime, 1.5)
+
+################################################################################
+class TcpSweepScalingTest(TcpProbeTestBase):
+
+    #---------------------------------------------------------------------------
+    def _timeSweep(self, port, count):
+        targets = [ ('127.0.%d.%d' % (idx // 250, idx % 250 + 2), port) for idx in range(count) ]
+        probe = tcp.TcpProbe(timeout=0.5)
+
+        startTime = time.time()
+        results = probe.sweep(targets)
+        elapsed = time.time() - startTime
+
+        self.assertEqual(len(results), count)
+        self.assertNotIn(True, results.values())
+
+        return elapsed
+
+    #---------------------------------------------------------------------------
+    # sweep time should track the timeout, not the number of targets
+    def test_FlatSweepTime(self):
+        port = self._stalledPort()
+
+        small = self._timeSweep(port, 10)
+        large = self._timeSweep(port, 200)
+
+        self.assertLess(large, small * 2 + 0.5)
+        self.assertLess(large, 200 * 0.5 / 10)
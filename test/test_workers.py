@@ -0,0 +1,157 @@
+#!/usr/bin/env python2.7
+
+import logging
+import unittest
+import threading
+import time
+
+import workers
+
+# keep logging output to a minumim for testing
+logging.basicConfig(level=logging.ERROR)
+
+################################################################################
+class WorkerPoolTest(unittest.TestCase):
+
+    #---------------------------------------------------------------------------
+    def test_RunsTasks(self):
+        pool = workers.WorkerPool(size=2)
+        results = list()
+
+        for idx in range(10):
+            pool.submit(idx, results.append, idx)
+
+        pool.join()
+
+        self.assertEqual(sorted(results), list(range(10)))
+
+    #---------------------------------------------------------------------------
+    # tasks with the same key run in order and never at the same time
+    def test_KeyOrdering(self):
+        pool = workers.WorkerPool(size=4)
+        lock = threading.Lock()
+        results = list()
+        running = set()
+        overlaps = list()
+
+        def task(key, idx):
+            lock.acquire()
+            if key in running: overlaps.append(key)
+            running.add(key)
+            lock.release()
+
+            time.sleep(0.01)
+
+            lock.acquire()
+            running.discard(key)
+            results.append((key, idx))
+            lock.release()
+
+        for idx in range(5):
+            pool.submit('a', task, 'a', idx)
+            pool.submit('b', task, 'b', idx)
+
+        pool.join()
+
+        self.assertEqual(overlaps, [])
+        self.assertEqual([ idx for key, idx in results if key == 'a' ], list(range(5)))
+        self.assertEqual([ idx for key, idx in results if key == 'b' ], list(range(5)))
+
+    #---------------------------------------------------------------------------
+    def test_IsBusy(self):
+        pool = workers.WorkerPool(size=1)
+        release = threading.Event()
+
+        pool.submit('a', release.wait, 5)
+
+        self.assertTrue(pool.isBusy('a'))
+        self.assertFalse(pool.isBusy('b'))
+
+        release.set()
+        pool.join()
+
+        self.assertFalse(pool.isBusy('a'))
+
+    #---------------------------------------------------------------------------
+    def test_FailedTask(self):
+        pool = workers.WorkerPool(size=1)
+        results = list()
+
+        pool.submit('a', int, 'not a number')
+        pool.submit('a', results.append, 1)
+        pool.join()
+
+        self.assertEqual(results, [ 1 ])
+
+    #---------------------------------------------------------------------------
+    def test_ResizeDown(self):
+        pool = workers.WorkerPool(size=4)
+
+        for idx in range(4):
+            pool.submit(idx, time.sleep, 0.01)
+
+        pool.join()
+
+        pool.resize(1)
+        time.sleep(0.1)
+
+        self.assertEqual(len([ w for w in pool.workers if w.is_alive() ]), 1)
+
+        # the remaining worker still runs tasks
+        results = list()
+        pool.submit('a', results.append, 1)
+        pool.join()
+
+        self.assertEqual(results, [ 1 ])
+
+    #---------------------------------------------------------------------------
+    # tasks that are already waiting get the new workers right away
+    def test_ResizeUp(self):
+        pool = workers.WorkerPool(size=1)
+        release = threading.Event()
+        started = list()
+
+        def task(key):
+            started.append(key)
+            release.wait(5)
+
+        pool.submit('a', task, 'a')
+        pool.submit('b', task, 'b')
+        time.sleep(0.1)
+
+        self.assertEqual(started, [ 'a' ])
+
+        pool.resize(2)
+        time.sleep(0.1)
+
+        self.assertEqual(sorted(started), [ 'a', 'b' ])
+
+        release.set()
+        pool.join()
+
+    #---------------------------------------------------------------------------
+    # submitting while another thread waits in join() must still wake a worker
+    def test_SubmitDuringJoin(self):
+        pool = workers.WorkerPool(size=2)
+        first = threading.Event()
+        done = threading.Event()
+
+        # the first task holds a worker until the last one has run
+        pool.submit('a', done.wait, 5)
+        pool.submit('b', first.wait, 5)
+
+        joiner = threading.Thread(target=pool.join)
+        joiner.daemon = True
+        joiner.start()
+
+        # the second worker goes idle after the joiner has started waiting
+        time.sleep(0.1)
+        first.set()
+        time.sleep(0.1)
+
+        startTime = time.time()
+        pool.submit('c', done.set)
+        joiner.join(5)
+
+        self.assertFalse(joiner.is_alive())
+        self.assertLess(time.time() - startTime, 1)